@@ -1,26 +1,36 @@
 import argparse
-from os import cpu_count, makedirs, path
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count, environ, makedirs, path
 import sys
 from timeit import default_timer as timer
 
 from utils.io import (
     acquire_lock,
     read_config,
+    read_upload_state_log,
     write_upload_state_to_log,
 )
 from utils.upload import (
+    BIG_HTTP_BUFFER_SIZE,
     check_aws_access,
     check_buckets_exist,
+    collect_upload_results,
+    get_multipart_upload_state,
+    get_pool_connections,
+    get_s3_client,
+    load_multipart_upload_state,
     multi_core_upload,
+    set_http_send_buffer_size,
+    submit_upload,
 )
+from utils.upload_async import async_upload, check_async_available
 from utils.utils import (
     check_is_sequencing_run_dir,
     check_termination_file_exists,
     get_runs_to_upload,
     get_sequencing_file_list,
     filter_uploaded_files,
-    split_file_list_by_cores,
+    list_monitored_directories,
     verify_config,
 )
 from utils.log import get_logger, set_file_handler
@@ -100,8 +110,9 @@ def parse_args() -> argparse.Namespace:
         type=int,
         default=cpu_count(),
         help=(
-            "Number of CPU cores to split total files to upload across, will "
-            "default to using all available"
+            "Number of CPU cores available for uploading, the total threads"
+            " used will be cores * threads. Will default to using all"
+            " available"
         ),
     )
     upload_parser.add_argument(
@@ -113,6 +124,26 @@ def parse_args() -> argparse.Namespace:
             "(default: 8)"
         ),
     )
+    upload_parser.add_argument(
+        "--async",
+        dest="async_upload",
+        default=False,
+        action="store_true",
+        help=(
+            "Upload from a single asyncio event loop instead of a pool of"
+            " threads, suited to runs of many small files. Requires"
+            " aiobotocore to be installed"
+        ),
+    )
+    upload_parser.add_argument(
+        "--max_inflight",
+        type=int,
+        default=512,
+        help=(
+            "Maximum number of concurrent uploads when using --async "
+            "(default: 512)"
+        ),
+    )
 
     return parser.parse_args()
 
@@ -126,9 +157,10 @@ def upload_single_run(args) -> None:
     args : argparse.NameSpace
         parsed command line arguments
     """
-    check_aws_access()
-    check_buckets_exist(buckets=[args.bucket])
+    if args.async_upload:
+        check_async_available()
 
+    # check the directory first since this needs no calls to AWS
     if not args.skip_check:
         log.info(
             "Checking if the provided directory is a complete sequencing run"
@@ -142,26 +174,52 @@ def upload_single_run(args) -> None:
                 " again.",
                 args.local_path,
             )
-            exit()
+            sys.exit(2)
+
+    # create the S3 client shared by the AWS checks and uploading, async
+    # uploads use their own client so the checks use the default client
+    s3_client = None
 
-    files = get_sequencing_file_list(args.local_path)
-    files = split_file_list_by_cores(files=files, n=args.cores)
+    if not args.async_upload:
+        s3_client = get_s3_client(
+            max_pool_connections=get_pool_connections(
+                args.cores * args.threads
+            )
+        )
+
+    check_aws_access()
+    check_buckets_exist(buckets=[args.bucket])
+
+    # async uploads are not ordered by size, so no need to sort the files
+    files = get_sequencing_file_list(
+        args.local_path, sort_by_size=not args.async_upload
+    )
 
     # pass through the parent of the specified directory to upload
     # to ensure we upload into the actual run directory
-    parent_path = Path(args.local_path).parent
+    parent_path = path.dirname(path.normpath(args.local_path))
 
     # simple timer of upload
     start = timer()
 
-    multi_core_upload(
-        files=files,
-        bucket=args.bucket,
-        remote_path=args.remote_path,
-        cores=args.cores,
-        threads=args.threads,
-        parent_path=parent_path,
-    )
+    if args.async_upload:
+        async_upload(
+            files=files,
+            bucket=args.bucket,
+            remote_path=args.remote_path,
+            parent_path=parent_path,
+            max_inflight=args.max_inflight,
+        )
+    else:
+        multi_core_upload(
+            files=files,
+            bucket=args.bucket,
+            remote_path=args.remote_path,
+            cores=args.cores,
+            threads=args.threads,
+            parent_path=parent_path,
+            s3_client=s3_client,
+        )
 
     end = timer()
     total = end - start
@@ -173,6 +231,140 @@ def upload_single_run(args) -> None:
     )
 
 
+def _get_run_files_to_upload(
+    run_config, idx, total, sort_by_size=True
+) -> list:
+    """
+    Get the files of a run to upload, excluding any already uploaded in a
+    previous partial upload. The start time and full list of files of the
+    run are set in the run config for writing the upload state log.
+
+    Parameters
+    ----------
+    run_config : dict
+        config of the run to upload
+    idx : int
+        position of the run in the runs to upload
+    total : int
+        total number of runs to upload
+    sort_by_size : bool
+        if to sort the files of the run by their size
+
+    Returns
+    -------
+    list
+        files of the run to upload
+    """
+    log.info(
+        "Queuing run %s for upload [%s/%s]", run_config["run_id"], idx, total
+    )
+
+    # simple timer to log total upload time
+    run_config["start"] = timer()
+
+    all_run_files = get_sequencing_file_list(
+        seq_dir=run_config["run_dir"],
+        exclude_patterns=run_config.get("exclude_patterns"),
+        sort_by_size=sort_by_size,
+    )
+
+    files_to_upload = all_run_files
+
+    if run_config.get("uploaded_files"):
+        # files we stored from a previous partial upload to not reupload
+        files_to_upload = filter_uploaded_files(
+            local_files=files_to_upload,
+            uploaded_files=run_config.get("uploaded_files"),
+        )
+
+    run_config["all_run_files"] = all_run_files
+
+    return files_to_upload
+
+
+def _write_run_upload_state(
+    run_config, uploaded_files, failed_upload, uploads_dir
+) -> dict:
+    """
+    Write the upload state of a run to its log file and log the time taken
+    to upload
+
+    Parameters
+    ----------
+    run_config : dict
+        config of the uploaded run
+    uploaded_files : dict
+        mapping of local file to ETag ID of successfully uploaded files
+    failed_upload : list
+        list of files that failed to upload
+    uploads_dir : str
+        directory to write upload log to
+
+    Returns
+    -------
+    dict
+        all log data for the run
+    """
+    run_log_file = path.join(
+        uploads_dir, f"{run_config['run_id']}.upload.log.json"
+    )
+
+    log_data = write_upload_state_to_log(
+        run_id=run_config["run_id"],
+        run_path=run_config["run_dir"],
+        log_file=run_log_file,
+        local_files=run_config["all_run_files"],
+        uploaded_files=uploaded_files,
+        failed_files=failed_upload,
+        multipart_uploads=get_multipart_upload_state(
+            run_config["all_run_files"]
+        ),
+    )
+
+    upload_state = "Fully" if log_data["completed"] else "Partially"
+
+    total = timer() - run_config["start"]
+
+    log.info(
+        "%s uploaded %s in %s",
+        upload_state,
+        run_config["run_id"],
+        f"{int(total // 60)}m {int(total % 60)}s",
+    )
+
+    return log_data
+
+
+def _post_slack_messages(messages) -> None:
+    """
+    Post the given messages to their Slack channels concurrently, waiting
+    for all to be posted
+
+    Parameters
+    ----------
+    messages : list
+        list of tuples of webhook URL and message to post to it
+
+    Raises
+    ------
+    Exception
+        Raised from posting any message, as when posting synchronously
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        concurrent_jobs = []
+
+        for url, message in messages:
+            log.debug("Sending upload message to Slack channel %s", url)
+            concurrent_jobs.append(
+                executor.submit(slack.post_message, url=url, message=message)
+            )
+
+    # errors in the request are logged by post_message, any other error
+    # is raised here rather than being discarded with the future
+    for future in concurrent_jobs:
+        future.result()
+
+
 def monitor_directories_for_upload(config, dry_run) -> None:
     """
     Monitor specified directories for complete sequencing runs to upload
@@ -200,35 +392,71 @@ def monitor_directories_for_upload(config, dry_run) -> None:
             " no Slack notifications will be sent"
         )
 
+    if config.get("upload_mode") == "async":
+        check_async_available()
+
+    cores = config.get("max_cores", cpu_count())
+    threads = config.get("max_threads", 4)
+
+    # create the S3 client shared by the AWS checks and uploading, async
+    # uploads use their own client so the checks use the default client
+    s3_client = None
+
+    if config.get("upload_mode") != "async":
+        s3_client = get_s3_client(
+            max_pool_connections=get_pool_connections(cores * threads)
+        )
+
     check_aws_access(slack_alert_webhook=alert_url)
     check_buckets_exist(
         buckets=set([x["bucket"] for x in config["monitor"]]),
         slack_alert_webhook=alert_url,
     )
-
-    cores = config.get("max_cores", cpu_count)
-    threads = config.get("max_threads", 4)
     log_dir = config.get("log_dir", "/var/log/s3_upload")
 
+    # per run upload logs go into subdirectory with stdout/stderr log
+    uploads_dir = path.join(log_dir, "uploads")
+
     to_upload = []
     partially_uploaded = []
 
+    # list each monitored directory once, even if monitored by more than
+    # one monitor config
+    sub_directories = list_monitored_directories(
+        [
+            x
+            for monitor_dir_config in config["monitor"]
+            for x in monitor_dir_config.get("monitored_directories")
+        ]
+    )
+
     # find all the runs to upload in the specified monitored directories
-    # and build a dict per run with config of where to upload
-    for monitor_dir_config in config["monitor"]:
-        completed_runs, incomplete_runs = get_runs_to_upload(
-            monitor_dir_config.get("monitored_directories"),
-            log_dir=log_dir,
-            sample_pattern=monitor_dir_config.get("sample_regex"),
-            max_age=config.get("max_age", 72),
+    # and build a dict per run with config of where to upload, each
+    # monitor config is searched concurrently and the results merged in
+    # order of the config
+    with ThreadPoolExecutor(max_workers=len(config["monitor"])) as executor:
+        all_runs = list(
+            executor.map(
+                lambda monitor_dir_config: get_runs_to_upload(
+                    monitor_dir_config.get("monitored_directories"),
+                    log_dir=log_dir,
+                    sample_pattern=monitor_dir_config.get("sample_regex"),
+                    max_age=config.get("max_age", 72),
+                    sub_directories=sub_directories,
+                ),
+                config["monitor"],
+            )
         )
 
+    for monitor_dir_config, (completed_runs, incomplete_runs) in zip(
+        config["monitor"], all_runs
+    ):
         for run_dir in completed_runs:
             to_upload.append(
                 {
                     "run_dir": run_dir,
-                    "run_id": Path(run_dir).name,
-                    "parent_path": Path(run_dir).parent,
+                    "run_id": path.basename(run_dir),
+                    "parent_path": path.dirname(run_dir),
                     "bucket": monitor_dir_config["bucket"],
                     "remote_path": monitor_dir_config["remote_path"],
                     "exclude_patterns": monitor_dir_config.get(
@@ -238,11 +466,20 @@ def monitor_directories_for_upload(config, dry_run) -> None:
             )
 
         for partial_run, uploaded_files in incomplete_runs.items():
+            run_id = path.basename(partial_run)
+
+            # load state of any multipart uploads of large files that did
+            # not complete to resume from their already uploaded parts
+            run_log = read_upload_state_log(
+                log_file=path.join(uploads_dir, f"{run_id}.upload.log.json")
+            )
+            load_multipart_upload_state(run_log.get("multipart_uploads", {}))
+
             partially_uploaded.append(
                 {
                     "run_dir": partial_run,
-                    "run_id": Path(partial_run).name,
-                    "parent_path": Path(partial_run).parent,
+                    "run_id": run_id,
+                    "parent_path": path.dirname(partial_run),
                     "bucket": monitor_dir_config["bucket"],
                     "remote_path": monitor_dir_config["remote_path"],
                     "uploaded_files": uploaded_files,
@@ -279,85 +516,102 @@ def monitor_directories_for_upload(config, dry_run) -> None:
         log.info("--dry_run specified, exiting now without uploading")
         sys.exit()
 
-    log.info("Beginning upload of %s runs", len(to_upload))
-
-    runs_successfully_uploaded = []
-    runs_failed_upload = []
-
-    for idx, run_config in enumerate(to_upload, 1):
-        # begin uploading of each sequencing run
-        log.info(
-            "Uploading run %s [%s/%s]",
-            run_config["run_id"],
-            idx,
-            len(to_upload),
-        )
+    total_runs = len(to_upload)
 
-        # simple timer to log total upload time
-        start = timer()
+    log.info("Beginning upload of %s runs", total_runs)
 
-        all_run_files = get_sequencing_file_list(
-            seq_dir=run_config["run_dir"],
-            exclude_patterns=run_config.get("exclude_patterns"),
-        )
+    makedirs(uploads_dir, exist_ok=True)
 
-        files_to_upload = all_run_files.copy()
+    runs_successfully_uploaded = []
+    runs_failed_upload = []
 
-        if run_config.get("uploaded_files"):
-            # files we stored from a previous partial upload to not reupload
-            files_to_upload = filter_uploaded_files(
-                local_files=files_to_upload,
-                uploaded_files=run_config.get("uploaded_files"),
+    if config.get("upload_mode") == "async":
+        # upload each run in turn from a single event loop, with many
+        # requests in flight at once in place of the pool of threads.
+        # The files of the next run are listed from a separate thread
+        # whilst the current run is uploading, to overlap walking the
+        # run directory on disk with uploading over the network
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # async uploads are not ordered by size, so no need to sort
+            next_run_files = executor.submit(
+                _get_run_files_to_upload,
+                to_upload[0],
+                idx=1,
+                total=total_runs,
+                sort_by_size=False,
             )
 
-        files_to_upload = split_file_list_by_cores(
-            files=files_to_upload, n=cores
-        )
-
-        # call the actual upload, any errors being raised that result in
-        # files not being uploaded should be returned and will result in
-        # upload state log storing the run as not complete, allowing for
-        # retries on uploading
-        uploaded_files, failed_upload = multi_core_upload(
-            files=files_to_upload,
-            bucket=run_config["bucket"],
-            remote_path=run_config["remote_path"],
-            cores=cores,
-            threads=threads,
-            parent_path=run_config["parent_path"],
-        )
-
-        # set output logs to go into subdirectory with stdout/stderr log
-        makedirs(path.join(log_dir, "uploads"), exist_ok=True)
-        run_log_file = path.join(
-            log_dir, f"uploads/{run_config['run_id']}.upload.log.json"
-        )
-
-        log_data = write_upload_state_to_log(
-            run_id=run_config["run_id"],
-            run_path=run_config["run_dir"],
-            log_file=run_log_file,
-            local_files=all_run_files,
-            uploaded_files=uploaded_files,
-            failed_files=failed_upload,
-        )
-
-        if log_data["completed"]:
-            upload_state = "Fully"
-            runs_successfully_uploaded.append(log_data["run_id"])
-        else:
-            upload_state = "Partially"
-            runs_failed_upload.append(log_data["run_id"])
-
-        end = timer()
-        total = end - start
-
-        log.info(
-            "%s uploaded %s in %s",
-            upload_state,
-            run_config["run_id"],
-            f"{int(total // 60)}m {int(total % 60)}s",
-        )
+            for idx, run_config in enumerate(to_upload, 1):
+                files_to_upload = next_run_files.result()
+
+                if idx < total_runs:
+                    next_run_files = executor.submit(
+                        _get_run_files_to_upload,
+                        to_upload[idx],
+                        idx=idx + 1,
+                        total=total_runs,
+                        sort_by_size=False,
+                    )
+
+                uploaded_files, failed_upload = async_upload(
+                    files=files_to_upload,
+                    bucket=run_config["bucket"],
+                    remote_path=run_config["remote_path"],
+                    parent_path=run_config["parent_path"],
+                    max_inflight=config.get("max_inflight", 512),
+                )
+
+                log_data = _write_run_upload_state(
+                    run_config,
+                    uploaded_files=uploaded_files,
+                    failed_upload=failed_upload,
+                    uploads_dir=uploads_dir,
+                )
+
+                if log_data["completed"]:
+                    runs_successfully_uploaded.append(log_data["run_id"])
+                else:
+                    runs_failed_upload.append(log_data["run_id"])
+    else:
+        # use a single pool of threads and S3 client shared across the
+        # upload of all runs, with files from every run being queued into
+        # the same pool to not spin up a new pool per run and to keep
+        # connections open
+        with ThreadPoolExecutor(max_workers=cores * threads) as executor:
+            for idx, run_config in enumerate(to_upload, 1):
+                files_to_upload = _get_run_files_to_upload(
+                    run_config, idx=idx, total=total_runs
+                )
+
+                run_config["concurrent_jobs"] = submit_upload(
+                    executor=executor,
+                    s3_client=s3_client,
+                    files=files_to_upload,
+                    bucket=run_config["bucket"],
+                    remote_path=run_config["remote_path"],
+                    parent_path=run_config["parent_path"],
+                )
+
+            for run_config in to_upload:
+                # wait on all files of the run to upload, any errors being
+                # raised that result in files not being uploaded should be
+                # returned and will result in upload state log storing the
+                # run as not complete, allowing for retries on uploading
+                uploaded_files, failed_upload = collect_upload_results(
+                    run_config["concurrent_jobs"]
+                )
+
+                log_data = _write_run_upload_state(
+                    run_config,
+                    uploaded_files=uploaded_files,
+                    failed_upload=failed_upload,
+                    uploads_dir=uploads_dir,
+                )
+
+                if log_data["completed"]:
+                    runs_successfully_uploaded.append(log_data["run_id"])
+                else:
+                    runs_failed_upload.append(log_data["run_id"])
 
     log.info(
         "Completed uploading all runs, %s successfully uploaded, %s failed"
@@ -366,22 +620,47 @@ def monitor_directories_for_upload(config, dry_run) -> None:
         len(runs_failed_upload),
     )
 
-    if runs_successfully_uploaded and log_url:
-        log.debug(
-            "Sending success upload message to Slack channel %s", log_url
+    messages = []
+
+    if (
+        runs_successfully_uploaded
+        and runs_failed_upload
+        and log_url
+        and log_url == alert_url
+    ):
+        # both go to the same channel => send as a single message
+        messages.append(
+            (
+                log_url,
+                slack.format_message(
+                    completed=runs_successfully_uploaded,
+                    failed=runs_failed_upload,
+                ),
+            )
         )
-        message = slack.format_message(completed=runs_successfully_uploaded)
-        slack.post_message(url=log_url, message=message)
+    else:
+        if runs_successfully_uploaded and log_url:
+            messages.append(
+                (
+                    log_url,
+                    slack.format_message(completed=runs_successfully_uploaded),
+                )
+            )
 
-    if runs_failed_upload and alert_url:
-        log.debug("Sending failed upload alert to Slack channel %s", alert_url)
-        message = slack.format_message(failed=runs_failed_upload)
-        slack.post_message(url=alert_url, message=message)
+        if runs_failed_upload and alert_url:
+            messages.append(
+                (alert_url, slack.format_message(failed=runs_failed_upload))
+            )
+
+    _post_slack_messages(messages)
 
 
 def main() -> None:
     args = parse_args()
 
+    if environ.get("S3_UPLOAD_BIG_HTTP_BUFFER") == "1":
+        set_http_send_buffer_size(BIG_HTTP_BUFFER_SIZE)
+
     if args.mode == "upload":
         upload_single_run(args)
     else:
@@ -389,13 +668,17 @@ def main() -> None:
         verify_config(config=config)
 
         log_dir = config.get("log_dir", "/var/log/s3_upload")
-        acquire_lock(lock_file=path.join(log_dir, "s3_upload.lock"))
+        # keep the file descriptor of the lock open until exiting
+        lock_fd = acquire_lock(lock_file=path.join(log_dir, "s3_upload.lock"))
 
         if config.get("log_level"):
             log.setLevel(config.get("log_level"))
 
         set_file_handler(log, log_dir=log_dir)
 
+        if config.get("http_send_buffer_bytes"):
+            set_http_send_buffer_size(config.get("http_send_buffer_bytes"))
+
         monitor_directories_for_upload(config=config, dry_run=args.dry_run)
 
 
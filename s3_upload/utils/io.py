@@ -3,13 +3,14 @@
 import atexit
 from datetime import datetime
 from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
-import json
 import os
 from pathlib import Path
 import re
 import sys
 from typing import Union
 
+import orjson
+
 from .log import get_logger
 
 log = get_logger("s3_upload")
@@ -26,6 +27,11 @@ def acquire_lock(lock_file="/var/log/s3_upload/s3_upload.lock") -> int:
     If a process is already a lock on the file the function just cleanly
     exits with a zero exit code and will retry on the next schedule.
 
+    The lock is released by the kernel when the file descriptor is closed,
+    including on the process exiting or crashing, so a stale lock can not
+    be left behind. The returned file descriptor must therefore be kept
+    open for the lifetime of the upload.
+
     Parameters
     ----------
     lock_file : str
@@ -36,18 +42,16 @@ def acquire_lock(lock_file="/var/log/s3_upload/s3_upload.lock") -> int:
     int
         file id of the lock file
     """
-    if os.path.exists(lock_file):
-        lock_fd = os.open(lock_file, flags=os.O_RDWR)
-    else:
-        # only set create and truncate modes if file does not already
-        # exist to preserve any contents
-        lock_fd = os.open(lock_file, flags=os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+    # do not truncate on opening to preserve the contents written by any
+    # other process currently holding the lock
+    lock_fd = os.open(lock_file, flags=os.O_RDWR | os.O_CREAT, mode=0o644)
 
     try:
         # LOCK_EX means that only one process can hold the lock
         # LOCK_NB means that the fcntl.flock() is not blocking
         # https://docs.python.org/3/library/fcntl.html#fcntl.flock
         flock(lock_fd, LOCK_EX | LOCK_NB)
+        os.ftruncate(lock_fd, 0)
         os.write(
             lock_fd,
             "file lock acquired from running upload at"
@@ -106,11 +110,13 @@ def read_config(config) -> dict:
         contents of config file
     """
     log.info("Loading config from %s", config)
-    with open(config, "r") as fh:
-        return json.load(fh)
+    with open(config, "rb") as fh:
+        return orjson.loads(fh.read())
 
 
-def read_samplesheet_from_run_directory(run_dir) -> Union[list, None]:
+def read_samplesheet_from_run_directory(
+    run_dir, files=None
+) -> Union[list, None]:
     """
     Finds samplesheet(s) in the given run directory and returns the
     contents as a list.
@@ -124,6 +130,8 @@ def read_samplesheet_from_run_directory(run_dir) -> Union[list, None]:
     ----------
     run_dir : str
         path to run directory to search
+    files : iterable
+        optional names of files in the run directory if already listed
 
     Returns
     -------
@@ -132,7 +140,9 @@ def read_samplesheet_from_run_directory(run_dir) -> Union[list, None]:
     """
     log.info("Searching for samplesheet in run directory: %s", run_dir)
 
-    files = os.listdir(run_dir)
+    if files is None:
+        files = os.listdir(run_dir)
+
     files = [
         re.search(".*sample[-_ ]?sheet.*.csv$", x, re.IGNORECASE)
         for x in files
@@ -186,8 +196,8 @@ def read_upload_state_log(log_file) -> dict:
     """
     log.debug("Reading upload state from log file: %s", log_file)
 
-    with open(log_file) as fh:
-        log_data = json.load(fh)
+    with open(log_file, "rb") as fh:
+        log_data = orjson.loads(fh.read())
 
     uploaded = (
         "finished upload" if log_data["completed"] else "incomplete upload"
@@ -208,15 +218,43 @@ def read_upload_state_log(log_file) -> dict:
     return log_data
 
 
+def get_completed_marker(log_file) -> str:
+    """
+    Get the path to the marker file written alongside the upload state
+    log of a run that has completed uploading
+
+    Parameters
+    ----------
+    log_file : str
+        path to upload state log file of the run
+
+    Returns
+    -------
+    str
+        path to marker file
+    """
+    return f"{log_file}.completed"
+
+
 def write_upload_state_to_log(
-    run_id, run_path, log_file, local_files, uploaded_files, failed_files
+    run_id,
+    run_path,
+    log_file,
+    local_files,
+    uploaded_files,
+    failed_files,
+    multipart_uploads=None,
 ) -> dict:
     """
     Write the log file for the run to log the state of what has been uploaded.
 
     If the uploaded files matches the local files with no failed uploads,
     the run is marked as complete uploaded. This is then used for future
-    monitoring to know not to attempt re-upload.
+    monitoring to know not to attempt re-upload. An empty marker file
+    (`{log_file}.completed`) is also written alongside the log on
+    completing to be able to check this without reading the full log,
+    and is removed whenever any files fail to upload so that a failed
+    re-upload of a run is resumed.
 
     Log file will have the following structure:
 
@@ -229,8 +267,14 @@ def write_upload_state_to_log(
         "total_failed_upload": 0,   -> total files failed to upload
         "failed_upload_files": [],  -> list of files previously failed upload
         "uploaded_files": {},       -> mapping of uploaded files to object ID
+        "multipart_uploads": {},    -> mapping of files part way through a
+                                       multipart upload to the upload ID
+                                       and uploaded parts, to resume from
     }
 
+    The log file is written to a temporary file and then moved into place
+    to not leave a truncated log file if interrupted whilst writing.
+
     Parameters
     ----------
     run_id : str
@@ -245,6 +289,9 @@ def write_upload_state_to_log(
         mapping of uploaded local file path to remote object ID
     failed_files : list
         list of files that failed to upload
+    multipart_uploads : dict
+        mapping of files with incomplete multipart uploads to the upload ID
+        and uploaded parts
 
     Returns
     -------
@@ -268,8 +315,8 @@ def write_upload_state_to_log(
         # log file already exists => continuing previous failed upload
         log.debug("log file already exists to update at %s", log_file)
 
-        with open(log_file, "r") as fh:
-            log_data = json.load(fh)
+        with open(log_file, "rb") as fh:
+            log_data = orjson.loads(fh.read())
     else:
         log_data = {
             "run_id": run_id,
@@ -285,10 +332,10 @@ def write_upload_state_to_log(
     log_data["total_uploaded_files"] += total_uploaded_files
     log_data["total_failed_upload"] = total_failed_upload
     log_data["failed_upload_files"] = failed_files
-    log_data["uploaded_files"] = {
-        **log_data["uploaded_files"],
-        **uploaded_files,
-    }
+    # update in place to not rebuild the mapping of all previously
+    # uploaded files of the run on every attempt
+    log_data["uploaded_files"].update(uploaded_files)
+    log_data["multipart_uploads"] = multipart_uploads or {}
 
     if (
         total_failed_upload == 0
@@ -299,8 +346,22 @@ def write_upload_state_to_log(
             " completed uploading"
         )
         log_data["completed"] = True
+    elif total_failed_upload:
+        log_data["completed"] = False
+
+    # orjson is used over json for upload logs since these can contain
+    # many thousands of files for a single run
+    with open(f"{log_file}.tmp", "wb") as fh:
+        fh.write(orjson.dumps(log_data, option=orjson.OPT_INDENT_2))
 
-    with open(log_file, "w") as fh:
-        json.dump(log_data, fh, indent=4)
+    os.replace(f"{log_file}.tmp", log_file)
+
+    if log_data["completed"]:
+        open(get_completed_marker(log_file), "w").close()
+    else:
+        try:
+            os.remove(get_completed_marker(log_file))
+        except FileNotFoundError:
+            pass
 
     return log_data
@@ -1,11 +1,14 @@
 """Functions to handle log streams"""
 
-from datetime import date, datetime, time, timedelta
-from glob import glob
+import atexit
+from datetime import date, timedelta
+from functools import lru_cache
 import logging
 from logging import FileHandler
+from logging.handlers import QueueHandler, QueueListener
 import os
 from pathlib import Path
+from queue import SimpleQueue
 import re
 import sys
 
@@ -14,6 +17,30 @@ FORMATTER = logging.Formatter(
     "%(asctime)s [%(module)s] %(levelname)s: %(message)s"
 )
 
+LOG_DATE_SUFFIX = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+# QueueListeners started from start_listener() and not yet stopped
+_RUNNING_LISTENERS = set()
+
+
+@lru_cache(maxsize=32)
+def _log_suffix(ordinal) -> str:
+    """
+    Get the date suffix of the log file for the given day, cached to
+    only format each day once
+
+    Parameters
+    ----------
+    ordinal : int
+        proleptic Gregorian ordinal of the day
+
+    Returns
+    -------
+    str
+        date formatted as %Y-%m-%d
+    """
+    return date.fromordinal(ordinal).strftime("%Y-%m-%d")
+
 
 def get_console_handler() -> logging.StreamHandler:
     console_handler = logging.StreamHandler(sys.stdout)
@@ -25,7 +52,15 @@ def set_file_handler(logger, log_dir) -> logging.Logger:
     """
     Set the file handler to redirect all logs to log file
     `s3_upload.log.{%Y-%m-%d}`
-    in the specified directory
+    in the specified directory.
+
+    Records are not written to the file by the logging thread, instead
+    a QueueHandler is attached to the logger which puts each record on
+    to a queue, and a QueueListener writes them to the file from a single
+    background thread. This stops upload threads from contending on the
+    lock of the file handler and waiting on writes to the log file. The
+    listener is attached to the handler as `listener` and is stopped on
+    exit to flush any remaining records.
 
     Parameters
     ----------
@@ -42,11 +77,11 @@ def set_file_handler(logger, log_dir) -> logging.Logger:
     check_write_permission_to_log_dir(log_dir)
 
     log_file = os.path.join(
-        log_dir, f"s3_upload.log.{datetime.now().strftime('%Y-%m-%d')}"
+        log_dir, f"s3_upload.log.{_log_suffix(date.today().toordinal())}"
     )
 
     existing_file_handler = [
-        x for x in logger.handlers if isinstance(x, FileHandler)
+        x for x in logger.handlers if isinstance(x, QueueHandler)
     ]
 
     if existing_file_handler and os.path.exists(log_file):
@@ -59,7 +94,15 @@ def set_file_handler(logger, log_dir) -> logging.Logger:
     file_handler = FileHandler(filename=log_file)
     file_handler.setFormatter(FORMATTER)
 
-    logger.addHandler(file_handler)
+    log_queue = SimpleQueue()
+    listener = QueueListener(log_queue, file_handler)
+    start_listener(listener)
+    atexit.register(stop_listener, listener=listener)
+
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.listener = listener
+
+    logger.addHandler(queue_handler)
 
     logger.info(
         "Initialised log FileHandler, setting log output to %s", log_file
@@ -70,6 +113,35 @@ def set_file_handler(logger, log_dir) -> logging.Logger:
     return logger
 
 
+def start_listener(listener) -> None:
+    """
+    Start the given QueueListener, tracking it as running to be able to
+    be stopped by stop_listener()
+
+    Parameters
+    ----------
+    listener : logging.handlers.QueueListener
+        listener to start
+    """
+    listener.start()
+    _RUNNING_LISTENERS.add(listener)
+
+
+def stop_listener(listener) -> None:
+    """
+    Stop the given QueueListener, writing out any records still in the
+    queue. Safe to call on an already stopped listener.
+
+    Parameters
+    ----------
+    listener : logging.handlers.QueueListener
+        listener to stop
+    """
+    if listener in _RUNNING_LISTENERS:
+        _RUNNING_LISTENERS.discard(listener)
+        listener.stop()
+
+
 def clear_old_logs(logger, log_dir, backup_count) -> None:
     """
     Ensures that at most `backup_count` log file backups are retained.
@@ -86,19 +158,23 @@ def clear_old_logs(logger, log_dir, backup_count) -> None:
         path to log directory
     backup_count : int
     """
-    oldest_backup_date = datetime.combine(
-        (date.today() - timedelta(days=backup_count)), time()
-    )
+    # dates in ISO format sort lexicographically in chronological order,
+    # allowing comparing the date suffixes as strings without parsing
+    oldest_backup_date = (
+        date.today() - timedelta(days=backup_count)
+    ).isoformat()
 
-    backup_files = [
-        (f, re.search(r"\d{4}-\d{2}-\d{2}$|$", f).group())
-        for f in glob(f"{log_dir}/s3_upload.log.*")
-    ]
-    old_backup_files = [
-        x[0]
-        for x in backup_files
-        if x[1] and datetime.strptime(x[1], "%Y-%m-%d") < oldest_backup_date
-    ]
+    old_backup_files = []
+
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            if not entry.name.startswith("s3_upload.log."):
+                continue
+
+            backup_date = LOG_DATE_SUFFIX.search(entry.name)
+
+            if backup_date and backup_date.group() < oldest_backup_date:
+                old_backup_files.append(entry.path)
 
     logger.debug(
         "%s old backup files to be removed: %s",
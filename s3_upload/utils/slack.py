@@ -1,7 +1,8 @@
 """Functions for posting Slack notifications"""
 
-import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .log import get_logger
 
@@ -9,6 +10,43 @@ from .log import get_logger
 log = get_logger("s3_upload")
 
 
+def _get_session() -> requests.Session:
+    """
+    Create the session used for posting all Slack messages, this reuses
+    the open connection between messages and retries on failing to
+    connect and rate limiting from Slack.
+
+    Only errors where Slack has not accepted the message are retried, as
+    retrying a POST that failed after being sent (i.e. read errors and
+    5xx responses) may post a duplicate message.
+
+    Returns
+    -------
+    requests.Session
+        session with retrying adapter mounted
+    """
+    retries = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=[429],
+        allowed_methods=["POST"],
+    )
+
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retries),
+    )
+
+    return session
+
+
+_SESSION = _get_session()
+
+
 def format_message(completed=None, failed=None) -> str:
     """
     Format Slack message to send to on completing upload
@@ -61,10 +99,9 @@ def post_message(url, message) -> None:
     """
     log.info("Posting message to Slack")
     try:
-        response = requests.post(
+        response = _SESSION.post(
             url=url,
-            data=json.dumps({"text": message}),
-            headers={"content-type": "application/json"},
+            json={"text": message},
             timeout=30,
         )
 
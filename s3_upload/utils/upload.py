@@ -1,19 +1,26 @@
 """Functions for handling uploading into S3"""
 
-from concurrent.futures import (
-    ProcessPoolExecutor,
-    ThreadPoolExecutor,
-    as_completed,
-)
-from os import environ, path
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache, partial
+from http.client import HTTPConnection
+from os import environ, path, pread
+import resource
 import sys
-from typing import Dict, List, Tuple
+import time
+from typing import Dict, List, Tuple, Union
 
 import boto3
-from boto3.s3.transfer import TransferConfig
+from botocore.client import BaseClient
 from botocore.config import Config
 from botocore import exceptions as s3_exceptions
+from urllib3.connection import HTTPConnection as Urllib3HTTPConnection
+from urllib3.connection import HTTPSConnection as Urllib3HTTPSConnection
+
+try:
+    from os import POSIX_FADV_SEQUENTIAL, posix_fadvise
+except ImportError:
+    # not available on macOS
+    posix_fadvise = None
 
 from .log import get_logger
 from .slack import post_message as post_slack_message
@@ -22,9 +29,105 @@ AWS_DEFAULT_PROFILE = environ.get("AWS_DEFAULT_PROFILE")
 AWS_SECRET_KEY = environ.get("AWS_SECRET_KEY")
 AWS_ACCESS_KEY = environ.get("AWS_ACCESS_KEY")
 
+# block size to send request bodies in for all uploads when opted into
+# with the environment variable S3_UPLOAD_BIG_HTTP_BUFFER=1
+BIG_HTTP_BUFFER_SIZE = 1024**2
+
+# single S3 client shared across all uploads, set from get_s3_client()
+_S3_CLIENT = None
+
+# files at or above this size are uploaded as multipart uploads with
+# their parts uploaded in parallel from their own threads, smaller files
+# are uploaded in a single request from the calling thread of the pool
+LARGE_FILE_THRESHOLD = 1024**3
+
+# minimum part size and number of parts uploaded concurrently across all
+# files for multipart uploads, S3 allows a maximum of 10,000 parts per
+# upload. Large parts keep the number of requests per file low, as the
+# time of each part upload is then dominated by transfer rather than
+# latency
+MULTIPART_CHUNKSIZE = 64 * 1024**2
+MULTIPART_CONCURRENCY = 8
+MAX_PARTS = 10000
+
+# pool shared by the multipart uploads of all files to upload their parts
+# from, this caps the parts in flight (and the part sized buffers read for
+# them) to MULTIPART_CONCURRENCY however many large files are uploaded at
+# once. No threads are started until the first part is submitted
+_PART_EXECUTOR = ThreadPoolExecutor(
+    max_workers=MULTIPART_CONCURRENCY, thread_name_prefix="s3_upload_part"
+)
+
+# number of attempts to upload each file before it is returned as failed,
+# and the errors on which the upload is retried. botocore retries failed
+# requests itself, but not connections dropped whilst sending the body
+UPLOAD_ATTEMPTS = 3
+RETRYABLE_UPLOAD_ERRORS = (
+    s3_exceptions.ClientError,
+    s3_exceptions.ConnectionError,
+    s3_exceptions.HTTPClientError,
+    ConnectionError,
+)
+
+# errors from uploading a file for which the file is returned as failed
+# to upload again on the next run, any other error is raised
+UPLOAD_ERRORS = RETRYABLE_UPLOAD_ERRORS + (OSError,)
+
+# number of completed files between logging the progress of uploading
+PROGRESS_LOG_INTERVAL = 1000
+
+# state of multipart uploads not yet completed, keyed by local file, to
+# be written to the upload state log of the run to allow resuming the
+# upload from the already uploaded parts
+_MULTIPART_UPLOADS = {}
+
 log = get_logger("s3_upload")
 
 
+def set_http_send_buffer_size(size) -> None:
+    """
+    Set the default block size used by HTTP connections for sending the
+    body of requests.
+
+    Both http.client and urllib3 (which botocore uses) default to sending
+    file bodies in small blocks (8KB and 16KB respectively), resulting in
+    many small socket send() calls per file, each of which has to
+    re-acquire the GIL when uploading from multiple threads. Increasing
+    this (i.e. to 1MB) can significantly increase the upload throughput
+    of each thread.
+
+    This patches the default `blocksize` argument of the connection
+    classes, therefore must be called before any connections are opened.
+    S3 requests are sent over HTTPS through botocore's AWSHTTPSConnection,
+    which subclasses the urllib3 HTTPSConnection. With urllib3 >= 2 this
+    has its own `blocksize` default and so is patched separately, with
+    urllib3 < 2 it is passed through to http.client.
+
+    Parameters
+    ----------
+    size : int
+        block size in bytes to send request bodies in
+    """
+    log.debug("Setting HTTP connection send buffer size to %s bytes", size)
+
+    for connection in [
+        HTTPConnection,
+        Urllib3HTTPConnection,
+        Urllib3HTTPSConnection,
+    ]:
+        init = connection.__init__
+        arg_names = init.__code__.co_varnames[: init.__code__.co_argcount]
+
+        if init.__kwdefaults__ and "blocksize" in init.__kwdefaults__:
+            # blocksize is a keyword only argument (urllib3 >= 2)
+            init.__kwdefaults__ = {**init.__kwdefaults__, "blocksize": size}
+        elif "blocksize" in arg_names:
+            # positional argument, defaults align to the last arguments
+            defaults = list(init.__defaults__)
+            defaults[arg_names.index("blocksize") - len(arg_names)] = size
+            init.__defaults__ = tuple(defaults)
+
+
 def check_aws_access(slack_alert_webhook=None) -> List[dict]:
     """
     Check authentication with AWS S3 with stored credentials by checking
@@ -92,15 +195,7 @@ def check_aws_access(slack_alert_webhook=None) -> List[dict]:
         sys.exit(error_message)
 
     try:
-        return list(
-            boto3.Session(
-                aws_access_key_id=AWS_ACCESS_KEY,
-                aws_secret_access_key=AWS_SECRET_KEY,
-                profile_name=AWS_DEFAULT_PROFILE,
-            )
-            .resource("s3")
-            .buckets.all()
-        )
+        return _list_buckets()
     except Exception as err:
         if slack_alert_webhook:
             post_slack_message(
@@ -111,9 +206,53 @@ def check_aws_access(slack_alert_webhook=None) -> List[dict]:
         raise RuntimeError(f"Error in connecting to AWS: {err}") from err
 
 
+@lru_cache(maxsize=1)
+def _list_buckets() -> List[dict]:
+    """
+    List all accessible S3 buckets, cached to only call AWS once for the
+    lifetime of the process. This uses the same client as uploading to
+    reuse the already open connection.
+
+    Returns
+    -------
+    list
+        list of available S3 bucket details
+    """
+    return get_s3_client().list_buckets().get("Buckets", [])
+
+
+def _head_bucket(s3_client, bucket) -> Union[dict, None]:
+    """
+    Get the metadata of the given bucket
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        boto3 S3 client
+    bucket : str
+        S3 bucket to check
+
+    Returns
+    -------
+    dict | None
+        bucket metadata, or None if the bucket does not exist or is not
+        accessible
+    """
+    try:
+        log.debug("Checking %s exists and accessible", bucket)
+        return s3_client.head_bucket(Bucket=bucket)
+    except s3_exceptions.ClientError:
+        return None
+
+
 def check_buckets_exist(buckets, slack_alert_webhook=None) -> List[dict]:
     """
-    Check that the provided bucket(s) exist and are accessible
+    Check that the provided bucket(s) exist and are accessible.
+
+    Buckets are first checked against the single (cached) call to list
+    all buckets made when checking access to AWS, with HeadBucket only
+    called for any not in the listing (i.e. buckets owned by another
+    account that we have been granted access to).
 
     Parameters
     ----------
@@ -138,23 +277,33 @@ def check_buckets_exist(buckets, slack_alert_webhook=None) -> List[dict]:
         # try get from env if not set, mostly for testing
         slack_alert_webhook = environ.get("SLACK_ALERT_WEBHOOK")
 
-    valid = []
-    invalid = []
+    buckets = list(buckets)
 
-    for bucket in buckets:
-        try:
-            log.debug("Checking %s exists and accessible", bucket)
-            valid.append(
-                boto3.Session(
-                    aws_access_key_id=AWS_ACCESS_KEY,
-                    aws_secret_access_key=AWS_SECRET_KEY,
-                    profile_name=AWS_DEFAULT_PROFILE,
+    try:
+        listed = {x["Name"]: x for x in _list_buckets()}
+    except s3_exceptions.ClientError as err:
+        log.debug("Unable to list buckets, checking each bucket: %s", err)
+        listed = {}
+
+    unlisted = [x for x in buckets if x not in listed]
+
+    if unlisted:
+        s3_client = get_s3_client()
+
+        # check remaining buckets concurrently from the client shared
+        # with uploading
+        with ThreadPoolExecutor(max_workers=min(16, len(unlisted))) as pool:
+            listed.update(
+                zip(
+                    unlisted,
+                    pool.map(partial(_head_bucket, s3_client), unlisted),
                 )
-                .client("s3")
-                .head_bucket(Bucket=bucket)
             )
-        except s3_exceptions.ClientError:
-            invalid.append(bucket)
+
+    metadata = [listed[x] for x in buckets]
+
+    valid = [x for x in metadata if x is not None]
+    invalid = [bucket for bucket, x in zip(buckets, metadata) if x is None]
 
     if invalid:
         error_message = (
@@ -181,7 +330,7 @@ def check_buckets_exist(buckets, slack_alert_webhook=None) -> List[dict]:
 
 
 def upload_single_file(
-    s3_client, bucket, remote_path, local_file, parent_path
+    s3_client, bucket, remote_path, local_file, parent_path, file_sizes=None
 ) -> Tuple[str, str]:
     """
     Uploads single file into S3 storage bucket
@@ -199,6 +348,10 @@ def upload_single_file(
     parent_path : str
         path to parent of sequencing directory, will be removed from
         the file path for uploading to not form part of the remote path
+    file_sizes : dict
+        mapping of local files to their size in bytes already read when
+        submitting the uploads, if the file is not in this its size is
+        read from the file
 
     Returns
     -------
@@ -207,40 +360,459 @@ def upload_single_file(
     str
         ETag attribute of the uploaded file
     """
-    # remove base directory and join to specified S3 location
-    upload_file = re.sub(rf"^{parent_path}", "", local_file).lstrip("/")
-    upload_file = path.join(remote_path, upload_file).lstrip("/")
+    file_size = (file_sizes or {}).get(local_file)
+
+    if file_size is None:
+        file_size = _get_file_size(local_file)
+
+    upload_file = _get_upload_key(
+        local_file=local_file,
+        parent_path=parent_path,
+        remote_path=remote_path,
+    )
 
     log.debug("Uploading %s to %s:%s", local_file, bucket, upload_file)
 
-    # set threshold for splitting across cores to 1GB and to not use
-    # multiple threads for single file upload to allow us to control
-    # this better from the config
-    config = TransferConfig(multipart_threshold=1024**3, use_threads=False)
-    s3_client.upload_file(
-        Filename=local_file,
+    # split large files into parts uploaded in parallel so that a run
+    # with a few very large files is not bound by a single thread
+    # uploading each, and so an interrupted upload may be resumed
+    if file_size >= LARGE_FILE_THRESHOLD:
+        etag = multipart_upload_file(
+            s3_client=s3_client,
+            bucket=bucket,
+            key=upload_file,
+            local_file=local_file,
+            file_size=file_size,
+        )
+
+        log.debug("%s uploaded as %s", local_file, etag)
+
+        return local_file, etag.strip('"')
+
+    # the ETag is returned from the upload request itself, therefore no
+    # further request is needed to get the object ID
+    with open(local_file, "rb") as fh:
+        response = s3_client.put_object(
+            Bucket=bucket, Key=upload_file, Body=fh
+        )
+
+    log.debug("%s uploaded as %s", local_file, response.get("ETag"))
+
+    return local_file, response.get("ETag", "").strip('"')
+
+
+def _upload_with_retry(
+    s3_client,
+    bucket,
+    remote_path,
+    local_file,
+    parent_path,
+    file_sizes=None,
+    max_attempts=UPLOAD_ATTEMPTS,
+) -> Tuple[str, str]:
+    """
+    Call upload_single_file(), retrying with an exponential backoff on
+    transient errors so that a single failed request does not leave the
+    file to be uploaded again on the next run.
+
+    Large files uploaded as multipart uploads resume from the parts
+    already uploaded on each retry.
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        boto3 S3 client
+    bucket : str
+        S3 bucket to upload to
+    remote_path : str
+        parent directory in bucket to upload to
+    local_file : str
+        file and path to upload
+    parent_path : str
+        path to parent of sequencing directory
+    file_sizes : dict
+        mapping of local files to their size in bytes
+    max_attempts : int
+        maximum number of attempts to upload the file
+
+    Returns
+    -------
+    str
+        path and filename of uploaded file
+    str
+        ETag attribute of the uploaded file
+
+    Raises
+    ------
+    Exception
+        Raised from the last attempt to upload the file
+    """
+    for attempt in range(max_attempts):
+        try:
+            return upload_single_file(
+                s3_client=s3_client,
+                bucket=bucket,
+                remote_path=remote_path,
+                local_file=local_file,
+                parent_path=parent_path,
+                file_sizes=file_sizes,
+            )
+        except RETRYABLE_UPLOAD_ERRORS as exc:
+            if attempt == max_attempts - 1:
+                raise
+
+            log.warning(
+                "Error in uploading %s on attempt %s, retrying: %s",
+                local_file,
+                attempt + 1,
+                exc,
+            )
+            time.sleep(2**attempt)
+
+
+def get_multipart_upload_state(files) -> Dict[str, dict]:
+    """
+    Get the state of the multipart uploads not yet completed for any of
+    the given files
+
+    Parameters
+    ----------
+    files : list
+        list of local files
+
+    Returns
+    -------
+    dict
+        mapping of local file to its upload ID and uploaded parts
+    """
+    return {
+        local_file: _MULTIPART_UPLOADS[local_file]
+        for local_file in files
+        if local_file in _MULTIPART_UPLOADS
+    }
+
+
+def load_multipart_upload_state(multipart_uploads) -> None:
+    """
+    Load the state of multipart uploads from a previous partial upload of
+    a run, these will then be resumed when uploading the same files
+
+    Parameters
+    ----------
+    multipart_uploads : dict
+        mapping of local file to its upload ID and uploaded parts, as
+        returned from get_multipart_upload_state()
+    """
+    log.debug(
+        "Loading state of %s previous multipart uploads to resume",
+        len(multipart_uploads),
+    )
+    _MULTIPART_UPLOADS.update(multipart_uploads)
+
+
+def _get_resumable_parts(s3_client, state) -> Dict[int, dict]:
+    """
+    Get the parts already uploaded to S3 for the given multipart upload
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        boto3 S3 client
+    state : dict
+        state of multipart upload from a previous upload attempt
+
+    Returns
+    -------
+    dict
+        mapping of part number to uploaded part, empty if the upload no
+        longer exists in S3
+    """
+    try:
+        paginator = s3_client.get_paginator("list_parts")
+        pages = paginator.paginate(
+            Bucket=state["bucket"],
+            Key=state["key"],
+            UploadId=state["upload_id"],
+        )
+
+        return {
+            part["PartNumber"]: {
+                "PartNumber": part["PartNumber"],
+                "ETag": part["ETag"],
+                "Size": part["Size"],
+            }
+            for page in pages
+            for part in page.get("Parts", [])
+        }
+    except s3_exceptions.ClientError as err:
+        log.warning(
+            "Unable to resume multipart upload %s, starting new upload: %s",
+            state["upload_id"],
+            err,
+        )
+        return {}
+
+
+def _upload_part(s3_client, state, fd, part_number, offset, size) -> None:
+    """
+    Upload a single part of a file as part of a multipart upload, adding
+    the uploaded part to the upload state.
+
+    The part is read with pread from the file descriptor shared by all
+    parts of the file, which reads from the given offset without moving
+    the shared file position and so is safe to call from multiple threads.
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        boto3 S3 client
+    state : dict
+        state of multipart upload
+    fd : int
+        file descriptor of the file being uploaded
+    part_number : int
+        number of the part to upload, starting from 1
+    offset : int
+        offset in bytes of the start of the part in the file
+    size : int
+        size in bytes of the part
+    """
+    body = pread(fd, size, offset)
+
+    response = s3_client.upload_part(
+        Bucket=state["bucket"],
+        Key=state["key"],
+        UploadId=state["upload_id"],
+        PartNumber=part_number,
+        Body=body,
+    )
+
+    state["parts"].append(
+        {"PartNumber": part_number, "ETag": response["ETag"], "Size": size}
+    )
+
+
+def multipart_upload_file(
+    s3_client, bucket, key, local_file, file_size=None
+) -> str:
+    """
+    Upload a file as a multipart upload, with parts uploaded in parallel.
+
+    The upload ID and each uploaded part are stored in the state of
+    multipart uploads whilst uploading. If the upload fails, this is
+    written to the upload state log of the run, and on the next attempt
+    of uploading the file (loaded with load_multipart_upload_state()) the
+    already uploaded parts are checked against S3 and skipped, with only
+    the missing parts being uploaded.
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        boto3 S3 client
+    bucket : str
+        S3 bucket to upload to
+    key : str
+        key of object to upload to
+    local_file : str
+        file and path to upload
+    file_size : int
+        size of the file in bytes, if not given is read from the file
+
+    Returns
+    -------
+    str
+        ETag attribute of the uploaded file
+    """
+    if file_size is None:
+        file_size = path.getsize(local_file)
+    part_size = max(MULTIPART_CHUNKSIZE, -(-file_size // MAX_PARTS))
+
+    state = _MULTIPART_UPLOADS.get(local_file)
+    uploaded_parts = {}
+
+    if (
+        state
+        and state["bucket"] == bucket
+        and state["key"] == key
+        and state["part_size"] == part_size
+    ):
+        uploaded_parts = _get_resumable_parts(s3_client, state)
+    elif state:
+        log.warning(
+            "Previous multipart upload of %s does not match current file,"
+            " starting new upload",
+            local_file,
+        )
+
+    if not uploaded_parts:
+        if state:
+            try:
+                s3_client.abort_multipart_upload(
+                    Bucket=state["bucket"],
+                    Key=state["key"],
+                    UploadId=state["upload_id"],
+                )
+            except s3_exceptions.ClientError:
+                pass
+
+        response = s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        state = {
+            "bucket": bucket,
+            "key": key,
+            "upload_id": response["UploadId"],
+            "part_size": part_size,
+            "parts": [],
+        }
+    else:
+        log.info(
+            "Resuming multipart upload of %s from %s already uploaded parts",
+            local_file,
+            len(uploaded_parts),
+        )
+
+    # the last part may be smaller than the part size, any previously
+    # uploaded parts not of the expected size are uploaded again
+    all_parts = [
+        (number, offset, min(part_size, file_size - offset))
+        for number, offset in enumerate(
+            range(0, file_size, part_size), start=1
+        )
+    ]
+    state["parts"] = [
+        uploaded_parts[number]
+        for number, _, size in all_parts
+        if uploaded_parts.get(number, {}).get("Size") == size
+    ]
+    _MULTIPART_UPLOADS[local_file] = state
+
+    completed = {x["PartNumber"] for x in state["parts"]}
+
+    # open the file once for all parts, hinting to the kernel that the
+    # file will be read through to increase the read ahead
+    with open(local_file, "rb") as fh:
+        if posix_fadvise is not None:
+            posix_fadvise(fh.fileno(), 0, 0, POSIX_FADV_SEQUENTIAL)
+
+        concurrent_jobs = [
+            _PART_EXECUTOR.submit(
+                _upload_part,
+                s3_client=s3_client,
+                state=state,
+                fd=fh.fileno(),
+                part_number=number,
+                offset=offset,
+                size=size,
+            )
+            for number, offset, size in all_parts
+            if number not in completed
+        ]
+
+        # all parts must be read before the file is closed
+        wait(concurrent_jobs)
+
+    for future in concurrent_jobs:
+        # raise any error from uploading a part, leaving the state of the
+        # upload to be stored to resume from
+        future.result()
+
+    response = s3_client.complete_multipart_upload(
         Bucket=bucket,
-        Key=upload_file,
-        Config=config,
+        Key=key,
+        UploadId=state["upload_id"],
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": x["PartNumber"], "ETag": x["ETag"]}
+                for x in sorted(state["parts"], key=lambda x: x["PartNumber"])
+            ]
+        },
     )
 
-    # ensure we can access the remote file to log the object ID
-    remote_object = s3_client.get_object(Bucket=bucket, Key=upload_file)
+    _MULTIPART_UPLOADS.pop(local_file, None)
+
+    return response["ETag"]
+
+
+def _get_upload_key(local_file, parent_path, remote_path) -> str:
+    """
+    Get the key to upload the local file to in the bucket, by removing
+    the parent path from the start of the file path and joining it to
+    the remote path
+
+    Parameters
+    ----------
+    local_file : str
+        file and path to upload
+    parent_path : str
+        path to parent of sequencing directory to remove from the file path
+    remote_path : str
+        parent directory in bucket to upload to
+
+    Returns
+    -------
+    str
+        key of the object to upload to
+    """
+    # plain string prefix match since the parent path may contain regex
+    # metacharacters, i.e. a run directory under /data/run+1/
+    if local_file.startswith(parent_path):
+        local_file = local_file[len(parent_path) :]
+
+    return _get_key_prefix(remote_path) + local_file.lstrip("/")
+
+
+@lru_cache(maxsize=None)
+def _get_key_prefix(remote_path) -> str:
+    """
+    Get the prefix of all keys uploaded to the given remote path, cached
+    since the same remote path is used for every file of a run
+
+    Parameters
+    ----------
+    remote_path : str
+        parent directory in bucket to upload to
+
+    Returns
+    -------
+    str
+        remote path without leading or trailing slashes and ending in a
+        single forward slash, or an empty string for the bucket root
+    """
+    # S3 keys are always separated by forward slashes regardless of the
+    # separator of the local file system
+    remote_path = remote_path.strip("/")
+
+    return f"{remote_path}/" if remote_path else ""
+
+
+def _get_file_size(local_file) -> int:
+    """
+    Get the size of the given file, returning zero if it is not accessible
+    to let the upload itself raise and handle the error
 
-    log.debug("%s uploaded as %s", local_file, remote_object.get("ETag"))
+    Parameters
+    ----------
+    local_file : str
+        path to file
 
-    return local_file, remote_object.get("ETag", "").strip('"')
+    Returns
+    -------
+    int
+        size of file in bytes
+    """
+    try:
+        return path.getsize(local_file)
+    except OSError:
+        return 0
 
 
 def _submit_to_pool(pool, func, item_input, items, **kwargs) -> dict:
     """
-    Submits one call to `func` in `pool` (either ThreadPoolExecutor or
-    ProcessPoolExecutor) for each item in `items`. All additional
-    arguments defined in `kwargs` are passed to the given function.
+    Submits one call to `func` in `pool` for each item in `items`. All
+    additional arguments defined in `kwargs` are passed to the given
+    function.
 
-    This has been abstracted from both multi_thread_upload and
-    multi_core_upload to allow for unit testing of the called function
-    raising exceptions that are caught and handled.
+    This has been abstracted from submit_upload to allow for unit testing
+    of the called function raising exceptions that are caught and handled.
 
     In this context we will be calling upload_single_file() once for
     each of files in the given list of files, passing through the S3
@@ -248,7 +820,7 @@ def _submit_to_pool(pool, func, item_input, items, **kwargs) -> dict:
 
     Parameters
     ----------
-    pool : ThreadPoolExecutor | ProcessPoolExecutor
+    pool : ThreadPoolExecutor
         concurrent.futures executor to submit calls to
     func : callable
         function to call on submitting
@@ -263,32 +835,240 @@ def _submit_to_pool(pool, func, item_input, items, **kwargs) -> dict:
         mapping of concurrent.futures.Future objects to the original
         `item` submitted for that future
     """
-    return {
-        pool.submit(
-            func,
-            **{**{item_input: item}, **kwargs},
-        ): item
-        for item in items
-    }
+    # bind the arguments shared by every call once, instead of merging
+    # them into a new dict of arguments for each item submitted
+    func = partial(func, **kwargs)
 
+    return {pool.submit(func, **{item_input: item}): item for item in items}
 
-def multi_thread_upload(
-    files, bucket, remote_path, threads, parent_path
-) -> Tuple[Dict[str, str], list]:
+
+def get_pool_connections(threads) -> int:
+    """
+    Get the number of connections for the connection pool of the S3 client
+    shared by the given number of upload threads.
+
+    Each thread holds at most one connection at a time, whilst the parts
+    of all multipart uploads are uploaded from the shared pool of
+    MULTIPART_CONCURRENCY part threads, making the sum of the two the
+    most connections open at once. Sizing the pool to this means no
+    connection is discarded and re-opened for the pool being full.
+    Every connection holds an open file descriptor, therefore a warning is
+    logged if these may exceed the open file limit of the process.
+
+    Parameters
+    ----------
+    threads : int
+        total number of threads uploading
+
+    Returns
+    -------
+    int
+        maximum number of connections to keep in the connection pool
     """
-    Uploads the given set of `files` to S3 on a single CPU core using
-    maximum of n threads.
+    connections = threads + MULTIPART_CONCURRENCY
 
-    We are defining one S3 client per core due to boto3 clients being thread
-    safe but not safe to share across processes due to expected response
-    ordering: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/clients.html#caveat
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if soft_limit != resource.RLIM_INFINITY and connections * 2 > soft_limit:
+        log.warning(
+            "%s connections for uploading may exceed the open file limit of"
+            " %s, this should be raised with `ulimit -n`",
+            connections,
+            soft_limit,
+        )
+
+    log.info("Uploading with up to %s connections to S3", connections)
+
+    return connections
+
+
+def get_s3_client(max_pool_connections=100) -> BaseClient:
+    """
+    Get the S3 client to use for uploading, this is lazily created on the
+    first call and the same client returned for all subsequent calls.
+
+    boto3 clients are thread safe, therefore a single client may be shared
+    between all threads of a ThreadPoolExecutor to reuse the open
+    connections from its connection pool, avoiding a new TLS handshake per
+    file. They are not however safe to share across processes due to
+    expected response ordering:
+    https://boto3.amazonaws.com/v1/documentation/api/latest/guide/clients.html#caveat
+
+    The same client is also used for checking access to AWS and the
+    buckets, therefore this should first be called with the required
+    `max_pool_connections` before calling check_aws_access() and
+    check_buckets_exist().
 
     We will also set `disable_request_compression` since the majority of run
     data will not compress and this reduces unneeded CPU and memory load. In
-    addition, `tcp_keepalive` is set to ensure the session is kept alive.
+    addition, `tcp_keepalive` is set to ensure the session is kept alive and
+    `adaptive` retries used to back off from S3 when requests are throttled.
     Other available config parameters for the botocore Config object are here:
     https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
 
+    Parameters
+    ----------
+    max_pool_connections : int
+        maximum number of connections to keep in the connection pool, this
+        should be at least the number of threads sharing the client. Only
+        used when first creating the client.
+
+    Returns
+    -------
+    botocore.client.S3
+        boto3 S3 client
+    """
+    global _S3_CLIENT
+
+    if _S3_CLIENT is None:
+        log.debug(
+            "Creating S3 client with %s max pool connections",
+            max_pool_connections,
+        )
+        session = boto3.session.Session(
+            aws_access_key_id=AWS_ACCESS_KEY,
+            aws_secret_access_key=AWS_SECRET_KEY,
+            profile_name=AWS_DEFAULT_PROFILE,
+        )
+
+        _S3_CLIENT = session.client(
+            "s3",
+            config=Config(
+                retries={"max_attempts": 10, "mode": "adaptive"},
+                disable_request_compression=True,
+                tcp_keepalive=True,
+                max_pool_connections=max_pool_connections,
+            ),
+        )
+
+    return _S3_CLIENT
+
+
+def submit_upload(
+    executor, s3_client, files, bucket, remote_path, parent_path
+) -> dict:
+    """
+    Submit one call to upload_single_file() to the given executor for each
+    of the given `files`, retrying the upload of each file on transient
+    errors (see _upload_with_retry()).
+
+    This allows for a single long-lived ThreadPoolExecutor and S3 client
+    to be shared between the uploads of multiple runs, with the files of
+    every run being queued up in the same pool.
+
+    Each file is submitted as its own task onto the single work queue of
+    the executor which every thread takes from as it becomes free, this
+    dynamically balances the upload between threads where file sizes are
+    highly skewed (i.e. large BCLs and small InterOp files). Files are
+    submitted largest first (longest processing time first scheduling) to
+    not leave a thread uploading a single large file at the end.
+
+    Parameters
+    ----------
+    executor : ThreadPoolExecutor
+        concurrent.futures executor to submit uploads to
+    s3_client : botocore.client.S3
+        boto3 S3 client shared across all threads
+    files : list
+        list of local files to upload
+    bucket : str
+        S3 bucket to upload to
+    remote_path : str
+        parent directory in bucket to upload to
+    parent_path : str
+        path to parent of sequencing directory, will be removed from
+        the file path for uploading to not form part of the remote path
+
+    Returns
+    -------
+    dict
+        mapping of concurrent.futures.Future objects to the local file
+        submitted for upload
+    """
+    # read the size of each file once, both to order the files and to
+    # not need to read it again from each thread when uploading
+    file_sizes = {
+        local_file: _get_file_size(local_file) for local_file in files
+    }
+
+    return _submit_to_pool(
+        pool=executor,
+        func=_upload_with_retry,
+        item_input="local_file",
+        items=sorted(files, key=file_sizes.get, reverse=True),
+        s3_client=s3_client,
+        bucket=bucket,
+        remote_path=remote_path,
+        parent_path=parent_path,
+        file_sizes=file_sizes,
+    )
+
+
+def collect_upload_results(concurrent_jobs) -> Tuple[Dict[str, str], list]:
+    """
+    Wait on the submitted uploads to complete and gather up the uploaded
+    and failed files.
+
+    Results are gathered as each upload completes, with the progress
+    logged every PROGRESS_LOG_INTERVAL files.
+
+    Parameters
+    ----------
+    concurrent_jobs : dict
+        mapping of concurrent.futures.Future objects to the local file
+        submitted for upload, as returned from submit_upload()
+
+    Returns
+    -------
+    dict
+        mapping of local file to ETag ID of uploaded file
+    list
+        list of any files that failed to upload
+    """
+    uploaded_files = {}
+    failed_upload = []
+
+    for completed, future in enumerate(as_completed(concurrent_jobs), 1):
+        if completed % PROGRESS_LOG_INTERVAL == 0:
+            log.info(
+                "Completed uploading %s/%s files (%s failed)",
+                completed,
+                len(concurrent_jobs),
+                len(failed_upload),
+            )
+
+        # access returned output as each is returned in any order
+        try:
+            local_file, remote_id = future.result()
+            uploaded_files[local_file] = remote_id
+        except UPLOAD_ERRORS as exc:
+            # catch any errors from S3 or reading the file that may get
+            # raised from uploading, we will return a list of failed files
+            # to try reupload later. Any other error is from a bug and is
+            # raised to not be hidden as a failed upload
+            log.error(
+                "Error in uploading %s: %s", concurrent_jobs[future], exc
+            )
+            failed_upload.append(concurrent_jobs[future])
+
+    return uploaded_files, failed_upload
+
+
+def multi_thread_upload(
+    files, bucket, remote_path, threads, parent_path, s3_client=None
+) -> Tuple[Dict[str, str], list]:
+    """
+    Uploads the given set of `files` to S3 using maximum of n threads.
+
+    We are defining one S3 client and sharing this between all threads
+    (see get_s3_client() for details).
+
+    Each thread sends the file body over its connection in blocks of
+    the default HTTP connection block size (8-16KB), to send these in
+    larger blocks set either the environment variable
+    `S3_UPLOAD_BIG_HTTP_BUFFER=1` or `http_send_buffer_bytes` in the
+    config (see set_http_send_buffer_size()).
+
     Parameters
     ----------
     files : list
@@ -298,10 +1078,13 @@ def multi_thread_upload(
     remote_path : str
         parent directory in bucket to upload to
     threads : int
-        maximum number of threaded process to open per core
+        maximum number of threads to upload with
     parent_path : str
         path to parent of sequencing directory, will be removed from
         the file path for uploading to not form part of the remote path
+    s3_client : botocore.client.S3
+        S3 client to upload with, if not given will use the shared client
+        from get_s3_client()
 
     Returns
     -------
@@ -312,58 +1095,38 @@ def multi_thread_upload(
     """
     log.info("Uploading %s files with %s threads", len(files), threads)
 
-    session = boto3.session.Session(
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_KEY,
-        profile_name=AWS_DEFAULT_PROFILE,
-    )
-    s3_client = session.client(
-        "s3",
-        config=Config(
-            retries={"total_max_attempts": 10, "mode": "standard"},
-            disable_request_compression=True,
-            tcp_keepalive=True,
-            max_pool_connections=100,
-        ),
-    )
+    if not files:
+        return {}, []
 
-    uploaded_files = {}
-    failed_upload = []
+    if not s3_client:
+        s3_client = get_s3_client(
+            max_pool_connections=get_pool_connections(threads)
+        )
 
     with ThreadPoolExecutor(max_workers=threads) as executor:
-        concurrent_jobs = _submit_to_pool(
-            pool=executor,
-            func=upload_single_file,
-            item_input="local_file",
-            items=files,
+        concurrent_jobs = submit_upload(
+            executor=executor,
             s3_client=s3_client,
+            files=files,
             bucket=bucket,
             remote_path=remote_path,
             parent_path=parent_path,
         )
 
-        for future in as_completed(concurrent_jobs):
-            # access returned output as each is returned in any order
-            try:
-                local_file, remote_id = future.result()
-                uploaded_files[local_file] = remote_id
-            except Exception as exc:
-                # catch any errors that may get raised from uploading, we
-                # will return a list of failed files to try reupload later
-                log.error(
-                    "Error in uploading %s: %s", concurrent_jobs[future], exc
-                )
-                failed_upload.append(concurrent_jobs[future])
-
-    return uploaded_files, failed_upload
+        return collect_upload_results(concurrent_jobs)
 
 
 def multi_core_upload(
-    files, bucket, remote_path, cores, threads, parent_path
+    files, bucket, remote_path, cores, threads, parent_path, s3_client=None
 ) -> Tuple[Dict[str, str], list]:
     """
-    Call the multi_thread_upload on `files` split across n
-    logical CPU cores
+    Upload the given `files` with a single pool of `cores` * `threads`
+    threads.
+
+    Uploading to S3 is network I/O bound and the GIL is released whilst
+    sending data, therefore we use only threads and a single S3 client
+    shared across them. This avoids the memory and start up overhead of
+    forking a process per core and pickling the file lists between them.
 
     Parameters
     ----------
@@ -374,12 +1137,15 @@ def multi_core_upload(
     remote_path : str
         parent directory in bucket to upload to
     cores : int
-        maximum number of logical CPU cores to split uploading across
+        number of logical CPU cores available for uploading
     threads : int
-        maximum number of threaded process to open per core
+        maximum number of threads to open per core
     parent_path : str
         path to parent of sequencing directory, will be removed from
         the file path for uploading to not form part of the remote path
+    s3_client : botocore.client.S3
+        S3 client to upload with, if not given will use the shared client
+        from get_s3_client()
 
     Returns
     -------
@@ -390,47 +1156,21 @@ def multi_core_upload(
     """
     log.info(
         "Beginning uploading %s files with %s cores to %s:%s",
-        sum([len(x) for x in files]),
+        len(files),
         cores,
         bucket,
         remote_path,
     )
 
-    all_uploaded_files = {}
-    all_failed_upload = []
-
-    pool_executor = ProcessPoolExecutor(max_workers=cores)
-    concurrent_jobs = _submit_to_pool(
-        pool=pool_executor,
-        func=multi_thread_upload,
-        item_input="files",
-        items=files,
+    all_uploaded_files, all_failed_upload = multi_thread_upload(
+        files=files,
         bucket=bucket,
         remote_path=remote_path,
+        threads=cores * threads,
         parent_path=parent_path,
-        threads=threads,
+        s3_client=s3_client,
     )
 
-    for future in as_completed(concurrent_jobs):
-        # access returned output as each is returned in any order
-        try:
-            uploaded_files, failed_upload = future.result()
-
-            all_uploaded_files = {**all_uploaded_files, **uploaded_files}
-            all_failed_upload.extend(failed_upload)
-        except Exception as exc:
-            # catch any other errors that might get raised from the
-            # ProcessPool but not handled in the child ThreadPool
-            all_failed_upload.extend(concurrent_jobs[future])
-            log.error(
-                "Failed uploading %s files for a single ProcessPool due to"
-                " an unhandled error: %s",
-                len(concurrent_jobs[future]),
-                exc,
-            )
-
-    pool_executor.shutdown(wait=True)
-
     if all_uploaded_files:
         log.info(
             "Successfully uploaded %s files to %s:%s",
@@ -0,0 +1,683 @@
+"""
+Functions for uploading files to S3 from a single asyncio event loop.
+
+This is an alternative to the thread pool upload in upload.py, intended
+for runs made up of many small files where the per request overhead
+dominates, and many more requests may be kept in flight than threads.
+Requires the optional aiobotocore dependency to be installed.
+"""
+
+import asyncio
+from os import path
+from typing import List, Tuple
+
+from botocore import exceptions as s3_exceptions
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+from .log import get_logger
+from .upload import (
+    AWS_ACCESS_KEY,
+    AWS_DEFAULT_PROFILE,
+    AWS_SECRET_KEY,
+    LARGE_FILE_THRESHOLD,
+    MAX_PARTS,
+    MULTIPART_CHUNKSIZE,
+    MULTIPART_CONCURRENCY,
+    RETRYABLE_UPLOAD_ERRORS,
+    UPLOAD_ATTEMPTS,
+    UPLOAD_ERRORS,
+    _MULTIPART_UPLOADS,
+    _get_file_size,
+    _get_upload_key,
+)
+
+log = get_logger("s3_upload")
+
+# files larger than this uploaded in a single request also wait on the
+# part semaphore, as their contents are read into memory to upload
+BUFFERED_FILE_SIZE = 1024**2
+
+
+def check_async_available() -> None:
+    """
+    Check that aiobotocore is installed to be able to upload async
+
+    Raises
+    ------
+    ImportError
+        Raised if aiobotocore is not installed
+    """
+    if get_session is None:
+        raise ImportError(
+            "aiobotocore must be installed to upload with upload_mode async"
+        )
+
+
+async def _async_upload_single_file(
+    s3_client,
+    semaphore,
+    part_semaphore,
+    bucket,
+    remote_path,
+    local_file,
+    parent_path,
+) -> Tuple[str, str]:
+    """
+    Upload single file to the specified bucket, waiting on the semaphore
+    to limit the total number of requests in flight.
+
+    The file is read in the default executor of the event loop to not
+    block other uploads whilst reading, with files larger than
+    BUFFERED_FILE_SIZE also waiting on the part semaphore to limit the
+    size of the file contents held in memory at once.
+
+    Parameters
+    ----------
+    s3_client : aiobotocore.client.AioBaseClient
+        async S3 client to upload with
+    semaphore : asyncio.Semaphore
+        semaphore limiting the number of concurrent uploads
+    part_semaphore : asyncio.Semaphore
+        semaphore limiting the number of parts and larger files read into
+        memory
+    bucket : str
+        name of bucket to upload to
+    remote_path : str
+        path in bucket to upload file to
+    local_file : str
+        file to upload
+    parent_path : str
+        path to parent of run directory, will be removed from the file path
+        when uploading to S3 to ensure upload is to the run dir name
+
+    Returns
+    -------
+    str
+        path and filename of uploaded file
+    str
+        ETag attribute of the uploaded file
+    """
+    upload_file = _get_upload_key(
+        local_file=local_file,
+        parent_path=parent_path,
+        remote_path=remote_path,
+    )
+
+    file_size = _get_file_size(local_file)
+
+    if file_size >= LARGE_FILE_THRESHOLD:
+        # each part waits on the semaphore, therefore this must not be
+        # held for the whole file to not block the uploading of parts
+        etag = await _async_multipart_upload(
+            s3_client=s3_client,
+            semaphore=semaphore,
+            part_semaphore=part_semaphore,
+            bucket=bucket,
+            key=upload_file,
+            local_file=local_file,
+        )
+
+        return local_file, etag.strip('"')
+
+    if file_size > BUFFERED_FILE_SIZE:
+        async with part_semaphore:
+            response = await _async_put_object(
+                s3_client=s3_client,
+                semaphore=semaphore,
+                bucket=bucket,
+                key=upload_file,
+                local_file=local_file,
+                size=file_size,
+            )
+    else:
+        response = await _async_put_object(
+            s3_client=s3_client,
+            semaphore=semaphore,
+            bucket=bucket,
+            key=upload_file,
+            local_file=local_file,
+            size=file_size,
+        )
+
+    return local_file, response["ETag"].strip('"')
+
+
+async def _async_put_object(
+    s3_client, semaphore, bucket, key, local_file, size
+) -> dict:
+    """
+    Read the given file in the default executor of the event loop and
+    upload it in a single request, waiting on the semaphore to limit the
+    total number of requests in flight
+
+    Parameters
+    ----------
+    s3_client : aiobotocore.client.AioBaseClient
+        async S3 client to upload with
+    semaphore : asyncio.Semaphore
+        semaphore limiting the number of concurrent uploads
+    bucket : str
+        name of bucket to upload to
+    key : str
+        key of object to upload to
+    local_file : str
+        file to upload
+    size : int
+        size of the file in bytes
+
+    Returns
+    -------
+    dict
+        response of the PutObject request
+    """
+    loop = asyncio.get_running_loop()
+
+    async with semaphore:
+        log.debug("Uploading %s to %s:%s", local_file, bucket, key)
+
+        body = await loop.run_in_executor(
+            None, _read_part, local_file, 0, size
+        )
+
+        return await s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def _read_part(local_file, offset, size) -> bytes:
+    """
+    Read a single part of a file to upload, this is blocking and therefore
+    run in the default executor of the event loop
+
+    Parameters
+    ----------
+    local_file : str
+        file to read from
+    offset : int
+        offset in bytes of the start of the part in the file
+    size : int
+        size in bytes of the part
+
+    Returns
+    -------
+    bytes
+        contents of the part
+    """
+    with open(local_file, "rb") as fh:
+        fh.seek(offset)
+
+        return fh.read(size)
+
+
+async def _async_upload_part(
+    s3_client,
+    semaphore,
+    part_semaphore,
+    state,
+    local_file,
+    part_number,
+    offset,
+    size,
+) -> None:
+    """
+    Upload a single part of a file as part of a multipart upload, adding
+    the uploaded part to the upload state.
+
+    The part is held in memory from being read until it is uploaded,
+    therefore this waits on the part semaphore before reading to limit
+    the number of parts held at once, separately to the semaphore
+    limiting the number of requests in flight.
+
+    Parameters
+    ----------
+    s3_client : aiobotocore.client.AioBaseClient
+        async S3 client to upload with
+    semaphore : asyncio.Semaphore
+        semaphore limiting the number of concurrent uploads
+    part_semaphore : asyncio.Semaphore
+        semaphore limiting the number of parts read into memory
+    state : dict
+        state of multipart upload
+    local_file : str
+        file being uploaded
+    part_number : int
+        number of the part to upload, starting from 1
+    offset : int
+        offset in bytes of the start of the part in the file
+    size : int
+        size in bytes of the part
+    """
+    loop = asyncio.get_running_loop()
+
+    async with part_semaphore:
+        body = await loop.run_in_executor(
+            None, _read_part, local_file, offset, size
+        )
+
+        async with semaphore:
+            response = await s3_client.upload_part(
+                Bucket=state["bucket"],
+                Key=state["key"],
+                UploadId=state["upload_id"],
+                PartNumber=part_number,
+                Body=body,
+            )
+
+    state["parts"].append(
+        {"PartNumber": part_number, "ETag": response["ETag"], "Size": size}
+    )
+
+
+async def _async_get_resumable_parts(s3_client, state) -> dict:
+    """
+    Get the parts already uploaded to S3 for the given multipart upload
+
+    Parameters
+    ----------
+    s3_client : aiobotocore.client.AioBaseClient
+        async S3 client to upload with
+    state : dict
+        state of multipart upload from a previous upload attempt
+
+    Returns
+    -------
+    dict
+        mapping of part number to uploaded part, empty if the upload no
+        longer exists in S3
+    """
+    try:
+        paginator = s3_client.get_paginator("list_parts")
+        uploaded_parts = {}
+
+        async for page in paginator.paginate(
+            Bucket=state["bucket"],
+            Key=state["key"],
+            UploadId=state["upload_id"],
+        ):
+            for part in page.get("Parts", []):
+                uploaded_parts[part["PartNumber"]] = {
+                    "PartNumber": part["PartNumber"],
+                    "ETag": part["ETag"],
+                    "Size": part["Size"],
+                }
+
+        return uploaded_parts
+    except s3_exceptions.ClientError as err:
+        log.warning(
+            "Unable to resume multipart upload %s, starting new upload: %s",
+            state["upload_id"],
+            err,
+        )
+        return {}
+
+
+async def _async_multipart_upload(
+    s3_client, semaphore, part_semaphore, bucket, key, local_file
+) -> str:
+    """
+    Upload a large file as a multipart upload, with all parts uploaded
+    concurrently alongside other files.
+
+    As with multipart_upload_file(), the upload ID and each uploaded part
+    are stored in the state of multipart uploads shared with upload.py
+    whilst uploading. If any part fails to upload the state is kept, to
+    be written to the upload state log of the run, and the next attempt
+    resumes from the parts already uploaded.
+
+    Parameters
+    ----------
+    s3_client : aiobotocore.client.AioBaseClient
+        async S3 client to upload with
+    semaphore : asyncio.Semaphore
+        semaphore limiting the number of concurrent uploads
+    part_semaphore : asyncio.Semaphore
+        semaphore limiting the number of parts read into memory
+    bucket : str
+        name of bucket to upload to
+    key : str
+        key of object to upload to
+    local_file : str
+        file to upload
+
+    Returns
+    -------
+    str
+        ETag attribute of the uploaded file
+
+    Raises
+    ------
+    Exception
+        Raised from the first part to fail uploading
+    """
+    log.debug("Uploading %s to %s:%s as multipart", local_file, bucket, key)
+
+    file_size = path.getsize(local_file)
+    part_size = max(MULTIPART_CHUNKSIZE, -(-file_size // MAX_PARTS))
+
+    state = _MULTIPART_UPLOADS.get(local_file)
+    uploaded_parts = {}
+
+    if (
+        state
+        and state["bucket"] == bucket
+        and state["key"] == key
+        and state["part_size"] == part_size
+    ):
+        uploaded_parts = await _async_get_resumable_parts(s3_client, state)
+    elif state:
+        log.warning(
+            "Previous multipart upload of %s does not match current file,"
+            " starting new upload",
+            local_file,
+        )
+
+    if not uploaded_parts:
+        if state:
+            # failing to abort the previous upload must not stop the new
+            # upload, it is left to expire with the bucket lifecycle
+            try:
+                await s3_client.abort_multipart_upload(
+                    Bucket=state["bucket"],
+                    Key=state["key"],
+                    UploadId=state["upload_id"],
+                )
+            except Exception as abort_error:
+                log.error(
+                    "Error in aborting multipart upload %s of %s: %s",
+                    state["upload_id"],
+                    local_file,
+                    abort_error,
+                )
+
+        response = await s3_client.create_multipart_upload(
+            Bucket=bucket, Key=key
+        )
+        state = {
+            "bucket": bucket,
+            "key": key,
+            "upload_id": response["UploadId"],
+            "part_size": part_size,
+            "parts": [],
+        }
+    else:
+        log.info(
+            "Resuming multipart upload of %s from %s already uploaded parts",
+            local_file,
+            len(uploaded_parts),
+        )
+
+    # the last part may be smaller than the part size, any previously
+    # uploaded parts not of the expected size are uploaded again
+    all_parts = [
+        (number, offset, min(part_size, file_size - offset))
+        for number, offset in enumerate(
+            range(0, file_size, part_size), start=1
+        )
+    ]
+    state["parts"] = [
+        uploaded_parts[number]
+        for number, _, size in all_parts
+        if uploaded_parts.get(number, {}).get("Size") == size
+    ]
+    _MULTIPART_UPLOADS[local_file] = state
+
+    completed = {x["PartNumber"] for x in state["parts"]}
+
+    results = await asyncio.gather(
+        *[
+            _async_upload_part(
+                s3_client=s3_client,
+                semaphore=semaphore,
+                part_semaphore=part_semaphore,
+                state=state,
+                local_file=local_file,
+                part_number=number,
+                offset=offset,
+                size=size,
+            )
+            for number, offset, size in all_parts
+            if number not in completed
+        ],
+        return_exceptions=True,
+    )
+
+    errors = [x for x in results if isinstance(x, BaseException)]
+
+    if errors:
+        # leave the state of the upload to be stored to resume from
+        raise errors[0]
+
+    response = await s3_client.complete_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        UploadId=state["upload_id"],
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": x["PartNumber"], "ETag": x["ETag"]}
+                for x in sorted(state["parts"], key=lambda x: x["PartNumber"])
+            ]
+        },
+    )
+
+    _MULTIPART_UPLOADS.pop(local_file, None)
+
+    return response["ETag"]
+
+
+async def _async_upload_with_retry(
+    s3_client,
+    semaphore,
+    part_semaphore,
+    bucket,
+    remote_path,
+    local_file,
+    parent_path,
+    max_attempts=UPLOAD_ATTEMPTS,
+) -> Tuple[str, str]:
+    """
+    Call _async_upload_single_file(), retrying with an exponential backoff
+    on transient errors in the same way as _upload_with_retry(). Large
+    files uploaded as multipart uploads resume from the parts already
+    uploaded on each retry.
+
+    Parameters
+    ----------
+    s3_client : aiobotocore.client.AioBaseClient
+        async S3 client to upload with
+    semaphore : asyncio.Semaphore
+        semaphore limiting the number of concurrent uploads
+    part_semaphore : asyncio.Semaphore
+        semaphore limiting the number of parts and larger files read into
+        memory
+    bucket : str
+        name of bucket to upload to
+    remote_path : str
+        path in bucket to upload file to
+    local_file : str
+        file to upload
+    parent_path : str
+        path to parent of run directory
+    max_attempts : int
+        maximum number of attempts to upload the file
+
+    Returns
+    -------
+    str
+        path and filename of uploaded file
+    str
+        ETag attribute of the uploaded file
+
+    Raises
+    ------
+    Exception
+        Raised from the last attempt to upload the file
+    """
+    for attempt in range(max_attempts):
+        try:
+            return await _async_upload_single_file(
+                s3_client=s3_client,
+                semaphore=semaphore,
+                part_semaphore=part_semaphore,
+                bucket=bucket,
+                remote_path=remote_path,
+                local_file=local_file,
+                parent_path=parent_path,
+            )
+        except RETRYABLE_UPLOAD_ERRORS as exc:
+            if attempt == max_attempts - 1:
+                raise
+
+            log.warning(
+                "Error in uploading %s on attempt %s, retrying: %s",
+                local_file,
+                attempt + 1,
+                exc,
+            )
+            await asyncio.sleep(2**attempt)
+
+
+async def async_multi_core_upload(
+    files,
+    bucket,
+    remote_path,
+    parent_path,
+    max_inflight=512,
+) -> Tuple[dict, List[str]]:
+    """
+    Upload the given files from a single event loop, with up to
+    `max_inflight` uploads running concurrently.
+
+    Files are uploaded with a single PutObject request, except for large
+    files which are split into parts that are uploaded concurrently in
+    the same way as single files.
+
+    Parameters
+    ----------
+    files : list
+        list of files to upload
+    bucket : str
+        name of bucket to upload to
+    remote_path : str
+        path in bucket to upload files to
+    parent_path : str
+        path to parent of run directory, will be removed from the file path
+        when uploading to S3 to ensure upload is to the run dir name
+    max_inflight : int
+        maximum number of uploads to run concurrently
+
+    Returns
+    -------
+    dict
+        mapping of local file to ETag ID of successfully uploaded files
+    list
+        list of files that failed to upload
+    """
+    check_async_available()
+
+    uploaded_files = {}
+    failed_upload = []
+
+    if not files:
+        return uploaded_files, failed_upload
+
+    semaphore = asyncio.Semaphore(max_inflight)
+
+    # parts of large files are held in memory whilst uploading, therefore
+    # are limited to far fewer than the requests of small files in flight
+    part_semaphore = asyncio.Semaphore(MULTIPART_CONCURRENCY)
+    config = AioConfig(
+        retries={"max_attempts": 10, "mode": "adaptive"},
+        max_pool_connections=max_inflight,
+    )
+
+    # authenticate with the same environment variables as get_s3_client()
+    session = get_session()
+
+    if AWS_DEFAULT_PROFILE:
+        session.set_config_variable("profile", AWS_DEFAULT_PROFILE)
+
+    async with session.create_client(
+        "s3",
+        config=config,
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+    ) as s3_client:
+        results = await asyncio.gather(
+            *[
+                _async_upload_with_retry(
+                    s3_client=s3_client,
+                    semaphore=semaphore,
+                    part_semaphore=part_semaphore,
+                    bucket=bucket,
+                    remote_path=remote_path,
+                    local_file=local_file,
+                    parent_path=parent_path,
+                )
+                for local_file in files
+            ],
+            return_exceptions=True,
+        )
+
+    for local_file, result in zip(files, results):
+        if isinstance(result, UPLOAD_ERRORS):
+            log.error("Error in uploading %s: %s", local_file, result)
+            failed_upload.append(local_file)
+        elif isinstance(result, BaseException):
+            # includes CancelledError, which is not an Exception from 3.8
+            raise result
+        else:
+            uploaded_files[result[0]] = result[1]
+
+    log.info(
+        "Successfully uploaded %s files to %s", len(uploaded_files), bucket
+    )
+
+    if failed_upload:
+        log.error(
+            "Failed uploading %s files to %s:\n\t%s",
+            len(failed_upload),
+            bucket,
+            "\n\t".join(failed_upload),
+        )
+
+    return uploaded_files, failed_upload
+
+
+def async_upload(
+    files, bucket, remote_path, parent_path, max_inflight=512
+) -> Tuple[dict, List[str]]:
+    """
+    Run async_multi_core_upload to completion in a new event loop
+
+    Parameters
+    ----------
+    files : list
+        list of files to upload
+    bucket : str
+        name of bucket to upload to
+    remote_path : str
+        path in bucket to upload files to
+    parent_path : str
+        path to parent of run directory
+    max_inflight : int
+        maximum number of uploads to run concurrently
+
+    Returns
+    -------
+    dict
+        mapping of local file to ETag ID of successfully uploaded files
+    list
+        list of files that failed to upload
+    """
+    return asyncio.run(
+        async_multi_core_upload(
+            files=files,
+            bucket=bucket,
+            remote_path=remote_path,
+            parent_path=parent_path,
+            max_inflight=max_inflight,
+        )
+    )
@@ -1,20 +1,78 @@
 """General utility functions"""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from glob import glob
-from itertools import zip_longest
-from os import path, scandir, stat
-from pathlib import Path
+from functools import partial
+from os import DirEntry, path, scandir
 import re
-from typing import List, Tuple, Union
+from typing import Iterator, List, Set, Tuple, Union
 
-from .io import read_upload_state_log, read_samplesheet_from_run_directory
+from .io import (
+    get_completed_marker,
+    read_upload_state_log,
+    read_samplesheet_from_run_directory,
+)
 from .log import get_logger
 
 log = get_logger("s3_upload")
 
+# units of file sizes for sizeof_fmt(), each 1024x the previous
+SIZE_UNITS = ["", "K", "M", "G", "T", "P", "E", "Z", "Yi"]
 
-def check_termination_file_exists(run_dir) -> bool:
+# required keys of each monitor section of the config and their types
+MONITOR_SCHEMA = (
+    ("monitored_directories", list),
+    ("bucket", str),
+    ("remote_path", str),
+)
+
+
+def _list_file_names(run_dir) -> Set[str]:
+    """
+    List the names of all entries in the given directory from a single
+    read of the directory, to check for the presence of multiple files
+    without a stat call for each
+
+    Parameters
+    ----------
+    run_dir : str
+        path to directory to list
+
+    Returns
+    -------
+    set
+        names of entries in the directory
+    """
+    with scandir(run_dir) as entries:
+        return {entry.name for entry in entries}
+
+
+def _file_exists(run_dir, file_name, file_names=None) -> bool:
+    """
+    Check if the given file exists in the run directory, either from the
+    already listed names of the directory if given, or from the file system
+
+    Parameters
+    ----------
+    run_dir : str
+        path to directory to check
+    file_name : str
+        name of file to check for
+    file_names : set
+        names of entries in the directory from _list_file_names()
+
+    Returns
+    -------
+    bool
+        True if the file exists else False
+    """
+    if file_names is not None:
+        return file_name in file_names
+
+    return path.exists(path.join(run_dir, file_name))
+
+
+def check_termination_file_exists(run_dir, file_names=None) -> bool:
     """
     Check if the run has completed sequencing from the presence of
     CopyComplete.txt (for NovaSeqs), or RTAComplete(.txt/.xml) for other
@@ -26,6 +84,8 @@ def check_termination_file_exists(run_dir) -> bool:
     ----------
     run_dir : str
         path to run directory to check
+    file_names : set
+        optional names of entries in the run directory already listed
 
     Returns
     -------
@@ -34,12 +94,12 @@ def check_termination_file_exists(run_dir) -> bool:
     """
     log.debug("Checking for termination file in %s", run_dir)
 
-    if path.exists(path.join(run_dir, "CopyComplete.txt")):
+    if _file_exists(run_dir, "CopyComplete.txt", file_names):
         # NovaSeq run that is complete
         log.debug("Termination file exists => sequencing complete")
         return True
-    elif path.exists(path.join(run_dir, "RTAComplete.txt")) or path.exists(
-        path.join(run_dir, "RTAComplete.xml")
+    elif _file_exists(run_dir, "RTAComplete.txt", file_names) or _file_exists(
+        run_dir, "RTAComplete.xml", file_names
     ):
         # other type of Illumina sequencer (e.g. MiSeq, NextSeq, HiSeq)
         log.debug("Termination file exists => sequencing complete")
@@ -49,7 +109,7 @@ def check_termination_file_exists(run_dir) -> bool:
         return False
 
 
-def check_is_sequencing_run_dir(run_dir) -> bool:
+def check_is_sequencing_run_dir(run_dir, file_names=None) -> bool:
     """
     Check if a given directory is a sequencing run from presence of
     RunInfo.xml file
@@ -58,6 +118,8 @@ def check_is_sequencing_run_dir(run_dir) -> bool:
     ----------
     run_dir : str
         path to directory to check
+    file_names : set
+        optional names of entries in the directory already listed
 
     Returns
     -------
@@ -65,7 +127,7 @@ def check_is_sequencing_run_dir(run_dir) -> bool:
         True if directory is a sequencing run else False
     """
     log.debug("Checking if directory is a sequencing run: %s", run_dir)
-    return path.exists(path.join(run_dir, "RunInfo.xml"))
+    return _file_exists(run_dir, "RunInfo.xml", file_names)
 
 
 def check_run_age_within_limit(run_dir, max_age=72) -> bool:
@@ -100,7 +162,7 @@ def check_run_age_within_limit(run_dir, max_age=72) -> bool:
 
 def check_upload_state(
     run_dir, log_dir="/var/log/s3_upload/"
-) -> Tuple[str, list]:
+) -> Tuple[str, dict]:
     """
     Checking upload state of run (i.e. uploaded, partial, new)
 
@@ -115,20 +177,26 @@ def check_upload_state(
     -------
     str
         state of run upload, will be one of: uploaded, partial or new
-    list
-        list of uploaded files
+    dict
+        mapping of already uploaded files to their remote object ID, this
+        is not read for runs with a completed marker file
     """
     upload_log = path.join(
-        log_dir, "uploads/", f"{Path(run_dir).name}.upload.log.json"
+        log_dir, "uploads/", f"{path.basename(run_dir)}.upload.log.json"
     )
 
     if not path.exists(upload_log):
-        return "new", []
+        return "new", {}
+
+    if path.exists(get_completed_marker(upload_log)):
+        # completed upload, no need to read the full log of uploaded files
+        return "uploaded", {}
 
     log_contents = read_upload_state_log(log_file=upload_log)
 
-    # get the list of already uploaded files from the stored mapping
-    uploaded_files = list(log_contents["uploaded_files"].keys())
+    # return the stored mapping of already uploaded files directly, this
+    # may be checked against without building a list or set of the files
+    uploaded_files = log_contents["uploaded_files"]
 
     if log_contents["completed"]:
         return "uploaded", uploaded_files
@@ -149,7 +217,7 @@ def check_all_uploadable_samples(
     ----------
     samplesheet_contents : list
         contents of samplesheet
-    sample_pattern : str
+    sample_pattern : str | re.Pattern
         regex pattern for matching against samplenames
 
     Returns
@@ -159,9 +227,12 @@ def check_all_uploadable_samples(
         if no samplenames are returned from the call to
         get_samplenames_from_samplesheet.
     """
+    # compiling an already compiled pattern returns it unchanged
+    sample_pattern = re.compile(sample_pattern)
+
     log.info(
         "Checking if sample names match provided pattern(s) from config: %s",
-        sample_pattern,
+        sample_pattern.pattern,
     )
 
     sample_names = get_samplenames_from_samplesheet(
@@ -172,7 +243,7 @@ def check_all_uploadable_samples(
         log.warning("Failed parsing samplenames from samplesheet")
         return None
 
-    all_match = all([re.search(sample_pattern, x) for x in sample_names])
+    all_match = all([sample_pattern.search(x) for x in sample_names])
 
     if all_match:
         log.info("All samples in samplesheet match provided regex pattern")
@@ -185,11 +256,159 @@ def check_all_uploadable_samples(
         return False
 
 
+def _list_sub_directories(monitored_dir) -> List[str]:
+    """
+    List the paths of the sub directories in the given directory
+
+    Parameters
+    ----------
+    monitored_dir : str
+        directory to list
+
+    Returns
+    -------
+    list
+        paths of the sub directories
+    """
+    with scandir(monitored_dir) as entries:
+        return [entry.path for entry in entries if entry.is_dir()]
+
+
+def list_monitored_directories(monitor_dirs) -> dict:
+    """
+    List the sub directories of each of the given monitored directories.
+
+    The same directory may be monitored by more than one monitor config
+    (i.e. with different sample regex patterns), therefore each unique
+    directory is only listed once, concurrently since each listing is
+    bound by the latency of the (likely network) file system.
+
+    Parameters
+    ----------
+    monitor_dirs : list
+        list of directories to list
+
+    Returns
+    -------
+    dict
+        mapping of monitored directory to the paths of its sub directories
+    """
+    unique_dirs = list(dict.fromkeys(monitor_dirs))
+
+    with ThreadPoolExecutor(max_workers=max(len(unique_dirs), 1)) as pool:
+        return dict(
+            zip(unique_dirs, pool.map(_list_sub_directories, unique_dirs))
+        )
+
+
+def _check_run_directory(
+    sub_dir, log_dir, sample_pattern, max_age
+) -> Tuple[Union[str, None], dict]:
+    """
+    Check if the given sub directory of a monitored directory is a
+    completed sequencing run, if it has been uploaded and if it should be
+    uploaded
+
+    Parameters
+    ----------
+    sub_dir : str
+        path to directory to check
+    log_dir : str
+        directory where to read per run upload log files from
+    sample_pattern : str | re.Pattern
+        optional regex pattern that all samples from samplesheet must
+        match to be uploadable
+    max_age : int
+        maximum age in hours to monitor a run directory for uploading
+
+    Returns
+    -------
+    str | None
+        upload state of the run if it is to be uploaded, one of new or
+        partial, else None
+    dict
+        mapping of already uploaded files of the run to their remote
+        object ID
+    """
+    # list the run directory once to check for all of the
+    # expected files in place of checking each exists
+    try:
+        file_names = _list_file_names(sub_dir)
+    except OSError as err:
+        log.error("Failed listing %s, will not be uploaded: %s", sub_dir, err)
+        return None, {}
+
+    if not check_is_sequencing_run_dir(sub_dir, file_names):
+        log.debug(
+            "%s is not a sequencing run and will not be uploaded", sub_dir
+        )
+        return None, {}
+
+    if not check_termination_file_exists(sub_dir, file_names):
+        log.debug(
+            "%s has not completed sequencing and will not be uploaded",
+            sub_dir,
+        )
+        return None, {}
+
+    samplesheet_contents = read_samplesheet_from_run_directory(
+        sub_dir, files=file_names
+    )
+
+    if not samplesheet_contents:
+        log.error(
+            "Failed parsing samplesheet from %s, run will not be uploaded",
+            sub_dir,
+        )
+        return None, {}
+
+    if sample_pattern:
+        if not check_all_uploadable_samples(
+            samplesheet_contents=samplesheet_contents,
+            sample_pattern=sample_pattern,
+        ):
+            log.debug(
+                "One or more samples in samplesheet do not match the sample"
+                " pattern from the config [%s], run will not be uploaded",
+                getattr(sample_pattern, "pattern", sample_pattern),
+            )
+            return None, {}
+
+    upload_state, uploaded_files = check_upload_state(
+        run_dir=sub_dir, log_dir=log_dir
+    )
+
+    if upload_state == "uploaded":
+        log.info("%s has completed uploading and will be skipped", sub_dir)
+        return None, {}
+    elif upload_state == "partial":
+        log.info(
+            "%s has partially uploaded (%s files), will continue uploading",
+            sub_dir,
+            len(uploaded_files),
+        )
+        return "partial", uploaded_files
+    else:
+        # only try upload a newly picked up run if it's within age limit
+        if not check_run_age_within_limit(run_dir=sub_dir, max_age=max_age):
+            log.debug(
+                "%s older than maximum age (%s h) to monitor for upload and"
+                " will not be uploaded",
+                sub_dir,
+                max_age,
+            )
+            return None, {}
+
+        log.info("%s has not started uploading, to be uploaded", sub_dir)
+        return "new", uploaded_files
+
+
 def get_runs_to_upload(
     monitor_dirs,
     log_dir="/var/log/s3_upload",
     sample_pattern=None,
     max_age=72,
+    sub_directories=None,
 ) -> Tuple[list, dict]:
     """
     Get completed sequencing runs to upload from specified directories
@@ -201,11 +420,15 @@ def get_runs_to_upload(
         list of directories to check for completed sequencing runs
     log_dir : str
         directory where to read per run upload log files from
-    sample_pattern : str
+    sample_pattern : str | re.Pattern
         optional regex pattern that all samples from samplesheet must
         match to be uploadable
     max_age : int
         maximum age in hours to monitor a run directory for uploading
+    sub_directories : dict
+        optional mapping of monitored directory to its sub directories
+        from list_monitored_directories(), to not list again directories
+        already listed for another monitor config
 
     Returns
     -------
@@ -218,98 +441,82 @@ def get_runs_to_upload(
     to_upload = []
     partially_uploaded = {}
 
+    if sub_directories is None:
+        sub_directories = list_monitored_directories(monitor_dirs)
+
     for monitored_dir in monitor_dirs:
-        # check each sub directory if it looks like a sequencing run,
-        # if it has completed and if it has been uploaded
         log.info("Checking %s for completed sequencing runs", monitored_dir)
 
-        sub_directories = [
-            f.path for f in scandir(monitored_dir) if f.is_dir()
-        ]
-
         log.debug(
             "directories found in %s: %s",
             monitored_dir,
-            [Path(x).name for x in sub_directories],
+            [path.basename(x) for x in sub_directories[monitored_dir]],
         )
 
-        for sub_dir in sub_directories:
-            if not check_is_sequencing_run_dir(sub_dir):
-                log.debug(
-                    "%s is not a sequencing run and will not be uploaded",
-                    sub_dir,
-                )
-                continue
+    all_sub_directories = [x for y in monitor_dirs for x in sub_directories[y]]
+
+    # check each sub directory concurrently since each check is bound by
+    # the latency of listing and reading files from the file system
+    with ThreadPoolExecutor(
+        max_workers=max(min(32, len(all_sub_directories)), 1)
+    ) as pool:
+        all_states = list(
+            pool.map(
+                partial(
+                    _check_run_directory,
+                    log_dir=log_dir,
+                    sample_pattern=sample_pattern,
+                    max_age=max_age,
+                ),
+                all_sub_directories,
+            )
+        )
 
-            if not check_termination_file_exists(sub_dir):
-                log.debug(
-                    "%s has not completed sequencing and will not be uploaded",
-                    sub_dir,
-                )
-                continue
+    for sub_dir, (upload_state, uploaded_files) in zip(
+        all_sub_directories, all_states
+    ):
+        if upload_state == "partial":
+            partially_uploaded[sub_dir] = uploaded_files
+        elif upload_state == "new":
+            to_upload.append(sub_dir)
 
-            samplesheet_contents = read_samplesheet_from_run_directory(sub_dir)
+    return to_upload, partially_uploaded
 
-            if not samplesheet_contents:
-                log.error(
-                    "Failed parsing samplesheet from %s, run will not be"
-                    " uploaded",
-                    sub_dir,
-                )
-                continue
 
-            if sample_pattern:
-                if not check_all_uploadable_samples(
-                    samplesheet_contents=samplesheet_contents,
-                    sample_pattern=sample_pattern,
-                ):
-                    log.debug(
-                        "One or more samples in samplesheet do not match the"
-                        " sample pattern from the config [%s], run will not be"
-                        " uploaded",
-                        sample_pattern,
-                    )
-                    continue
+def _scan_files(directory) -> Iterator[DirEntry]:
+    """
+    Recursively yield the files in the given directory.
 
-            upload_state, uploaded_files = check_upload_state(
-                run_dir=sub_dir, log_dir=log_dir
-            )
+    This uses os.scandir to read the file type of each entry from the
+    directory listing, avoiding a stat call per entry to determine if it
+    is a file. Symlinked directories are not followed, whilst symlinked
+    files are returned, and hidden files and directories are skipped as
+    they were when using glob.
 
-            if upload_state == "uploaded":
-                log.info(
-                    "%s has completed uploading and will be skipped", sub_dir
-                )
+    Parameters
+    ----------
+    directory : str
+        path to directory to search
+
+    Yields
+    ------
+    os.DirEntry
+        entry of each file found
+    """
+    with scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
                 continue
-            elif upload_state == "partial":
-                log.info(
-                    "%s has partially uploaded (%s files), will continue"
-                    " uploading",
-                    sub_dir,
-                    len(uploaded_files),
-                )
-                partially_uploaded[sub_dir] = uploaded_files
-            else:
-                # only try upload a newly picked up run if it's within age limit
-                if not check_run_age_within_limit(
-                    run_dir=sub_dir, max_age=max_age
-                ):
-                    log.debug(
-                        "%s older than maximum age (%s h) to monitor for"
-                        " upload and will not be uploaded",
-                        sub_dir,
-                        max_age,
-                    )
-                    continue
 
-                log.info(
-                    "%s has not started uploading, to be uploaded", sub_dir
-                )
-                to_upload.append(sub_dir)
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file():
+                yield entry
 
-    return to_upload, partially_uploaded
 
-
-def get_sequencing_file_list(seq_dir, exclude_patterns=None) -> list:
+def get_sequencing_file_list(
+    seq_dir, exclude_patterns=None, sort_by_size=True
+) -> list:
     """
     Recursively get list of files and their paths from the given
     directory.
@@ -322,8 +529,12 @@ def get_sequencing_file_list(seq_dir, exclude_patterns=None) -> list:
     seq_dir : str
         path to search for files
     exclude_patterns : list
-        list of regex patterns against which to exclude files, matching
-        against the full file path and file name
+        list of regex patterns (either as strings or pre-compiled) against
+        which to exclude files, matching against the full file path and
+        file name
+    sort_by_size : bool
+        if to sort the files by their size, if False the files are not
+        stat'ed and are returned in the order found
 
     Returns
     -------
@@ -337,38 +548,54 @@ def get_sequencing_file_list(seq_dir, exclude_patterns=None) -> list:
     """
     log.info("Getting list of files to upload in %s", seq_dir)
 
-    if not Path(seq_dir).absolute().exists():
+    if not path.exists(seq_dir):
         log.error("Provided directory does not exist: %s", seq_dir)
         raise FileNotFoundError(
             f"Provided directory does not exist: {seq_dir}"
         )
 
-    files = sorted(
-        [
-            (x, stat(x).st_size)
-            for x in glob(f"{seq_dir}/**/*", recursive=True)
-            if Path(x).is_file()
-        ],
-        key=lambda x: x[1],
-        reverse=True,
-    )
+    entries = list(_scan_files(seq_dir))
 
-    log.info("Found %s files in %s", len(files), seq_dir)
+    log.info("Found %s files in %s", len(entries), seq_dir)
 
     if exclude_patterns:
+        # combine all patterns into a single compiled pattern to search
+        # each file against once, excluding files before reading their
+        # size to not stat files that will not be uploaded
+        exclude_regex = re.compile(
+            "|".join(re.compile(x).pattern for x in exclude_patterns)
+        )
+
         log.info(
             "Excluding files to upload against provided pattern(s): %s",
-            exclude_patterns,
+            exclude_regex.pattern,
         )
-        files = [
-            x
-            for x in files
-            if not re.search(r"|".join(exclude_patterns), x[0])
-        ]
+        entries = [x for x in entries if not exclude_regex.search(x.path)]
 
-    total_size = sizeof_fmt(sum(x[1] for x in files))
+    if not sort_by_size:
+        log.info("%s files found to upload", len(entries))
 
-    log.info(f"{len(files)} files found to upload totalling %s", total_size)
+        return [x.path for x in entries]
+
+    # sum the total size whilst reading each file size to not need a
+    # second pass over all files just to log it
+    files = []
+    total_size = 0
+
+    for entry in entries:
+        # DirEntry.stat() follows symlinks to give the size of the file
+        # that is uploaded, and is cached on the entry once called
+        file_size = entry.stat().st_size
+        total_size += file_size
+        files.append((entry.path, file_size))
+
+    files.sort(key=lambda x: x[1], reverse=True)
+
+    log.info(
+        "%s files found to upload totalling %s",
+        len(files),
+        sizeof_fmt(total_size),
+    )
 
     return [x[0] for x in files]
 
@@ -410,14 +637,16 @@ def get_samplenames_from_samplesheet(contents) -> Union[list, None]:
 
 def filter_uploaded_files(local_files, uploaded_files) -> list:
     """
-    Remove already uploaded files from list of local files to upload
+    Remove already uploaded files from list of local files to upload,
+    keeping the remaining files in their original order
 
     Parameters
     ----------
     local_files : list
         list of local files to upload
-    uploaded_files : list
-        list of files already uploaded
+    uploaded_files : list | set | dict
+        files already uploaded, either as a set or mapping of the files
+        to be used as is, or any iterable of files
 
     Returns
     -------
@@ -431,44 +660,23 @@ def filter_uploaded_files(local_files, uploaded_files) -> list:
         len(uploaded_files),
     )
 
-    uploadable_files = list(set(local_files) - set(uploaded_files))
+    # filter in place of a set difference to keep the local files in their
+    # order of size for uploading the largest files first
+    if not isinstance(uploaded_files, (set, dict)):
+        uploaded_files = set(uploaded_files)
+    uploadable_files = [x for x in local_files if x not in uploaded_files]
 
     log.debug("%s local files left to upload", len(uploadable_files))
 
     return uploadable_files
 
 
-def split_file_list_by_cores(files, n) -> List[List[str]]:
-    """
-    Split given list of files sorted by file size into n approximately
-    equal total size and length.
-
-    This is a reasonably naive approach to give us n lists of files with
-    an equal length and approximately equal split of small to large files,
-    allowing us to more evenly split the total amount of data to upload
-    between each ProcessPool.
-
-    Parameters
-    ----------
-    files : list
-        sorted list of files
-    n : int
-        number of sub lists to split file list to
-
-    Returns
-    ------
-    list
-        list of lists of filenames
-    """
-    files = [files[i : i + n] for i in range(0, len(files), n)]
-    files = [[x for x in y if x] for y in zip_longest(*files)]
-
-    return files
-
-
 def verify_config(config) -> None:
     """
-    Verify that config structure and parameters are valid
+    Verify that config structure and parameters are valid.
+
+    Any `sample_regex` and `exclude_patterns` regex patterns in the
+    monitor sections are compiled in place in the given config.
 
     Parameters
     ----------
@@ -494,6 +702,15 @@ def verify_config(config) -> None:
     if not isinstance(config.get("max_age", 0), int):
         errors.append("max_age must be a positive integer")
 
+    if not isinstance(config.get("http_send_buffer_bytes", 0), int):
+        errors.append("http_send_buffer_bytes must be an integer")
+
+    if config.get("upload_mode", "threads") not in ["threads", "async"]:
+        errors.append("upload_mode must be one of: threads, async")
+
+    if not isinstance(config.get("max_inflight", 0), int):
+        errors.append("max_inflight must be an integer")
+
     if config.get("log_level"):
         level = config.get("log_level")
         valid_str_levels = [
@@ -515,33 +732,48 @@ def verify_config(config) -> None:
         errors.append("required parameter monitor not defined")
 
     for idx, monitor in enumerate(config.get("monitor", "")):
-        for key, expected_type in {
-            "monitored_directories": list,
-            "bucket": str,
-            "remote_path": str,
-        }.items():
-            if not monitor.get(key):
+        for key, expected_type in MONITOR_SCHEMA:
+            value = monitor.get(key)
+
+            if not value:
                 errors.append(
                     f"required parameter {key} missing from monitor section"
                     f" {idx}"
                 )
-            else:
-                if not isinstance(monitor.get(key), expected_type):
-                    errors.append(
-                        f"{key} not of expected type from monitor section "
-                        f"{idx}. Expected: {expected_type} | Found "
-                        f"{type(monitor.get(key))}"
-                    )
+            elif not isinstance(value, expected_type):
+                errors.append(
+                    f"{key} not of expected type from monitor section "
+                    f"{idx}. Expected: {expected_type} | Found "
+                    f"{type(value)}"
+                )
 
+        # compile regex patterns once here to validate and to not need
+        # compiling again on every use
         if monitor.get("sample_regex"):
             try:
-                re.compile(monitor.get("sample_regex"))
+                monitor["sample_regex"] = re.compile(
+                    monitor.get("sample_regex")
+                )
             except Exception:
                 errors.append(
                     "Invalid regex pattern provided in monitor section "
                     f"{idx}: {monitor.get('sample_regex')}"
                 )
 
+        if monitor.get("exclude_patterns"):
+            compiled_patterns = []
+
+            for pattern in monitor.get("exclude_patterns"):
+                try:
+                    compiled_patterns.append(re.compile(pattern))
+                except Exception:
+                    errors.append(
+                        "Invalid exclude pattern provided in monitor section "
+                        f"{idx}: {pattern}"
+                    )
+
+            monitor["exclude_patterns"] = compiled_patterns
+
     if errors:
         error_message = (
             f"{len(errors)} errors found in config:{chr(10)}{chr(9)}"
@@ -569,8 +801,8 @@ def sizeof_fmt(num) -> str:
     str
         file size in human-readable format
     """
-    for unit in ["", "K", "M", "G", "T", "P", "E", "Z"]:
-        if abs(num) < 1024.0:
-            return f"{num:3.2f}{unit}B"
-        num /= 1024.0
-    return f"{num:.2f}YiB"
+    # pick the unit from the number of bits of the size, with each unit
+    # being 10 bits (1024x) larger than the previous
+    idx = min(max(int(abs(num)).bit_length() - 1, 0) // 10, 8)
+
+    return f"{num / (1 << (10 * idx)):3.2f}{SIZE_UNITS[idx]}B"
@@ -6,7 +6,9 @@ optimal to set for uploading
 
 import argparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
 import os
 from pathlib import Path
 from statistics import mean
@@ -122,14 +124,27 @@ def cleanup_remote_files(bucket, remote_path) -> None:
         .Bucket(bucket)
     )
 
-    objects = bucket.objects.filter(Prefix=remote_path)
-    objects = [{"Key": obj.key} for obj in objects]
+    objects = iter(bucket.objects.filter(Prefix=remote_path))
 
-    # delete_objects has a max request size of 1000 keys
-    objects = [objects[i : i + 1000] for i in range(0, len(objects), 1000)]
+    # delete_objects has a max request size of 1000 keys, therefore delete
+    # in chunks concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = []
 
-    for sub_objects in objects:
-        bucket.delete_objects(Delete={"Objects": sub_objects})
+        while True:
+            chunk = [{"Key": obj.key} for obj in islice(objects, 1000)]
+
+            if not chunk:
+                break
+
+            futures.append(
+                executor.submit(
+                    bucket.delete_objects, Delete={"Objects": chunk}
+                )
+            )
+
+        for future in futures:
+            future.result()
 
 
 def call_command(command) -> subprocess.CompletedProcess:
@@ -216,7 +231,7 @@ def run_benchmark(
 
     We are going to use subprocess.run to call the script instead of
     directly importing, this is so we can run memory-profiler to get
-    the maximum memory used across all child processes.
+    the maximum memory used by the upload process.
 
     Parameters
     ----------
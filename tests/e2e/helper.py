@@ -2,8 +2,10 @@
 Simple helper functions used in most tests for set up and clean up
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
+from itertools import islice
 import json
 from os import makedirs, path, remove
 from pathlib import Path
@@ -35,9 +37,7 @@ def create_files(run_dir, *files):
     """
     for file_path in files:
         full_path = path.join(run_dir, file_path)
-        parent_dir = Path(full_path).parent
-
-        makedirs(parent_dir, exist_ok=True)
+        makedirs(path.dirname(full_path), exist_ok=True)
         open(full_path, encoding="utf-8", mode="a").close()
 
 
@@ -82,11 +82,27 @@ def cleanup_remote_files(remote_path) -> None:
         .Bucket(S3_BUCKET)
     )
 
-    objects = bucket.objects.filter(Prefix=remote_path)
-    objects = [{"Key": obj.key} for obj in objects]
+    objects = iter(bucket.objects.filter(Prefix=remote_path))
+
+    # delete_objects has a max request size of 1000 keys, therefore delete
+    # in chunks concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = []
+
+        while True:
+            chunk = [{"Key": obj.key} for obj in islice(objects, 1000)]
+
+            if not chunk:
+                break
+
+            futures.append(
+                executor.submit(
+                    bucket.delete_objects, Delete={"Objects": chunk}
+                )
+            )
 
-    if objects:
-        bucket.delete_objects(Delete={"Objects": objects})
+        for future in futures:
+            future.result()
 
 
 def read_upload_log() -> dict:
@@ -20,30 +20,36 @@ class TestAcquireLock(unittest.TestCase):
             os.remove(self.test_lock)
 
     @patch("s3_upload.utils.io.os.open", wraps=os.open)
-    def test_when_lock_file_does_not_exist_the_correct_flag_set(
-        self, mock_open
-    ):
+    def test_lock_file_opened_without_truncating(self, mock_open):
         """
-        When the lock file does not already exist we should open the lock
-        file with O_RDWR (2), O_CREAT (64) and O_TRUNC (512). Therefore
-        the flag set for open should be 578
+        The lock file should be opened with O_RDWR and O_CREAT but not
+        O_TRUNC, to not lose the contents of a file locked by another
+        process, whether or not the lock file already exists
         """
-        io.acquire_lock(self.test_lock)
+        for exists in [False, True]:
+            with self.subTest(f"lock file exists: {exists}"):
+                if exists:
+                    open(self.test_lock, "w").close()
 
-        self.assertEqual(mock_open.call_args[1]["flags"], 578)
+                lock_fd = io.acquire_lock(self.test_lock)
 
-    @patch("s3_upload.utils.io.os.open", wraps=os.open)
-    def test_when_lock_file_exists_the_correct_flag_set(self, mock_open):
-        """
-        When the lock file already exists we should open the lock file
-        with only O_RDWR (2) and therefore the flag should be 2, which
-        will prevent the file from being truncated and losing contents.
-        """
-        open(self.test_lock, "w").close()
+                self.assertEqual(
+                    mock_open.call_args[1]["flags"], os.O_RDWR | os.O_CREAT
+                )
+
+                io.release_lock(lock_fd)
 
+    def test_contents_of_locked_file_not_lost_when_lock_not_acquired(self):
         io.acquire_lock(self.test_lock)
 
-        self.assertEqual(mock_open.call_args[1]["flags"], 2)
+        with open(self.test_lock) as fh:
+            lock_contents = fh.read()
+
+        with patch("s3_upload.utils.io.sys.exit"):
+            io.acquire_lock(self.test_lock)
+
+        with open(self.test_lock) as fh:
+            self.assertEqual(fh.read(), lock_contents)
 
     def test_file_lock_correctly_acquired_when_not_already_set(self):
         """
@@ -261,7 +267,13 @@ class TestReadUploadStateLog(unittest.TestCase):
 @patch("s3_upload.utils.io.os.path.exists")
 class TestWriteUploadStateToLog(unittest.TestCase):
     def tearDown(self):
-        os.remove(os.path.join(TEST_DATA_DIR, "test_run.upload.log.json"))
+        # os.path.exists is patched for the tests, list the dir to check
+        for file in [
+            "test_run.upload.log.json",
+            "test_run.upload.log.json.completed",
+        ]:
+            if file in os.listdir(TEST_DATA_DIR):
+                os.remove(os.path.join(TEST_DATA_DIR, file))
 
     def test_when_no_file_exists_for_fully_uploaded_run(self, mock_exists):
         mock_exists.return_value = False
@@ -296,9 +308,17 @@ class TestWriteUploadStateToLog(unittest.TestCase):
                 "file2.txt": "def456",
                 "file3.txt": "ghi789",
             },
+            "multipart_uploads": {},
         }
 
-        self.assertDictEqual(written_log_contents, expected_log_contents)
+        with self.subTest("log written"):
+            self.assertDictEqual(written_log_contents, expected_log_contents)
+
+        with self.subTest("completed marker written"):
+            self.assertIn(
+                "test_run.upload.log.json.completed",
+                os.listdir(TEST_DATA_DIR),
+            )
 
     def test_when_no_file_exists_for_partially_uploaded_run(self, mock_exists):
         mock_exists.return_value = False
@@ -328,10 +348,49 @@ class TestWriteUploadStateToLog(unittest.TestCase):
             "total_failed_upload": 1,
             "failed_upload_files": ["file3.txt"],
             "uploaded_files": {"file1.txt": "abc123", "file2.txt": "def456"},
+            "multipart_uploads": {},
         }
 
         self.assertDictEqual(written_log_contents, expected_log_contents)
 
+    def test_multipart_upload_state_written_to_log(self, mock_exists):
+        mock_exists.return_value = False
+        log_file = os.path.join(TEST_DATA_DIR, "test_run.upload.log.json")
+
+        multipart_uploads = {
+            "file2.txt": {
+                "bucket": "test_bucket",
+                "key": "test_run/file2.txt",
+                "upload_id": "upload_1",
+                "part_size": 1024,
+                "parts": [{"PartNumber": 1, "ETag": "abc", "Size": 1024}],
+            }
+        }
+
+        io.write_upload_state_to_log(
+            run_id="test_run",
+            run_path="/some/path/seq1/test_run",
+            log_file=log_file,
+            local_files=["file1.txt", "file2.txt"],
+            uploaded_files={"file1.txt": "abc123"},
+            failed_files=["file2.txt"],
+            multipart_uploads=multipart_uploads,
+        )
+
+        with open(log_file, "r") as fh:
+            written_log_contents = json.load(fh)
+
+        with self.subTest("multipart state written"):
+            self.assertDictEqual(
+                written_log_contents["multipart_uploads"], multipart_uploads
+            )
+
+        with self.subTest("temporary file moved into place"):
+            # os.path.exists is patched in this test class
+            self.assertNotIn(
+                "test_run.upload.log.json.tmp", os.listdir(TEST_DATA_DIR)
+            )
+
     def test_when_log_file_exists_that_complete_run_data_is_merged_in(
         self, mock_exists
     ):
@@ -378,6 +437,7 @@ class TestWriteUploadStateToLog(unittest.TestCase):
                 "file2.txt": "def456",
                 "file3.txt": "ghi789",
             },
+            "multipart_uploads": {},
         }
 
         with open(log_file, "r") as fh:
@@ -435,6 +495,7 @@ class TestWriteUploadStateToLog(unittest.TestCase):
                 "file1.txt": "abc123",
                 "file2.txt": "def456",
             },
+            "multipart_uploads": {},
         }
 
         with open(log_file, "r") as fh:
@@ -1,21 +1,29 @@
-from datetime import date, datetime, time, timedelta
+from datetime import date, timedelta
+import io
+from itertools import count
 import logging
 from logging import FileHandler
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
 import os
 from pathlib import Path
-from shutil import rmtree
-from uuid import uuid4
+from queue import SimpleQueue
+from tempfile import TemporaryDirectory
 import unittest
 from unittest.mock import patch
 
-import pytest
-
 from unit import TEST_DATA_DIR
 from s3_upload.utils import log
 
+_TEST_DATA_PATH = Path(TEST_DATA_DIR)
+
+# unique logger names only need to be unique within the test run
+_name_seq = count()
+
 
 class TestGetConsoleHandler(unittest.TestCase):
-    handler = log.get_console_handler()
+    @classmethod
+    def setUpClass(cls):
+        cls.handler = log.get_console_handler()
 
     def test_stream_handler_returned(self):
         self.assertIsInstance(self.handler, logging.StreamHandler)
@@ -26,23 +34,60 @@ class TestGetConsoleHandler(unittest.TestCase):
             "%(asctime)s [%(module)s] %(levelname)s: %(message)s",
         )
 
+    def test_formatted_message_emitted(self):
+        """
+        Test the format is applied to emitted records by writing to an
+        in memory stream, writing to the log file is tested separately
+        in TestSetFileHandler
+        """
+        handler = log.get_console_handler()
+        handler.setStream(io.StringIO())
+
+        logger = logging.getLogger(f"s3_upload_{next(_name_seq)}")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.info("testing")
+
+        self.assertIn("[test_log] INFO: testing", handler.stream.getvalue())
+
+
+class TestLogSuffix(unittest.TestCase):
+    def test_date_correctly_formatted(self):
+        self.assertEqual(
+            log._log_suffix(date(2024, 1, 9).toordinal()), "2024-01-09"
+        )
+
 
 class TestSetFileHandler(unittest.TestCase):
-    def setUp(self):
-        self.logger = log.get_logger(
-            f"s3_upload_{uuid4().hex}", log_level=logging.INFO
+    """
+    The logger and its file handler are shared between all tests, any
+    test that stops the listener must restart it once finished
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.today_str = date.today().isoformat()
+        cls.logger = log.get_logger(
+            f"s3_upload_{next(_name_seq)}", log_level=logging.INFO
         )
-        self.log_file = os.path.join(
+        cls.log_file = os.path.join(
             TEST_DATA_DIR,
-            f"s3_upload.log.{datetime.now().strftime('%Y-%m-%d')}",
+            f"s3_upload.log.{cls.today_str}",
         )
 
-        log.set_file_handler(self.logger, TEST_DATA_DIR)
-        self.logger.setLevel(5)
+        log.set_file_handler(cls.logger, TEST_DATA_DIR)
+        cls.logger.setLevel(5)
+
+        cls.listener = [
+            x for x in cls.logger.handlers if isinstance(x, QueueHandler)
+        ][0].listener
+
+    @classmethod
+    def tearDownClass(cls):
+        log.stop_listener(cls.listener)
 
-    def tearDown(self):
         log.clear_old_logs(
-            logger=self.logger, log_dir=TEST_DATA_DIR, backup_count=-1
+            logger=cls.logger, log_dir=TEST_DATA_DIR, backup_count=-1
         )
 
     def test_file_handler_correctly_set(self):
@@ -53,11 +98,17 @@ class TestSetFileHandler(unittest.TestCase):
                 "%(asctime)s [%(module)s] %(levelname)s: %(message)s",
             )
 
-        file_handler = [
-            x for x in self.logger.handlers if isinstance(x, FileHandler)
+        queue_handler = [
+            x for x in self.logger.handlers if isinstance(x, QueueHandler)
         ]
 
-        self.assertTrue(file_handler)
+        with self.subTest("queue handler attached to logger"):
+            self.assertTrue(queue_handler)
+
+        with self.subTest("listener writes to file handler"):
+            self.assertIsInstance(
+                queue_handler[0].listener.handlers[0], FileHandler
+            )
 
     def test_log_file_correctly_written_to(self):
         """
@@ -65,8 +116,13 @@ class TestSetFileHandler(unittest.TestCase):
         an attribute, so we can test the correct specified file is
         set by emitting a log message and reading from the file
         """
+        self.addCleanup(log.start_listener, self.listener)
+
         self.logger.info("testing")
 
+        # stop the listener to flush the queue to the file
+        log.stop_listener(self.listener)
+
         with open(self.log_file) as fh:
             log_contents = fh.read()
 
@@ -82,14 +138,33 @@ class TestSetFileHandler(unittest.TestCase):
 
             self.assertEqual(mock_file_handler.call_count, 0)
 
+    def test_stop_listener_can_be_called_more_than_once(self):
+        self.addCleanup(log.start_listener, self.listener)
+
+        log.stop_listener(self.listener)
+        log.stop_listener(self.listener)
+
+    def test_stop_listener_on_listener_never_started(self):
+        log.stop_listener(QueueListener(SimpleQueue()))
+
 
 class TestClearOldLogs(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.today_str = date.today().isoformat()
+
     def setUp(self):
         self.logger = log.get_logger(
-            f"s3_upload_{uuid4().hex}", log_level=logging.INFO
+            f"s3_upload_{next(_name_seq)}", log_level=logging.INFO
         )
 
+        # capture emitted records without a target to flush them to
+        self.log_records = MemoryHandler(capacity=10_000)
+        self.logger.addHandler(self.log_records)
+
     def tearDown(self):
+        self.logger.removeHandler(self.log_records)
+
         log.clear_old_logs(
             logger=self.logger, log_dir=TEST_DATA_DIR, backup_count=-1
         )
@@ -99,67 +174,59 @@ class TestClearOldLogs(unittest.TestCase):
         Log files older than specified `backup_count` days are determined
         from the YY-MM-DD suffix on the file name and should be removed
         """
-        five_days_ago = datetime.combine(
-            (date.today() - timedelta(days=5)), time()
-        ).strftime("%Y-%m-%d")
-        six_days_ago = datetime.combine(
-            (date.today() - timedelta(days=6)), time()
-        ).strftime("%Y-%m-%d")
-
-        open(
-            Path(TEST_DATA_DIR).joinpath(f"s3_upload.log.{five_days_ago}"),
-            encoding="utf-8",
-            mode="a",
-        ).close()
-        open(
-            Path(TEST_DATA_DIR).joinpath(f"s3_upload.log.{six_days_ago}"),
-            encoding="utf-8",
-            mode="a",
-        ).close()
+        five_days_ago = (date.today() - timedelta(days=5)).isoformat()
+        six_days_ago = (date.today() - timedelta(days=6)).isoformat()
+
+        for suffix in (five_days_ago, six_days_ago):
+            open(
+                os.path.join(TEST_DATA_DIR, f"s3_upload.log.{suffix}"), "w"
+            ).close()
 
         log.clear_old_logs(
             logger=self.logger, log_dir=TEST_DATA_DIR, backup_count=5
         )
 
+        remaining_files = set(os.listdir(TEST_DATA_DIR))
+
         with self.subTest("newer log file retained"):
-            self.assertTrue(
-                os.path.exists(
-                    Path(TEST_DATA_DIR).joinpath(
-                        f"s3_upload.log.{five_days_ago}"
-                    )
-                )
-            )
+            self.assertIn(f"s3_upload.log.{five_days_ago}", remaining_files)
 
         with self.subTest("older log file deleted"):
-            self.assertFalse(
-                os.path.exists(
-                    Path(TEST_DATA_DIR).joinpath(
-                        f"s3_upload.log.{six_days_ago}"
-                    )
-                )
-            )
+            self.assertNotIn(f"s3_upload.log.{six_days_ago}", remaining_files)
+
+    def test_files_without_date_suffix_are_not_deleted(self):
+        no_date_log = os.path.join(TEST_DATA_DIR, "s3_upload.log.backup")
+        open(no_date_log, "w").close()
 
-    @patch("s3_upload.utils.log.os.remove")
+        log.clear_old_logs(
+            logger=self.logger, log_dir=TEST_DATA_DIR, backup_count=-1
+        )
+
+        self.assertTrue(os.path.exists(no_date_log))
+
+        os.remove(no_date_log)
+
+    @patch.object(log.os, "remove")
     def test_errors_on_deleting_caught_and_logged_but_not_raised(
         self, mock_remove
     ):
         # create a log file
         log.set_file_handler(logger=self.logger, log_dir=TEST_DATA_DIR)
 
-        today_log = Path(TEST_DATA_DIR).joinpath(
-            f"s3_upload.log.{datetime.now().strftime('%Y-%m-%d')}"
-        )
+        today_log = _TEST_DATA_PATH / f"s3_upload.log.{self.today_str}"
 
         mock_remove.side_effect = OSError("file can not be deleted")
 
-        with self.assertLogs(self.logger) as log_output:
-            log.clear_old_logs(
-                logger=self.logger, log_dir=TEST_DATA_DIR, backup_count=-1
-            )
+        log.clear_old_logs(
+            logger=self.logger, log_dir=TEST_DATA_DIR, backup_count=-1
+        )
 
-            expected_log_error = f"Failed to delete old log file {today_log}"
+        expected_log_error = f"Failed to delete old log file {today_log}"
 
-            self.assertIn(expected_log_error, "".join(log_output.output))
+        self.assertIn(
+            expected_log_error,
+            [x.getMessage() for x in self.log_records.buffer],
+        )
 
 
 class TestCheckWritePermissionToLogDir(unittest.TestCase):
@@ -167,16 +234,12 @@ class TestCheckWritePermissionToLogDir(unittest.TestCase):
         log.check_write_permission_to_log_dir(TEST_DATA_DIR)
 
     def test_missing_dir_with_valid_parent_dir_does_not_raise_error(self):
-        test_log_dir = os.path.join(
-            TEST_DATA_DIR, "sub_directory_that_does_not_exist_yet"
-        )
-
-        Path(test_log_dir).mkdir(parents=True, exist_ok=True)
-
-        with self.subTest():
-            log.check_write_permission_to_log_dir(test_log_dir)
-
-        rmtree(test_log_dir)
+        with TemporaryDirectory(dir=TEST_DATA_DIR) as parent_dir:
+            log.check_write_permission_to_log_dir(
+                os.path.join(
+                    parent_dir, "sub_directory_that_does_not_exist_yet"
+                )
+            )
 
     def test_dir_with_no_write_permission_raises_permission_error(self):
         test_log_dir = "/"
@@ -186,9 +249,11 @@ class TestCheckWritePermissionToLogDir(unittest.TestCase):
             " have write permission for current user"
         )
 
-        with pytest.raises(PermissionError, match=expected_error):
+        with self.assertRaises(PermissionError) as error:
             log.check_write_permission_to_log_dir(test_log_dir)
 
+        self.assertEqual(str(error.exception), expected_error)
+
     def test_missing_dir_with_parent_dir_no_write_permission_raises_error(
         self,
     ):
@@ -199,14 +264,16 @@ class TestCheckWritePermissionToLogDir(unittest.TestCase):
             " have write permission for current user"
         )
 
-        with pytest.raises(PermissionError, match=expected_error):
+        with self.assertRaises(PermissionError) as error:
             log.check_write_permission_to_log_dir(test_log_dir)
 
+        self.assertEqual(str(error.exception), expected_error)
+
 
 class TestGetLogger(unittest.TestCase):
     def test_existing_logger_returned_when_already_exists(self):
-        # create new logger with a random name that won't already exist
-        random_log = uuid4().hex
+        # create new logger with a name that won't already exist
+        random_log = f"s3_upload_{next(_name_seq)}"
 
         logger = log.get_logger(
             logger_name=random_log,
@@ -0,0 +1,113 @@
+from argparse import Namespace
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+import pytest
+
+# s3_upload.py imports from utils as run as a script from its directory
+sys.path.append(
+    os.path.abspath(
+        os.path.join(os.path.realpath(__file__), "../../../s3_upload")
+    )
+)
+
+from s3_upload import s3_upload
+
+
+@patch("s3_upload.s3_upload.upload_single_run")
+@patch("s3_upload.s3_upload.set_http_send_buffer_size")
+@patch(
+    "s3_upload.s3_upload.parse_args",
+    return_value=Namespace(mode="upload"),
+)
+class TestMain(unittest.TestCase):
+    def test_big_http_buffer_set_from_environment(
+        self, mock_args, mock_buffer, mock_upload
+    ):
+        with patch.dict(os.environ, {"S3_UPLOAD_BIG_HTTP_BUFFER": "1"}):
+            s3_upload.main()
+
+        mock_buffer.assert_called_once_with(s3_upload.BIG_HTTP_BUFFER_SIZE)
+
+    def test_big_http_buffer_not_set_by_default(
+        self, mock_args, mock_buffer, mock_upload
+    ):
+        with patch.dict(os.environ):
+            os.environ.pop("S3_UPLOAD_BIG_HTTP_BUFFER", None)
+            s3_upload.main()
+
+        mock_buffer.assert_not_called()
+
+    def test_big_http_buffer_set_before_uploading(
+        self, mock_args, mock_buffer, mock_upload
+    ):
+        mock_upload.side_effect = lambda args: self.assertEqual(
+            mock_buffer.call_count, 1
+        )
+
+        with patch.dict(os.environ, {"S3_UPLOAD_BIG_HTTP_BUFFER": "1"}):
+            s3_upload.main()
+
+        mock_upload.assert_called_once()
+
+
+@patch("s3_upload.s3_upload.slack.post_message")
+class TestPostSlackMessages(unittest.TestCase):
+    messages = [("log_url", "completed"), ("alert_url", "failed")]
+
+    def test_all_messages_posted(self, mock_post):
+        s3_upload._post_slack_messages(self.messages)
+
+        self.assertEqual(
+            sorted(x.kwargs["url"] for x in mock_post.call_args_list),
+            ["alert_url", "log_url"],
+        )
+
+    def test_error_from_posting_raised(self, mock_post):
+        mock_post.side_effect = [None, TypeError("bug")]
+
+        with pytest.raises(TypeError, match="bug"):
+            s3_upload._post_slack_messages(self.messages)
+
+    def test_nothing_posted_for_no_messages(self, mock_post):
+        s3_upload._post_slack_messages([])
+
+        mock_post.assert_not_called()
+
+
+@patch("s3_upload.s3_upload.multi_core_upload")
+@patch("s3_upload.s3_upload.async_upload")
+@patch("s3_upload.s3_upload.get_sequencing_file_list", return_value=[])
+@patch("s3_upload.s3_upload.check_buckets_exist")
+@patch("s3_upload.s3_upload.check_aws_access")
+@patch("s3_upload.s3_upload.check_async_available")
+@patch("s3_upload.s3_upload.get_pool_connections", return_value=8)
+@patch("s3_upload.s3_upload.get_s3_client")
+class TestUploadSingleRun(unittest.TestCase):
+    def _args(self, async_upload):
+        return Namespace(
+            async_upload=async_upload,
+            skip_check=True,
+            local_path="/path/to/run1",
+            bucket="test_bucket",
+            remote_path="/",
+            cores=2,
+            threads=4,
+            max_inflight=512,
+        )
+
+    def test_pooled_client_not_created_for_async_upload(
+        self, mock_client, *mocks
+    ):
+        s3_upload.upload_single_run(self._args(async_upload=True))
+
+        mock_client.assert_not_called()
+
+    def test_pooled_client_created_for_thread_upload(
+        self, mock_client, mock_connections, *mocks
+    ):
+        s3_upload.upload_single_run(self._args(async_upload=False))
+
+        mock_client.assert_called_once_with(max_pool_connections=8)
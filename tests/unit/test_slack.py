@@ -5,6 +5,29 @@ from unittest.mock import patch
 from s3_upload.utils import slack
 
 
+class TestGetSession(unittest.TestCase):
+    def test_retries_set_on_https_adapter(self):
+        retries = slack._get_session().get_adapter("https://").max_retries
+
+        with self.subTest("total"):
+            self.assertEqual(retries.total, 3)
+
+        with self.subTest("rate limiting retried"):
+            self.assertIn(429, retries.status_forcelist)
+
+        with self.subTest("post retried"):
+            self.assertIn("POST", retries.allowed_methods)
+
+        with self.subTest("connection errors retried"):
+            self.assertEqual(retries.connect, 3)
+
+        with self.subTest("server errors not retried"):
+            self.assertEqual(retries.status_forcelist, [429])
+
+        with self.subTest("read errors not retried"):
+            self.assertEqual(retries.read, 0)
+
+
 class TestFormatCompleteMessage(unittest.TestCase):
     def test_suffix_set_correctly_for_one_run(self):
         """
@@ -58,7 +81,7 @@ class TestFormatCompleteMessage(unittest.TestCase):
         self.assertEqual(compiled_message, expected_message)
 
 
-@patch("s3_upload.utils.slack.requests.post")
+@patch("s3_upload.utils.slack._SESSION.post")
 class TestPostMessage(unittest.TestCase):
     def test_params_set_to_requests_post(self, mock_post):
         slack.post_message(
@@ -68,8 +91,7 @@ class TestPostMessage(unittest.TestCase):
 
         expected_call_args = {
             "url": "https://hooks.slack.com/services/00001",
-            "data": '{"text": "test message"}',
-            "headers": {"content-type": "application/json"},
+            "json": {"text": "test message"},
             "timeout": 30,
         }
 
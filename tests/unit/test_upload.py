@@ -1,18 +1,94 @@
-from concurrent.futures import Future
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.client import HTTPConnection
+import os
 import re
+from tempfile import TemporaryDirectory
+from threading import Lock
+import time
 import unittest
-from unittest.mock import ANY, call, Mock, patch
+from unittest.mock import ANY, call, mock_open, Mock, patch
 
 import boto3
 from botocore import exceptions as s3_exceptions
 import pytest
+from botocore.awsrequest import AWSHTTPSConnection
+from urllib3.connection import HTTPConnection as Urllib3HTTPConnection
+from urllib3.connection import HTTPSConnection as Urllib3HTTPSConnection
 
 from s3_upload.utils import upload
 
+# expected error messages, with their patterns to match against in
+# pytest.raises escaped and compiled once on import
+CONNECT_ERROR = (
+    "Error in connecting to AWS: An error occurred (1) "
+    "when calling the bar operation: foo"
+)
+BOTH_AUTH_ERROR = (
+    "Both `AWS_DEFAULT_PROFILE` provided as well as `AWS_ACCESS_KEY`"
+    " and / or `AWS_SECRET_KEY`. Only one authentication method may be"
+    " used."
+)
+NO_AUTH_ERROR = (
+    "Required environment variables for AWS authentication not"
+    " defined. Requires either `AWS_DEFAULT_PROFILE` or"
+    " `AWS_ACCESS_KEY` and `AWS_SECRET_KEY`."
+)
+INVALID_BUCKETS_ERROR = (
+    "2 bucket(s) not accessible or do not exist: invalid_bucket_1,"
+    " invalid_bucket_2"
+)
+MISSING_BUCKET_ERROR = "1 bucket(s) not accessible or do not exist: s3-test"
+
+CONNECT_ERROR_PATTERN = re.compile(re.escape(CONNECT_ERROR))
+BOTH_AUTH_ERROR_PATTERN = re.compile(re.escape(BOTH_AUTH_ERROR))
+NO_AUTH_ERROR_PATTERN = re.compile(re.escape(NO_AUTH_ERROR))
+INVALID_BUCKETS_ERROR_PATTERN = re.compile(re.escape(INVALID_BUCKETS_ERROR))
+MISSING_BUCKET_ERROR_PATTERN = re.compile(re.escape(MISSING_BUCKET_ERROR))
+
+
+class TestSetHttpSendBufferSize(unittest.TestCase):
+    def setUp(self):
+        self.defaults = (
+            HTTPConnection.__init__.__defaults__,
+            Urllib3HTTPConnection.__init__.__defaults__,
+            Urllib3HTTPConnection.__init__.__kwdefaults__,
+            Urllib3HTTPSConnection.__init__.__defaults__,
+            Urllib3HTTPSConnection.__init__.__kwdefaults__,
+        )
+
+    def tearDown(self):
+        (
+            HTTPConnection.__init__.__defaults__,
+            Urllib3HTTPConnection.__init__.__defaults__,
+            Urllib3HTTPConnection.__init__.__kwdefaults__,
+            Urllib3HTTPSConnection.__init__.__defaults__,
+            Urllib3HTTPSConnection.__init__.__kwdefaults__,
+        ) = self.defaults
+
+    def test_block_size_of_new_connections_set(self):
+        upload.set_http_send_buffer_size(1024**2)
+
+        with self.subTest("http.client"):
+            self.assertEqual(HTTPConnection("host").blocksize, 1024**2)
+
+        with self.subTest("urllib3"):
+            self.assertEqual(Urllib3HTTPConnection("host").blocksize, 1024**2)
+
+    def test_block_size_of_botocore_https_connections_set(self):
+        upload.set_http_send_buffer_size(1024**2)
+
+        self.assertEqual(AWSHTTPSConnection("host").blocksize, 1024**2)
+
 
 @patch("s3_upload.utils.upload.post_slack_message")
-@patch("s3_upload.utils.upload.boto3.Session")
+@patch("s3_upload.utils.upload.get_s3_client")
 class TestCheckAwsAccess(unittest.TestCase):
+    def setUp(self):
+        upload._list_buckets.cache_clear()
+
+    def tearDown(self):
+        upload._list_buckets.cache_clear()
+
     @patch("s3_upload.utils.upload.AWS_ACCESS_KEY", None)
     @patch("s3_upload.utils.upload.AWS_SECRET_KEY", None)
     @patch("s3_upload.utils.upload.AWS_DEFAULT_PROFILE", "baz")
@@ -20,10 +96,9 @@ class TestCheckAwsAccess(unittest.TestCase):
         self, mock_s3, mock_slack
     ):
 
-        mock_s3.return_value.resource.return_value.buckets.all.return_value = [
-            "bucket_1",
-            "bucket_2",
-        ]
+        mock_s3.return_value.list_buckets.return_value = {
+            "Buckets": ["bucket_1", "bucket_2"]
+        }
         returned_buckets = upload.check_aws_access()
 
         self.assertEqual(returned_buckets, ["bucket_1", "bucket_2"])
@@ -35,10 +110,9 @@ class TestCheckAwsAccess(unittest.TestCase):
         self, mock_s3, mock_slack
     ):
 
-        mock_s3.return_value.resource.return_value.buckets.all.return_value = [
-            "bucket_1",
-            "bucket_2",
-        ]
+        mock_s3.return_value.list_buckets.return_value = {
+            "Buckets": ["bucket_1", "bucket_2"]
+        }
         returned_buckets = upload.check_aws_access()
 
         self.assertEqual(returned_buckets, ["bucket_1", "bucket_2"])
@@ -53,12 +127,7 @@ class TestCheckAwsAccess(unittest.TestCase):
             {"Error": {"Code": 1, "Message": "foo"}}, "bar"
         )
 
-        expected_error = re.escape(
-            "Error in connecting to AWS: An error occurred (1) "
-            "when calling the bar operation: foo"
-        )
-
-        with pytest.raises(RuntimeError, match=expected_error):
+        with pytest.raises(RuntimeError, match=CONNECT_ERROR_PATTERN):
             upload.check_aws_access(slack_alert_webhook="my_webhook")
 
         with self.subTest("correct Slack message sent"):
@@ -78,13 +147,7 @@ class TestCheckAwsAccess(unittest.TestCase):
     def test_system_exit_raised_when_all_env_variables_set(
         self, mock_s3, mock_slack
     ):
-        expected_error = (
-            "Both `AWS_DEFAULT_PROFILE` provided as well as `AWS_ACCESS_KEY`"
-            " and / or `AWS_SECRET_KEY`. Only one authentication method may be"
-            " used."
-        )
-
-        with pytest.raises(SystemExit, match=re.escape(expected_error)):
+        with pytest.raises(SystemExit, match=BOTH_AUTH_ERROR_PATTERN):
             upload.check_aws_access()
 
     @patch("s3_upload.utils.upload.AWS_ACCESS_KEY", None)
@@ -93,21 +156,15 @@ class TestCheckAwsAccess(unittest.TestCase):
     def test_system_exit_raised_and_slack_alert_sent_when_no_env_variables_set(
         self, mock_s3, mock_slack
     ):
-        expected_error = (
-            "Required environment variables for AWS authentication not"
-            " defined. Requires either `AWS_DEFAULT_PROFILE` or"
-            " `AWS_ACCESS_KEY` and `AWS_SECRET_KEY`."
-        )
-
         with self.subTest("SystemExit raised"), pytest.raises(
-            SystemExit, match=re.escape(expected_error)
+            SystemExit, match=NO_AUTH_ERROR_PATTERN
         ):
             upload.check_aws_access(slack_alert_webhook="my_webhook")
 
         with self.subTest("Correct Slack message sent"):
             expected_slack_message = (
                 ":warning:  *S3 Upload*: Error in connecting to"
-                f" AWS!\n\n{expected_error}"
+                f" AWS!\n\n{NO_AUTH_ERROR}"
             )
 
             self.assertEqual(
@@ -117,8 +174,14 @@ class TestCheckAwsAccess(unittest.TestCase):
 
 
 @patch("s3_upload.utils.upload.post_slack_message")
-@patch("s3_upload.utils.upload.boto3.Session.client")
+@patch("s3_upload.utils.upload.get_s3_client")
 class TestCheckBucketsExist(unittest.TestCase):
+    def setUp(self):
+        upload._list_buckets.cache_clear()
+
+    def tearDown(self):
+        upload._list_buckets.cache_clear()
+
     def test_bucket_metadata_returned_when_bucket_exists(
         self, mock_client, mock_slack
     ):
@@ -153,22 +216,14 @@ class TestCheckBucketsExist(unittest.TestCase):
     def test_runtime_error_raised_if_one_or_more_buckets_not_valid(
         self, mock_client, mock_slack
     ):
-        mock_client.side_effect = [
+        mock_client.return_value.head_bucket.side_effect = (
             s3_exceptions.ClientError(
                 {"Error": {"Code": 1, "Message": "foo"}}, "bar"
-            ),
-            s3_exceptions.ClientError(
-                {"Error": {"Code": 1, "Message": "baz"}}, "blarg"
-            ),
-        ]
-
-        expected_error = (
-            "2 bucket(s) not accessible or do not exist: invalid_bucket_1,"
-            " invalid_bucket_2"
+            )
         )
 
         with self.subTest("RuntimeError raised"), pytest.raises(
-            RuntimeError, match=re.escape(expected_error)
+            RuntimeError, match=INVALID_BUCKETS_ERROR_PATTERN
         ):
             upload.check_buckets_exist(
                 buckets=["invalid_bucket_1", "invalid_bucket_2"],
@@ -178,7 +233,7 @@ class TestCheckBucketsExist(unittest.TestCase):
         with self.subTest("Correct Slack message sent"):
             expected_slack_message = (
                 ":warning:  *S3 Upload*: Error in accessing specified S3"
-                f" buckets!\n\n\t\t{expected_error}"
+                f" buckets!\n\n\t\t{INVALID_BUCKETS_ERROR}"
             )
 
             self.assertEqual(
@@ -189,16 +244,93 @@ class TestCheckBucketsExist(unittest.TestCase):
     def test_client_error_raised_when_bucket_does_not_exist(
         self, mock_client, mock_slack
     ):
-        mock_client.side_effect = s3_exceptions.ClientError(
-            {"Error": {"Code": 1, "Message": "foo"}}, "bar"
+        mock_client.return_value.head_bucket.side_effect = (
+            s3_exceptions.ClientError(
+                {"Error": {"Code": 1, "Message": "foo"}}, "bar"
+            )
         )
 
-        expected_error = "1 bucket(s) not accessible or do not exist: s3-test"
-
-        with pytest.raises(RuntimeError, match=re.escape(expected_error)):
+        with pytest.raises(RuntimeError, match=MISSING_BUCKET_ERROR_PATTERN):
             upload.check_buckets_exist(["s3-test"])
 
+    def test_only_invalid_buckets_returned_in_error(
+        self, mock_client, mock_slack
+    ):
+        def head_bucket(Bucket):
+            if Bucket.startswith("invalid"):
+                raise s3_exceptions.ClientError({}, "HeadBucket")
+
+            return {"Bucket": Bucket}
+
+        mock_client.return_value.head_bucket.side_effect = head_bucket
+
+        with pytest.raises(RuntimeError, match=INVALID_BUCKETS_ERROR_PATTERN):
+            upload.check_buckets_exist(
+                buckets=[
+                    "invalid_bucket_1",
+                    "valid_bucket",
+                    "invalid_bucket_2",
+                ]
+            )
+
+    def test_shared_client_used_for_all_buckets(self, mock_client, mock_slack):
+        upload.check_buckets_exist(["bucket_1", "bucket_2", "bucket_3"])
+
+        with self.subTest("shared client used"):
+            self.assertTrue(
+                all(x == call() for x in mock_client.call_args_list)
+            )
+
+        with self.subTest("all buckets checked"):
+            self.assertEqual(
+                mock_client.return_value.head_bucket.call_count, 3
+            )
+
+    def test_listed_buckets_not_checked_individually(
+        self, mock_client, mock_slack
+    ):
+        mock_client.return_value.list_buckets.return_value = {
+            "Buckets": [{"Name": "bucket_1"}, {"Name": "bucket_2"}]
+        }
+        mock_client.return_value.head_bucket.return_value = {
+            "BucketRegion": "eu-west-2"
+        }
+
+        bucket_details = upload.check_buckets_exist(
+            ["bucket_1", "bucket_2", "bucket_3"]
+        )
+
+        with self.subTest("only unlisted bucket checked"):
+            mock_client.return_value.head_bucket.assert_called_once_with(
+                Bucket="bucket_3"
+            )
+
+        with self.subTest("metadata returned in order of buckets"):
+            self.assertEqual(
+                bucket_details,
+                [
+                    {"Name": "bucket_1"},
+                    {"Name": "bucket_2"},
+                    {"BucketRegion": "eu-west-2"},
+                ],
+            )
+
+    def test_buckets_checked_individually_when_listing_fails(
+        self, mock_client, mock_slack
+    ):
+        mock_client.return_value.list_buckets.side_effect = (
+            s3_exceptions.ClientError(
+                {"Error": {"Code": "AccessDenied", "Message": "foo"}},
+                "ListBuckets",
+            )
+        )
+
+        upload.check_buckets_exist(["bucket_1", "bucket_2"])
+
+        self.assertEqual(mock_client.return_value.head_bucket.call_count, 2)
 
+
+@patch("s3_upload.utils.upload.open", mock_open(), create=True)
 @patch("s3_upload.utils.upload.boto3.session.Session.client")
 class TestUploadSingleFile(unittest.TestCase):
     def test_upload_path_correctly_set_from_input_file_and_parent_path(
@@ -232,6 +364,12 @@ class TestUploadSingleFile(unittest.TestCase):
                 "parent_path": "/one_level_parent/",
                 "expected_upload_path": "run1/Samplesheet.csv",
             },
+            {
+                "remote_path": "/",
+                "local_file": "/data/run+1 (copy)/run1/Samplesheet.csv",
+                "parent_path": "/data/run+1 (copy)/",
+                "expected_upload_path": "run1/Samplesheet.csv",
+            },
         ]
 
         for args in expected_inputs_and_upload_path:
@@ -245,13 +383,13 @@ class TestUploadSingleFile(unittest.TestCase):
                 )
 
                 self.assertEqual(
-                    mock_client.return_value.upload_file.call_args[1]["Key"],
+                    mock_client.return_value.put_object.call_args[1]["Key"],
                     args["expected_upload_path"],
                 )
 
     def test_local_file_name_and_object_id_returned(self, mock_client):
-        mock_client.return_value.get_object.return_value = {
-            "ETag": "remote_id"
+        mock_client.return_value.put_object.return_value = {
+            "ETag": '"remote_id"'
         }
 
         local_file, remote_id = upload.upload_single_file(
@@ -270,7 +408,585 @@ class TestUploadSingleFile(unittest.TestCase):
             ),
         )
 
+    @patch("s3_upload.utils.upload._get_file_size", return_value=1024)
+    @patch("s3_upload.utils.upload.multipart_upload_file")
+    def test_small_files_uploaded_in_single_request(
+        self, mock_multipart, mock_size, mock_client
+    ):
+        upload.upload_single_file(
+            s3_client=boto3.client(),
+            bucket="test_bucket",
+            remote_path="/",
+            local_file="/path/to/monitored_dir/run1/file.cbcl",
+            parent_path="/path/to/monitored_dir/",
+        )
+
+        with self.subTest("uploaded with put_object"):
+            mock_client.return_value.put_object.assert_called_once()
+
+        with self.subTest("no further request for object ID"):
+            mock_client.return_value.get_object.assert_not_called()
+
+        with self.subTest("not uploaded as multipart"):
+            mock_multipart.assert_not_called()
+
+    @patch(
+        "s3_upload.utils.upload._get_file_size",
+        return_value=upload.LARGE_FILE_THRESHOLD,
+    )
+    @patch("s3_upload.utils.upload.multipart_upload_file")
+    def test_large_files_uploaded_as_multipart(
+        self, mock_multipart, mock_size, mock_client
+    ):
+        mock_multipart.return_value = '"etag-1"'
+
+        local_file, remote_id = upload.upload_single_file(
+            s3_client=boto3.client(),
+            bucket="test_bucket",
+            remote_path="/",
+            local_file="/path/to/monitored_dir/run1/file.cbcl",
+            parent_path="/path/to/monitored_dir/",
+        )
+
+        with self.subTest("uploaded as multipart"):
+            self.assertEqual(
+                mock_multipart.call_args[1]["key"], "run1/file.cbcl"
+            )
+
+        with self.subTest("not uploaded with put_object"):
+            mock_client.return_value.put_object.assert_not_called()
+
+        with self.subTest("etag returned"):
+            self.assertEqual(remote_id, "etag-1")
+
+
+class TestGetUploadKey(unittest.TestCase):
+    def test_key_has_single_separators_and_no_leading_slash(self):
+        for remote_path in ["bucket_dir", "/bucket_dir", "/bucket_dir/"]:
+            with self.subTest(remote_path=remote_path):
+                self.assertEqual(
+                    upload._get_upload_key(
+                        local_file="/path/to/monitored_dir/run1/file.txt",
+                        parent_path="/path/to/monitored_dir",
+                        remote_path=remote_path,
+                    ),
+                    "bucket_dir/run1/file.txt",
+                )
+
+    def test_key_has_no_leading_slash_for_bucket_root(self):
+        for remote_path in ["", "/"]:
+            with self.subTest(remote_path=remote_path):
+                self.assertEqual(
+                    upload._get_upload_key(
+                        local_file="/path/to/monitored_dir/run1/file.txt",
+                        parent_path="/path/to/monitored_dir/",
+                        remote_path=remote_path,
+                    ),
+                    "run1/file.txt",
+                )
+
+
+@patch("s3_upload.utils.upload.time.sleep")
+@patch("s3_upload.utils.upload.upload_single_file")
+class TestUploadWithRetry(unittest.TestCase):
+    client_error = s3_exceptions.ClientError(
+        {"Error": {"Code": 500, "Message": "foo"}}, "PutObject"
+    )
+
+    def _upload(self):
+        return upload._upload_with_retry(
+            s3_client="client",
+            bucket="test_bucket",
+            remote_path="/",
+            local_file="/path/to/monitored_dir/run1/file.txt",
+            parent_path="/path/to/monitored_dir/",
+        )
+
+    def test_upload_retried_on_transient_error(self, mock_upload, mock_sleep):
+        mock_upload.side_effect = [
+            self.client_error,
+            ConnectionResetError(),
+            ("file.txt", "etag"),
+        ]
+
+        with self.subTest("result of successful attempt returned"):
+            self.assertEqual(self._upload(), ("file.txt", "etag"))
+
+        with self.subTest("backoff between attempts"):
+            self.assertEqual(mock_sleep.call_args_list, [call(1), call(2)])
+
+    def test_error_raised_after_last_attempt(self, mock_upload, mock_sleep):
+        mock_upload.side_effect = self.client_error
+
+        with self.subTest("error raised"), pytest.raises(
+            s3_exceptions.ClientError
+        ):
+            self._upload()
+
+        with self.subTest("all attempts made"):
+            self.assertEqual(mock_upload.call_count, upload.UPLOAD_ATTEMPTS)
+
+    def test_non_transient_error_not_retried(self, mock_upload, mock_sleep):
+        mock_upload.side_effect = FileNotFoundError()
+
+        with pytest.raises(FileNotFoundError):
+            self._upload()
+
+        self.assertEqual(mock_upload.call_count, 1)
+
+
+@patch("s3_upload.utils.upload.MULTIPART_CHUNKSIZE", 10)
+@patch("s3_upload.utils.upload._MULTIPART_UPLOADS", new_callable=dict)
+class TestMultipartUploadFile(unittest.TestCase):
+    def setUp(self):
+        # 25 byte file => 3 parts of 10, 10 and 5 bytes
+        self.tmp_dir = TemporaryDirectory()
+        self.local_file = os.path.join(self.tmp_dir.name, "file.cbcl")
+
+        with open(self.local_file, "wb") as fh:
+            fh.write(b"a" * 25)
+
+        self.s3_client = Mock()
+        self.s3_client.create_multipart_upload.return_value = {
+            "UploadId": "new_upload"
+        }
+        self.s3_client.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+        self.s3_client.complete_multipart_upload.return_value = {
+            "ETag": "final_etag"
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _upload(self):
+        return upload.multipart_upload_file(
+            s3_client=self.s3_client,
+            bucket="test_bucket",
+            key="run1/file.cbcl",
+            local_file=self.local_file,
+        )
+
+    def test_all_parts_uploaded_and_completed(self, mock_state):
+        etag = self._upload()
+
+        with self.subTest("all parts uploaded"):
+            self.assertEqual(
+                sorted(
+                    (x[1]["PartNumber"], len(x[1]["Body"]))
+                    for x in self.s3_client.upload_part.call_args_list
+                ),
+                [(1, 10), (2, 10), (3, 5)],
+            )
+
+        with self.subTest("completed with parts in order"):
+            self.assertEqual(
+                self.s3_client.complete_multipart_upload.call_args[1][
+                    "MultipartUpload"
+                ],
+                {
+                    "Parts": [
+                        {"PartNumber": 1, "ETag": "etag-1"},
+                        {"PartNumber": 2, "ETag": "etag-2"},
+                        {"PartNumber": 3, "ETag": "etag-3"},
+                    ]
+                },
+            )
+
+        with self.subTest("etag returned"):
+            self.assertEqual(etag, "final_etag")
+
+        with self.subTest("state removed on completing"):
+            self.assertEqual(mock_state, {})
+
+    def test_parts_read_from_correct_offsets(self, mock_state):
+        with open(self.local_file, "wb") as fh:
+            fh.write(b"0123456789abcdefghijVWXYZ")
+
+        self._upload()
+
+        self.assertEqual(
+            sorted(
+                (x[1]["PartNumber"], x[1]["Body"])
+                for x in self.s3_client.upload_part.call_args_list
+            ),
+            [(1, b"0123456789"), (2, b"abcdefghij"), (3, b"VWXYZ")],
+        )
+
+    @patch("s3_upload.utils.upload.ThreadPoolExecutor")
+    def test_no_pool_created_per_file(self, mock_pool, mock_state):
+        self._upload()
+
+        with self.subTest("no pool created"):
+            mock_pool.assert_not_called()
+
+        with self.subTest("all parts uploaded"):
+            self.assertEqual(self.s3_client.upload_part.call_count, 3)
+
+    def test_parts_in_flight_capped_across_files(self, mock_state):
+        # upload 2 files of 3 parts at once, recording the most parts
+        # uploading at one time against a shared pool of 2 workers
+        other_file = os.path.join(self.tmp_dir.name, "other.cbcl")
+
+        with open(other_file, "wb") as fh:
+            fh.write(b"b" * 25)
+
+        lock = Lock()
+        in_flight = []
+        peak = []
+
+        def upload_part(**kwargs):
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+
+            time.sleep(0.05)
+
+            with lock:
+                in_flight.pop()
+
+            return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+        self.s3_client.upload_part.side_effect = upload_part
+
+        with patch(
+            "s3_upload.utils.upload._PART_EXECUTOR",
+            ThreadPoolExecutor(max_workers=2),
+        ):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                jobs = [
+                    pool.submit(
+                        upload.multipart_upload_file,
+                        s3_client=self.s3_client,
+                        bucket="test_bucket",
+                        key=f"run1/{os.path.basename(x)}",
+                        local_file=x,
+                    )
+                    for x in [self.local_file, other_file]
+                ]
+
+                for job in jobs:
+                    job.result()
+
+        with self.subTest("all parts uploaded"):
+            self.assertEqual(self.s3_client.upload_part.call_count, 6)
+
+        with self.subTest("parts in flight capped"):
+            self.assertEqual(max(peak), 2)
+
+    def test_state_kept_when_part_fails_to_upload(self, mock_state):
+        def upload_part(**kwargs):
+            if kwargs["PartNumber"] == 2:
+                raise s3_exceptions.ClientError({}, "UploadPart")
+
+            return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+        self.s3_client.upload_part.side_effect = upload_part
+
+        with pytest.raises(s3_exceptions.ClientError):
+            self._upload()
+
+        state = upload.get_multipart_upload_state([self.local_file])
+
+        with self.subTest("upload not completed"):
+            self.s3_client.complete_multipart_upload.assert_not_called()
+
+        with self.subTest("uploaded parts stored"):
+            self.assertEqual(
+                sorted(
+                    x["PartNumber"] for x in state[self.local_file]["parts"]
+                ),
+                [1, 3],
+            )
+
+    def test_previous_upload_resumed_from_uploaded_parts(self, mock_state):
+        upload.load_multipart_upload_state(
+            {
+                self.local_file: {
+                    "bucket": "test_bucket",
+                    "key": "run1/file.cbcl",
+                    "upload_id": "previous_upload",
+                    "part_size": 10,
+                    "parts": [],
+                }
+            }
+        )
+
+        self.s3_client.get_paginator.return_value.paginate.return_value = [
+            {
+                "Parts": [
+                    {"PartNumber": 1, "ETag": "etag-1", "Size": 10},
+                    {"PartNumber": 3, "ETag": "etag-3", "Size": 5},
+                ]
+            }
+        ]
+
+        self._upload()
+
+        with self.subTest("no new upload created"):
+            self.s3_client.create_multipart_upload.assert_not_called()
+
+        with self.subTest("only missing part uploaded"):
+            self.assertEqual(
+                [
+                    x[1]["PartNumber"]
+                    for x in self.s3_client.upload_part.call_args_list
+                ],
+                [2],
+            )
+
+        with self.subTest("completed with previous upload ID"):
+            self.assertEqual(
+                self.s3_client.complete_multipart_upload.call_args[1][
+                    "UploadId"
+                ],
+                "previous_upload",
+            )
+
+    def test_new_upload_started_when_previous_upload_not_found(
+        self, mock_state
+    ):
+        upload.load_multipart_upload_state(
+            {
+                self.local_file: {
+                    "bucket": "test_bucket",
+                    "key": "run1/file.cbcl",
+                    "upload_id": "expired_upload",
+                    "part_size": 10,
+                    "parts": [],
+                }
+            }
+        )
+
+        self.s3_client.get_paginator.return_value.paginate.side_effect = (
+            s3_exceptions.ClientError({}, "ListParts")
+        )
+
+        self._upload()
+
+        with self.subTest("new upload created"):
+            self.s3_client.create_multipart_upload.assert_called_once()
+
+        with self.subTest("all parts uploaded"):
+            self.assertEqual(self.s3_client.upload_part.call_count, 3)
+
+
+@patch("s3_upload.utils.upload._S3_CLIENT", None)
+@patch("s3_upload.utils.upload.boto3.session.Session")
+class TestGetS3Client(unittest.TestCase):
+    def test_client_only_created_once_and_reused(self, mock_session):
+        client_1 = upload.get_s3_client(max_pool_connections=8)
+        client_2 = upload.get_s3_client(max_pool_connections=8)
+
+        with self.subTest("same client returned"):
+            self.assertIs(client_1, client_2)
+
+        with self.subTest("session only created once"):
+            self.assertEqual(mock_session.call_count, 1)
+
+    def test_client_config_correctly_set(self, mock_session):
+        upload.get_s3_client(max_pool_connections=8)
+
+        config = mock_session.return_value.client.call_args[1]["config"]
+
+        with self.subTest("pool connections"):
+            self.assertEqual(config.max_pool_connections, 8)
+
+        with self.subTest("retries"):
+            self.assertEqual(
+                config.retries, {"max_attempts": 10, "mode": "adaptive"}
+            )
+
+        with self.subTest("tcp keepalive"):
+            self.assertTrue(config.tcp_keepalive)
+
+        with self.subTest("request compression disabled"):
+            self.assertTrue(config.disable_request_compression)
+
+
+@patch("s3_upload.utils.upload.resource.getrlimit")
+class TestGetPoolConnections(unittest.TestCase):
+    def test_headroom_for_multipart_parts_added(self, mock_limit):
+        mock_limit.return_value = (1024, 1024)
+
+        self.assertEqual(
+            upload.get_pool_connections(threads=32),
+            32 + upload.MULTIPART_CONCURRENCY,
+        )
+
+    def test_connections_cover_shared_part_pool(self, mock_limit):
+        mock_limit.return_value = (1024, 1024)
+
+        self.assertEqual(
+            upload.get_pool_connections(threads=32),
+            32 + upload._PART_EXECUTOR._max_workers,
+        )
+
+    @patch("s3_upload.utils.upload.log")
+    def test_warning_logged_when_open_file_limit_may_be_exceeded(
+        self, mock_log, mock_limit
+    ):
+        mock_limit.return_value = (64, 1024)
+
+        upload.get_pool_connections(threads=32)
+
+        self.assertIn("ulimit -n", mock_log.warning.call_args[0][0])
+
+
+@patch("s3_upload.utils.upload.upload_single_file")
+class TestSubmitUpload(unittest.TestCase):
+    local_files = [
+        "/path/to/monitored_dir/run1/Samplesheet.csv",
+        "/path/to/monitored_dir/run1/RunInfo.xml",
+    ]
+
+    def test_one_future_submitted_per_file_to_given_executor(
+        self, mock_upload
+    ):
+        mock_executor = Mock()
+        mock_executor.submit.side_effect = [Future(), Future()]
+
+        concurrent_jobs = upload.submit_upload(
+            executor=mock_executor,
+            s3_client="client",
+            files=self.local_files,
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path="/path/to/monitored_dir/",
+        )
+
+        with self.subTest("one call per file"):
+            self.assertEqual(mock_executor.submit.call_count, 2)
+
+        with self.subTest("shared client passed to every upload"):
+            self.assertTrue(
+                all(
+                    x[0][0].keywords["s3_client"] == "client"
+                    for x in mock_executor.submit.call_args_list
+                )
+            )
+
+        with self.subTest("futures mapped to files"):
+            self.assertEqual(
+                sorted(concurrent_jobs.values()), sorted(self.local_files)
+            )
+
+    @patch("s3_upload.utils.upload.path.getsize")
+    def test_files_submitted_largest_first(self, mock_size, mock_upload):
+        mock_size.side_effect = lambda x: {
+            "small.txt": 1,
+            "large.txt": 100,
+            "medium.txt": 10,
+        }[x]
+        mock_executor = Mock()
+        mock_executor.submit.side_effect = [Future(), Future(), Future()]
+
+        upload.submit_upload(
+            executor=mock_executor,
+            s3_client="client",
+            files=["small.txt", "large.txt", "medium.txt"],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path="/",
+        )
+
+        self.assertEqual(
+            [x[1]["local_file"] for x in mock_executor.submit.call_args_list],
+            ["large.txt", "medium.txt", "small.txt"],
+        )
+
+    @patch("s3_upload.utils.upload.path.getsize")
+    def test_file_sizes_read_once_and_passed_to_upload(
+        self, mock_size, mock_upload
+    ):
+        mock_size.side_effect = lambda x: {"small.txt": 1, "large.txt": 100}[x]
+        mock_executor = Mock()
+        mock_executor.submit.side_effect = [Future(), Future()]
+
+        upload.submit_upload(
+            executor=mock_executor,
+            s3_client="client",
+            files=["small.txt", "large.txt"],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path="/",
+        )
+
+        with self.subTest("size read once per file"):
+            self.assertEqual(mock_size.call_count, 2)
+
+        with self.subTest("sizes passed to upload"):
+            self.assertEqual(
+                mock_executor.submit.call_args[0][0].keywords["file_sizes"],
+                {"small.txt": 1, "large.txt": 100},
+            )
+
+    def test_inaccessible_file_still_submitted(self, mock_upload):
+        mock_executor = Mock()
+        mock_executor.submit.side_effect = [Future()]
+
+        concurrent_jobs = upload.submit_upload(
+            executor=mock_executor,
+            s3_client="client",
+            files=["/file/that/does/not/exist.txt"],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path="/",
+        )
+
+        self.assertEqual(
+            list(concurrent_jobs.values()), ["/file/that/does/not/exist.txt"]
+        )
+
+
+class TestCollectUploadResults(unittest.TestCase):
+    def test_uploaded_and_failed_files_correctly_returned(self):
+        submitted_futures = [Future(), Future()]
+        submitted_futures[0].set_result(("file1.txt", "abc"))
+        submitted_futures[1].set_exception(
+            s3_exceptions.ClientError(
+                {"Error": {"Code": 1, "Message": "foo"}}, "bar"
+            ),
+        )
+
+        uploaded_files, failed_files = upload.collect_upload_results(
+            dict(zip(submitted_futures, ["file1.txt", "file2.txt"]))
+        )
+
+        self.assertEqual(
+            (uploaded_files, failed_files),
+            ({"file1.txt": "abc"}, ["file2.txt"]),
+        )
+
+    def test_unexpected_error_raised(self):
+        submitted_futures = [Future()]
+        submitted_futures[0].set_exception(TypeError("bug"))
+
+        with pytest.raises(TypeError, match="bug"):
+            upload.collect_upload_results(
+                dict(zip(submitted_futures, ["file1.txt"]))
+            )
 
+    @patch("s3_upload.utils.upload.PROGRESS_LOG_INTERVAL", 2)
+    @patch("s3_upload.utils.upload.log")
+    def test_progress_logged_at_interval(self, mock_log):
+        submitted_futures = [Future() for _ in range(5)]
+
+        for idx, future in enumerate(submitted_futures):
+            future.set_result((f"file{idx}.txt", "abc"))
+
+        upload.collect_upload_results(
+            {x: f"file{idx}.txt" for idx, x in enumerate(submitted_futures)}
+        )
+
+        self.assertEqual(
+            [x[0][1:] for x in mock_log.info.call_args_list],
+            [(2, 5, 0), (4, 5, 0)],
+        )
+
+
+@patch("s3_upload.utils.upload._S3_CLIENT", None)
 @patch("s3_upload.utils.upload.as_completed")
 @patch("s3_upload.utils.upload.upload_single_file")
 @patch("s3_upload.utils.upload.boto3.session.Session.client")
@@ -327,6 +1043,7 @@ class TestMultiThreadUpload(unittest.TestCase):
                 remote_path="/",
                 local_file="/path/to/monitored_dir/run1/Samplesheet.csv",
                 parent_path="/path/to/monitored_dir/",
+                file_sizes=ANY,
             ),
             call(
                 s3_client=ANY,
@@ -334,6 +1051,7 @@ class TestMultiThreadUpload(unittest.TestCase):
                 remote_path="/",
                 local_file="/path/to/monitored_dir/run1/RunInfo.xml",
                 parent_path="/path/to/monitored_dir/",
+                file_sizes=ANY,
             ),
             call(
                 s3_client=ANY,
@@ -341,6 +1059,7 @@ class TestMultiThreadUpload(unittest.TestCase):
                 remote_path="/",
                 local_file="/path/to/monitored_dir/run1/CopyComplete.txt",
                 parent_path="/path/to/monitored_dir/",
+                file_sizes=ANY,
             ),
         ]
 
@@ -348,6 +1067,57 @@ class TestMultiThreadUpload(unittest.TestCase):
             expected_call_args_for_all_calls, mock_upload.call_args_list
         )
 
+    @patch("s3_upload.utils.upload.get_s3_client")
+    @patch("s3_upload.utils.upload.ThreadPoolExecutor")
+    def test_empty_input_returns_empty_without_pool(
+        self,
+        mock_pool,
+        mock_get_client,
+        mock_client,
+        mock_upload,
+        mock_completed,
+    ):
+        uploaded_files, failed_files = upload.multi_thread_upload(
+            files=[],
+            bucket="test_bucket",
+            remote_path="/",
+            threads=4,
+            parent_path="/path/to/monitored_dir/",
+        )
+
+        with self.subTest("empty results"):
+            self.assertEqual((uploaded_files, failed_files), ({}, []))
+
+        with self.subTest("no pool or client created"):
+            self.assertEqual(
+                (mock_pool.call_count, mock_get_client.call_count), (0, 0)
+            )
+
+    @patch("s3_upload.utils.upload._S3_CLIENT", None)
+    @patch("s3_upload.utils.upload.boto3.session.Session")
+    def test_single_client_shared_by_all_uploads(
+        self, mock_session, mock_client, mock_upload, mock_completed
+    ):
+        upload.multi_thread_upload(
+            files=self.local_files,
+            bucket="test_bucket",
+            remote_path="/",
+            threads=4,
+            parent_path="/path/to/monitored_dir/",
+        )
+
+        with self.subTest("session only created once"):
+            self.assertEqual(mock_session.call_count, 1)
+
+        with self.subTest("same client used for all uploads"):
+            self.assertEqual(
+                {
+                    id(x.kwargs["s3_client"])
+                    for x in mock_upload.call_args_list
+                },
+                {id(mock_session.return_value.client.return_value)},
+            )
+
     def test_correct_file_and_id_returned(
         self, mock_client, mock_upload, mock_completed
     ):
@@ -455,69 +1225,36 @@ class TestMultiThreadUpload(unittest.TestCase):
             self.assertEqual(failed_files, ["file2.txt", "file3.txt"])
 
 
+@patch("s3_upload.utils.upload.multi_thread_upload")
 class TestMultiCoreUpload(unittest.TestCase):
 
     local_files = [
-        ["/path/to/monitored_dir/run1/Samplesheet.csv"],
-        ["/path/to/monitored_dir/run1/RunInfo.xml"],
-        ["/path/to/monitored_dir/run1/CopyComplete.txt"],
+        "/path/to/monitored_dir/run1/Samplesheet.csv",
+        "/path/to/monitored_dir/run1/RunInfo.xml",
+        "/path/to/monitored_dir/run1/CopyComplete.txt",
     ]
 
-    @patch("s3_upload.utils.upload.as_completed")
-    @patch("s3_upload.utils.upload.ProcessPoolExecutor")
-    def test_correct_number_of_process_pools_set_from_cores_arg(
-        self, mock_pool, mock_completed
-    ):
-        for core in [1, 4]:
-            with self.subTest(f"{core} core(s) set to use"):
+    def test_single_thread_pool_of_cores_by_threads_used(self, mock_thread):
+        mock_thread.return_value = ({}, [])
+
+        for core, thread in [(1, 1), (2, 4)]:
+            with self.subTest(f"{core} core(s) and {thread} thread(s)"):
                 upload.multi_core_upload(
                     files=self.local_files,
                     bucket="test_bucket",
                     remote_path="/",
                     cores=core,
-                    threads=1,
+                    threads=thread,
                     parent_path="/path/to/monitored_dir/",
                 )
-                self.assertEqual(mock_pool.call_args[1]["max_workers"], core)
-
-    @patch("s3_upload.utils.upload.as_completed")
-    @patch("s3_upload.utils.upload._submit_to_pool")
-    @patch("s3_upload.utils.upload.ProcessPoolExecutor")
-    def test_returned_file_mapping_correct_for_all_successfully_uploading(
-        self, mock_pool, mock_submit, mock_completed
-    ):
-        # each ProcessPool should return a dict mapping from each ThreadPool
-        # of local file to remote object ID, these should then be finally
-        # merged and returned as a single level dict
-        submitted_futures = [Future(), Future(), Future()]
-
-        # set futures and their response for return of as_completed()
-        mock_completed.return_value = submitted_futures
-
-        return_values = [
-            ({"/path/to/monitored_dir/run1/Samplesheet.csv": "abc"}, []),
-            ({"/path/to/monitored_dir/run1/RunInfo.xml": "def"}, []),
-            ({"/path/to/monitored_dir/run1/CopyComplete.txt": "ghi"}, []),
-        ]
-
-        for i, j in zip(mock_completed.return_value, return_values):
-            i.set_result(j)
+                self.assertEqual(
+                    mock_thread.call_args[1]["threads"], core * thread
+                )
 
-        # set the response of the _submit_to_pool to be the dict mapping
-        # the futures to input file lists
-        mock_submit.return_value = {
-            future: input_file
-            for future, input_file in zip(
-                submitted_futures,
-                [
-                    ["/path/to/monitored_dir/run1/Samplesheet.csv"],
-                    ["/path/to/monitored_dir/run1/RunInfo.xml"],
-                    ["/path/to/monitored_dir/run1/CopyComplete.txt"],
-                ],
-            )
-        }
+    def test_flat_file_list_passed_through_to_upload(self, mock_thread):
+        mock_thread.return_value = ({}, [])
 
-        uploaded_files, failed_files = upload.multi_core_upload(
+        upload.multi_core_upload(
             files=self.local_files,
             bucket="test_bucket",
             remote_path="/",
@@ -526,140 +1263,61 @@ class TestMultiCoreUpload(unittest.TestCase):
             parent_path="/path/to/monitored_dir/",
         )
 
-        expected_local_file_to_remote_id_mapping = {
-            "/path/to/monitored_dir/run1/Samplesheet.csv": "abc",
-            "/path/to/monitored_dir/run1/RunInfo.xml": "def",
-            "/path/to/monitored_dir/run1/CopyComplete.txt": "ghi",
-        }
-
-        with self.subTest("all files uploaded"):
-            self.assertEqual(
-                expected_local_file_to_remote_id_mapping,
-                uploaded_files,
-            )
-
-        with self.subTest("no failed uploads"):
-            self.assertEqual(failed_files, [])
-
-    @patch("s3_upload.utils.upload.as_completed")
-    @patch("s3_upload.utils.upload._submit_to_pool")
-    @patch("s3_upload.utils.upload.ProcessPoolExecutor")
-    def test_returned_file_mapping_correct_for_failed_upload_in_child_thread(
-        self, mock_pool, mock_submit, mock_completed
-    ):
-        """
-        Test that if an error occurs in the child ThreadPoolExecutor and
-        returns a list of files that failed to upload that these are merged
-        and returned
-        """
-        # each ProcessPool should return a dict mapping from each ThreadPool
-        # of local file to remote object ID, these should then be finally
-        # merged and returned as a single level dict
-        submitted_futures = [Future(), Future(), Future()]
-
-        # set futures and their response for return of as_completed(),
-        # include 2 successful uploads and one fail
-        mock_completed.return_value = submitted_futures
+        self.assertEqual(mock_thread.call_args[1]["files"], self.local_files)
 
-        return_values = [
-            ({"/path/to/monitored_dir/run1/Samplesheet.csv": "abc"}, []),
-            ({"/path/to/monitored_dir/run1/RunInfo.xml": "def"}, []),
-            ({}, ["/path/to/monitored_dir/run1/CopyComplete.txt"]),
-        ]
+    def test_no_process_pool_used(self, mock_thread):
+        self.assertFalse(hasattr(upload, "ProcessPoolExecutor"))
 
-        for i, j in zip(mock_completed.return_value, return_values):
-            i.set_result(j)
-
-        # set the response of the _submit_to_pool to be the dict mapping
-        # the futures to input file lists
-        mock_submit.return_value = {
-            future: input_file
-            for future, input_file in zip(
-                submitted_futures,
-                [
-                    ["/path/to/monitored_dir/run1/Samplesheet.csv"],
-                    ["/path/to/monitored_dir/run1/RunInfo.xml"],
-                    ["/path/to/monitored_dir/run1/CopyComplete.txt"],
-                ],
-            )
-        }
+    def test_files_only_submitted_for_upload_once(self, mock_thread):
+        mock_thread.return_value = ({}, [])
 
-        uploaded_files, failed_files = upload.multi_core_upload(
+        upload.multi_core_upload(
             files=self.local_files,
             bucket="test_bucket",
             remote_path="/",
             cores=3,
-            threads=1,
+            threads=2,
             parent_path="/path/to/monitored_dir/",
         )
 
-        expected_uploaded_files = {
-            "/path/to/monitored_dir/run1/Samplesheet.csv": "abc",
-            "/path/to/monitored_dir/run1/RunInfo.xml": "def",
-        }
-
-        expected_failed_files = [
-            "/path/to/monitored_dir/run1/CopyComplete.txt"
-        ]
-
-        with self.subTest("all files uploaded"):
-            self.assertEqual(
-                expected_uploaded_files,
-                uploaded_files,
-            )
-
-        with self.subTest("no failed uploads"):
-            self.assertEqual(failed_files, expected_failed_files)
+        self.assertEqual(mock_thread.call_count, 1)
 
-    @patch("s3_upload.utils.upload.as_completed")
-    @patch("s3_upload.utils.upload._submit_to_pool")
-    @patch("s3_upload.utils.upload.ProcessPoolExecutor")
-    def test_exception_correctly_handled_from_parent_process(
-        self, mock_pool, mock_submit, mock_completed
-    ):
-        """
-        Test that if an error occurs in one of the main ProcessPoolExecutors
-        and that we catch this to not actually exit, the error will be logged
-        and failed set of upload files returned for alerting via Slack and
-        retrying on next call
-        """
-        # set a submitted future to mock a single core upload, we will
-        # raise an exception for when accessing its result object
-        submitted_futures = [Mock()]
-        submitted_futures[0].result.side_effect = RuntimeError(
-            "unhandled test exception"
+    def test_uploaded_and_failed_files_returned(self, mock_thread):
+        mock_thread.return_value = (
+            {
+                "/path/to/monitored_dir/run1/Samplesheet.csv": "abc",
+                "/path/to/monitored_dir/run1/RunInfo.xml": "def",
+            },
+            ["/path/to/monitored_dir/run1/CopyComplete.txt"],
         )
-        mock_completed.return_value = submitted_futures
-
-        mock_submit.return_value = {submitted_futures[0]: self.local_files}
-
-        with self.subTest("Error correctly caught and logged"):
-            expected_error = (
-                "Failed uploading 3 files for a single ProcessPool due to an"
-                " unhandled error: unhandled test exception"
-            )
-            with self.assertLogs("s3_upload", level="ERROR") as log:
-                upload.multi_core_upload(
-                    files=self.local_files,
-                    bucket="test_bucket",
-                    remote_path="/",
-                    cores=1,
-                    threads=1,
-                    parent_path="/path/to/monitored_dir/",
-                )
 
-                self.assertIn(expected_error, "".join(log.output))
-
-        with self.subTest("correctly returned no upload and all failed files"):
+        with self.assertLogs("s3_upload", level="ERROR") as log:
             uploaded_files, failed_files = upload.multi_core_upload(
                 files=self.local_files,
                 bucket="test_bucket",
                 remote_path="/",
-                cores=1,
+                cores=3,
                 threads=1,
                 parent_path="/path/to/monitored_dir/",
             )
 
+        with self.subTest("uploaded files returned"):
             self.assertEqual(
-                (uploaded_files, failed_files), ({}, self.local_files)
+                uploaded_files,
+                {
+                    "/path/to/monitored_dir/run1/Samplesheet.csv": "abc",
+                    "/path/to/monitored_dir/run1/RunInfo.xml": "def",
+                },
+            )
+
+        with self.subTest("failed files returned"):
+            self.assertEqual(
+                failed_files,
+                ["/path/to/monitored_dir/run1/CopyComplete.txt"],
+            )
+
+        with self.subTest("failed upload logged"):
+            self.assertIn(
+                "1 files failed to upload and will be logged for retrying",
+                "".join(log.output),
             )
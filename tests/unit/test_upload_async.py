@@ -0,0 +1,567 @@
+import asyncio
+import os
+from tempfile import TemporaryDirectory
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from botocore.exceptions import ClientError
+import pytest
+
+from s3_upload.utils import upload_async
+
+
+class TestCheckAsyncAvailable(unittest.TestCase):
+    def test_no_error_raised_when_aiobotocore_installed(self):
+        upload_async.check_async_available()
+
+    @patch("s3_upload.utils.upload_async.get_session", None)
+    def test_error_raised_when_aiobotocore_not_installed(self):
+        with pytest.raises(ImportError, match="aiobotocore must be installed"):
+            upload_async.check_async_available()
+
+
+@patch("s3_upload.utils.upload_async.get_session")
+class TestAsyncUpload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.run_dir = os.path.join(self.tmp_dir.name, "run1")
+        os.makedirs(self.run_dir)
+
+        self.local_files = []
+
+        for name in ["RunInfo.xml", "SampleSheet.csv", "CopyComplete.txt"]:
+            local_file = os.path.join(self.run_dir, name)
+            open(local_file, "w").close()
+            self.local_files.append(local_file)
+
+        self.mock_client = MagicMock()
+        self.mock_client.put_object = AsyncMock(
+            side_effect=lambda **kwargs: {"ETag": f"etag-{kwargs['Key']}"}
+        )
+
+        # state of multipart uploads shared with upload.py
+        patcher = patch(
+            "s3_upload.utils.upload_async._MULTIPART_UPLOADS",
+            new_callable=dict,
+        )
+        self.multipart_uploads = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _set_client(self, mock_session):
+        client_context = mock_session.return_value.create_client.return_value
+        client_context.__aenter__.return_value = self.mock_client
+
+    def _write_large_file(self):
+        large_file = os.path.join(self.run_dir, "large.cbcl")
+
+        with open(large_file, "wb") as fh:
+            fh.write(b"a" * 25)
+
+        return large_file
+
+    @staticmethod
+    def _paginate(parts):
+        """Build an async paginate returning the given uploaded parts"""
+
+        async def paginate(**kwargs):
+            yield {"Parts": parts}
+
+        return paginate
+
+    def test_all_files_uploaded_to_correct_keys(self, mock_session):
+        self._set_client(mock_session)
+
+        upload_async.async_upload(
+            files=self.local_files,
+            bucket="test_bucket",
+            remote_path="/sequencer_a",
+            parent_path=self.tmp_dir.name,
+        )
+
+        uploaded_keys = sorted(
+            x.kwargs["Key"] for x in self.mock_client.put_object.call_args_list
+        )
+
+        self.assertEqual(
+            uploaded_keys,
+            [
+                "sequencer_a/run1/CopyComplete.txt",
+                "sequencer_a/run1/RunInfo.xml",
+                "sequencer_a/run1/SampleSheet.csv",
+            ],
+        )
+
+    def test_uploaded_files_and_etags_returned(self, mock_session):
+        self._set_client(mock_session)
+
+        uploaded, failed = upload_async.async_upload(
+            files=self.local_files,
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        expected_uploaded = {
+            x: f"etag-run1/{os.path.basename(x)}" for x in self.local_files
+        }
+
+        with self.subTest("uploaded"):
+            self.assertDictEqual(uploaded, expected_uploaded)
+
+        with self.subTest("failed"):
+            self.assertEqual(failed, [])
+
+    def test_failed_uploads_returned_and_do_not_stop_other_uploads(
+        self, mock_session
+    ):
+        self._set_client(mock_session)
+        missing_file = os.path.join(self.run_dir, "missing.txt")
+
+        uploaded, failed = upload_async.async_upload(
+            files=self.local_files + [missing_file],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        with self.subTest("uploaded"):
+            self.assertEqual(sorted(uploaded), sorted(self.local_files))
+
+        with self.subTest("failed"):
+            self.assertEqual(failed, [missing_file])
+
+    def test_files_read_off_event_loop_and_uploaded_as_bytes(
+        self, mock_session
+    ):
+        self._set_client(mock_session)
+
+        with open(self.local_files[0], "wb") as fh:
+            fh.write(b"run info")
+
+        read_part = upload_async._read_part
+        read_threads = set()
+
+        def record_read(local_file, offset, size):
+            read_threads.add(threading.current_thread())
+
+            return read_part(local_file, offset, size)
+
+        with patch(
+            "s3_upload.utils.upload_async._read_part", side_effect=record_read
+        ):
+            upload_async.async_upload(
+                files=self.local_files[:1],
+                bucket="test_bucket",
+                remote_path="/",
+                parent_path=self.tmp_dir.name,
+            )
+
+        with self.subTest("file contents uploaded"):
+            self.assertEqual(
+                self.mock_client.put_object.call_args.kwargs["Body"],
+                b"run info",
+            )
+
+        with self.subTest("file not read on event loop thread"):
+            self.assertNotIn(threading.main_thread(), read_threads)
+
+    @patch("s3_upload.utils.upload_async.MULTIPART_CHUNKSIZE", 10)
+    @patch("s3_upload.utils.upload_async.LARGE_FILE_THRESHOLD", 20)
+    def test_large_files_uploaded_as_multipart(self, mock_session):
+        self._set_client(mock_session)
+
+        large_file = os.path.join(self.run_dir, "large.cbcl")
+
+        with open(large_file, "wb") as fh:
+            fh.write(b"a" * 25)
+
+        self.mock_client.create_multipart_upload = AsyncMock(
+            return_value={"UploadId": "upload_1"}
+        )
+        self.mock_client.upload_part = AsyncMock(
+            side_effect=lambda **kwargs: {
+                "ETag": f"etag-{kwargs['PartNumber']}"
+            }
+        )
+        self.mock_client.complete_multipart_upload = AsyncMock(
+            return_value={"ETag": '"final_etag"'}
+        )
+
+        uploaded, failed = upload_async.async_upload(
+            files=[large_file],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        with self.subTest("not uploaded in single request"):
+            self.mock_client.put_object.assert_not_called()
+
+        with self.subTest("all parts uploaded"):
+            self.assertEqual(self.mock_client.upload_part.call_count, 3)
+
+        with self.subTest("completed with all parts"):
+            self.assertEqual(
+                self.mock_client.complete_multipart_upload.call_args.kwargs[
+                    "MultipartUpload"
+                ],
+                {
+                    "Parts": [
+                        {"PartNumber": 1, "ETag": "etag-1"},
+                        {"PartNumber": 2, "ETag": "etag-2"},
+                        {"PartNumber": 3, "ETag": "etag-3"},
+                    ]
+                },
+            )
+
+        with self.subTest("etag returned"):
+            self.assertEqual(uploaded, {large_file: "final_etag"})
+
+    @patch("s3_upload.utils.upload_async.MULTIPART_CONCURRENCY", 2)
+    @patch("s3_upload.utils.upload_async.MULTIPART_CHUNKSIZE", 10)
+    @patch("s3_upload.utils.upload_async.LARGE_FILE_THRESHOLD", 20)
+    def test_parts_in_memory_limited_and_read_off_event_loop(
+        self, mock_session
+    ):
+        self._set_client(mock_session)
+
+        large_files = []
+
+        for name in ["large_1.cbcl", "large_2.cbcl"]:
+            large_file = os.path.join(self.run_dir, name)
+
+            with open(large_file, "wb") as fh:
+                fh.write(b"a" * 25)
+
+            large_files.append(large_file)
+
+        # record the most parts held at once, and the threads read from
+        read_threads = set()
+        in_memory = []
+        peak = []
+        read_part = upload_async._read_part
+
+        def record_read(local_file, offset, size):
+            read_threads.add(threading.current_thread())
+            in_memory.append(1)
+            peak.append(len(in_memory))
+
+            return read_part(local_file, offset, size)
+
+        async def upload_part(**kwargs):
+            await asyncio.sleep(0.01)
+            in_memory.pop()
+
+            return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+        self.mock_client.create_multipart_upload = AsyncMock(
+            return_value={"UploadId": "upload_1"}
+        )
+        self.mock_client.upload_part = AsyncMock(side_effect=upload_part)
+        self.mock_client.complete_multipart_upload = AsyncMock(
+            return_value={"ETag": '"final_etag"'}
+        )
+
+        with patch(
+            "s3_upload.utils.upload_async._read_part", side_effect=record_read
+        ):
+            uploaded, failed = upload_async.async_upload(
+                files=large_files,
+                bucket="test_bucket",
+                remote_path="/",
+                parent_path=self.tmp_dir.name,
+            )
+
+        with self.subTest("all parts uploaded"):
+            self.assertEqual(self.mock_client.upload_part.call_count, 6)
+
+        with self.subTest("parts in memory limited"):
+            self.assertEqual(max(peak), 2)
+
+        with self.subTest("parts not read on event loop thread"):
+            self.assertNotIn(threading.main_thread(), read_threads)
+
+    @patch("s3_upload.utils.upload_async.asyncio.sleep")
+    def test_upload_retried_on_transient_error(self, mock_sleep, mock_session):
+        self._set_client(mock_session)
+        self.mock_client.put_object.side_effect = [
+            ClientError({}, "PutObject"),
+            {"ETag": "etag-1"},
+        ]
+
+        uploaded, failed = upload_async.async_upload(
+            files=self.local_files[:1],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        with self.subTest("retried"):
+            self.assertEqual(self.mock_client.put_object.call_count, 2)
+
+        with self.subTest("backed off"):
+            mock_sleep.assert_awaited_once_with(1)
+
+        with self.subTest("uploaded"):
+            self.assertEqual(uploaded, {self.local_files[0]: "etag-1"})
+
+    @patch("s3_upload.utils.upload_async.asyncio.sleep")
+    @patch("s3_upload.utils.upload_async.MULTIPART_CHUNKSIZE", 10)
+    @patch("s3_upload.utils.upload_async.LARGE_FILE_THRESHOLD", 20)
+    def test_state_kept_when_part_fails_to_upload(
+        self, mock_sleep, mock_session
+    ):
+        self._set_client(mock_session)
+        large_file = self._write_large_file()
+
+        async def upload_part(**kwargs):
+            if kwargs["PartNumber"] == 2:
+                raise ClientError({}, "UploadPart")
+
+            return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+        self.mock_client.create_multipart_upload = AsyncMock(
+            return_value={"UploadId": "upload_1"}
+        )
+        self.mock_client.upload_part = AsyncMock(side_effect=upload_part)
+        # parts uploaded on the first attempt are resumed from on retrying
+        paginator = self.mock_client.get_paginator.return_value
+        paginator.paginate = self._paginate(
+            [
+                {"PartNumber": 1, "ETag": "etag-1", "Size": 10},
+                {"PartNumber": 3, "ETag": "etag-3", "Size": 5},
+            ]
+        )
+        self.mock_client.abort_multipart_upload = AsyncMock()
+        self.mock_client.complete_multipart_upload = AsyncMock()
+
+        uploaded, failed = upload_async.async_upload(
+            files=[large_file],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        with self.subTest("file returned as failed"):
+            self.assertEqual(failed, [large_file])
+
+        with self.subTest("upload not aborted"):
+            self.mock_client.abort_multipart_upload.assert_not_called()
+
+        with self.subTest("failed part retried"):
+            self.assertEqual(
+                [
+                    x.kwargs["PartNumber"]
+                    for x in self.mock_client.upload_part.call_args_list
+                ].count(2),
+                upload_async.UPLOAD_ATTEMPTS,
+            )
+
+        with self.subTest("upload not completed"):
+            self.mock_client.complete_multipart_upload.assert_not_called()
+
+        with self.subTest("uploaded parts stored"):
+            self.assertEqual(
+                sorted(
+                    x["PartNumber"]
+                    for x in self.multipart_uploads[large_file]["parts"]
+                ),
+                [1, 3],
+            )
+
+    @patch("s3_upload.utils.upload_async.MULTIPART_CHUNKSIZE", 10)
+    @patch("s3_upload.utils.upload_async.LARGE_FILE_THRESHOLD", 20)
+    def test_previous_upload_resumed_from_uploaded_parts(self, mock_session):
+        self._set_client(mock_session)
+        large_file = self._write_large_file()
+
+        self.multipart_uploads[large_file] = {
+            "bucket": "test_bucket",
+            "key": "run1/large.cbcl",
+            "upload_id": "previous_upload",
+            "part_size": 10,
+            "parts": [],
+        }
+
+        paginator = self.mock_client.get_paginator.return_value
+        paginator.paginate = self._paginate(
+            [
+                {"PartNumber": 1, "ETag": "etag-1", "Size": 10},
+                {"PartNumber": 2, "ETag": "etag-2", "Size": 10},
+            ]
+        )
+        self.mock_client.create_multipart_upload = AsyncMock()
+        self.mock_client.upload_part = AsyncMock(
+            return_value={"ETag": "etag-3"}
+        )
+        self.mock_client.complete_multipart_upload = AsyncMock(
+            return_value={"ETag": '"final_etag"'}
+        )
+
+        uploaded, failed = upload_async.async_upload(
+            files=[large_file],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        with self.subTest("no new upload created"):
+            self.mock_client.create_multipart_upload.assert_not_called()
+
+        with self.subTest("only missing part uploaded"):
+            self.assertEqual(
+                [
+                    x.kwargs["PartNumber"]
+                    for x in self.mock_client.upload_part.call_args_list
+                ],
+                [3],
+            )
+
+        with self.subTest("completed with all parts"):
+            self.assertEqual(
+                self.mock_client.complete_multipart_upload.call_args.kwargs[
+                    "MultipartUpload"
+                ],
+                {
+                    "Parts": [
+                        {"PartNumber": 1, "ETag": "etag-1"},
+                        {"PartNumber": 2, "ETag": "etag-2"},
+                        {"PartNumber": 3, "ETag": "etag-3"},
+                    ]
+                },
+            )
+
+        with self.subTest("state removed on completing"):
+            self.assertNotIn(large_file, self.multipart_uploads)
+
+    @patch("s3_upload.utils.upload_async.MULTIPART_CHUNKSIZE", 10)
+    @patch("s3_upload.utils.upload_async.LARGE_FILE_THRESHOLD", 20)
+    def test_new_upload_created_when_aborting_previous_fails(
+        self, mock_session
+    ):
+        self._set_client(mock_session)
+        large_file = self._write_large_file()
+
+        # part size of the previous upload no longer matches
+        self.multipart_uploads[large_file] = {
+            "bucket": "test_bucket",
+            "key": "run1/large.cbcl",
+            "upload_id": "previous_upload",
+            "part_size": 5,
+            "parts": [],
+        }
+
+        self.mock_client.abort_multipart_upload = AsyncMock(
+            side_effect=ClientError({}, "AbortMultipartUpload")
+        )
+        self.mock_client.create_multipart_upload = AsyncMock(
+            return_value={"UploadId": "upload_1"}
+        )
+        self.mock_client.upload_part = AsyncMock(
+            side_effect=lambda **kwargs: {
+                "ETag": f"etag-{kwargs['PartNumber']}"
+            }
+        )
+        self.mock_client.complete_multipart_upload = AsyncMock(
+            return_value={"ETag": '"final_etag"'}
+        )
+
+        with self.assertLogs("s3_upload", level="ERROR") as log:
+            uploaded, failed = upload_async.async_upload(
+                files=[large_file],
+                bucket="test_bucket",
+                remote_path="/",
+                parent_path=self.tmp_dir.name,
+            )
+
+        with self.subTest("abort error logged"):
+            self.assertIn("previous_upload", "".join(log.output))
+
+        with self.subTest("new upload created"):
+            self.mock_client.create_multipart_upload.assert_awaited_once()
+
+        with self.subTest("uploaded"):
+            self.assertEqual(uploaded, {large_file: "final_etag"})
+
+    def test_unexpected_error_raised(self, mock_session):
+        self._set_client(mock_session)
+        self.mock_client.put_object.side_effect = TypeError("bug")
+
+        with pytest.raises(TypeError, match="bug"):
+            upload_async.async_upload(
+                files=self.local_files,
+                bucket="test_bucket",
+                remote_path="/",
+                parent_path=self.tmp_dir.name,
+            )
+
+    def test_cancelled_upload_raised(self, mock_session):
+        self._set_client(mock_session)
+        self.mock_client.put_object.side_effect = asyncio.CancelledError()
+
+        with pytest.raises(asyncio.CancelledError):
+            upload_async.async_upload(
+                files=self.local_files,
+                bucket="test_bucket",
+                remote_path="/",
+                parent_path=self.tmp_dir.name,
+            )
+
+    @patch("s3_upload.utils.upload_async.AWS_DEFAULT_PROFILE", None)
+    @patch("s3_upload.utils.upload_async.AWS_SECRET_KEY", "bar")
+    @patch("s3_upload.utils.upload_async.AWS_ACCESS_KEY", "foo")
+    def test_client_created_with_access_keys(self, mock_session):
+        self._set_client(mock_session)
+
+        upload_async.async_upload(
+            files=self.local_files,
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        kwargs = mock_session.return_value.create_client.call_args.kwargs
+
+        with self.subTest("access keys passed"):
+            self.assertEqual(
+                (kwargs["aws_access_key_id"], kwargs["aws_secret_access_key"]),
+                ("foo", "bar"),
+            )
+
+        with self.subTest("profile not set"):
+            mock_session.return_value.set_config_variable.assert_not_called()
+
+    @patch("s3_upload.utils.upload_async.AWS_DEFAULT_PROFILE", "baz")
+    @patch("s3_upload.utils.upload_async.AWS_SECRET_KEY", None)
+    @patch("s3_upload.utils.upload_async.AWS_ACCESS_KEY", None)
+    def test_client_created_with_profile(self, mock_session):
+        self._set_client(mock_session)
+
+        upload_async.async_upload(
+            files=self.local_files,
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        mock_session.return_value.set_config_variable.assert_called_once_with(
+            "profile", "baz"
+        )
+
+    def test_no_client_created_for_empty_file_list(self, mock_session):
+        uploaded, failed = upload_async.async_upload(
+            files=[],
+            bucket="test_bucket",
+            remote_path="/",
+            parent_path=self.tmp_dir.name,
+        )
+
+        with self.subTest("no client"):
+            mock_session.assert_not_called()
+
+        with self.subTest("empty results"):
+            self.assertEqual((uploaded, failed), ({}, []))
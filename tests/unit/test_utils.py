@@ -4,7 +4,7 @@ import re
 from shutil import copyfile, rmtree
 from uuid import uuid4
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import pytest
 
@@ -67,6 +67,25 @@ class TestCheckTerminationFileExists(unittest.TestCase):
             utils.check_termination_file_exists(self.test_run_dir)
         )
 
+    @patch("s3_upload.utils.utils.path.exists")
+    def test_listed_file_names_used_in_place_of_file_system(self, mock_exists):
+        with self.subTest("complete"):
+            self.assertTrue(
+                utils.check_termination_file_exists(
+                    self.test_run_dir, file_names={"RTAComplete.xml"}
+                )
+            )
+
+        with self.subTest("incomplete"):
+            self.assertFalse(
+                utils.check_termination_file_exists(
+                    self.test_run_dir, file_names={"RunInfo.xml"}
+                )
+            )
+
+        with self.subTest("file system not checked"):
+            mock_exists.assert_not_called()
+
 
 class TestCheckIsSequencingRunDir(unittest.TestCase):
     @classmethod
@@ -126,6 +145,56 @@ class TestCheckRunAgeWithinLimit(unittest.TestCase):
         )
 
 
+class TestCheckUploadStateFromWrittenLog(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = os.path.join(TEST_DATA_DIR, uuid4().hex)
+        os.makedirs(os.path.join(self.log_dir, "uploads"))
+
+        self.log_file = os.path.join(
+            self.log_dir, "uploads", "test_run.upload.log.json"
+        )
+
+    def tearDown(self):
+        rmtree(self.log_dir)
+
+    def _write(self, uploaded_files, failed_files):
+        io.write_upload_state_to_log(
+            run_id="test_run",
+            run_path="/some/path/seq1/test_run",
+            log_file=self.log_file,
+            local_files=["file1.txt", "file2.txt"],
+            uploaded_files=uploaded_files,
+            failed_files=failed_files,
+        )
+
+    def test_failed_reupload_of_completed_run_returned_as_partial(self):
+        self._write(
+            uploaded_files={"file1.txt": "abc123", "file2.txt": "def456"},
+            failed_files=[],
+        )
+        self._write(
+            uploaded_files={"file1.txt": "ghi789"},
+            failed_files=["file2.txt"],
+        )
+
+        upload_state, uploaded_files = utils.check_upload_state(
+            run_dir="/some/path/seq1/test_run", log_dir=self.log_dir
+        )
+
+        with self.subTest("completed marker removed"):
+            self.assertFalse(
+                os.path.exists(io.get_completed_marker(self.log_file))
+            )
+
+        with self.subTest("partial returned"):
+            self.assertEqual(upload_state, "partial")
+
+        with self.subTest("uploaded files read from log"):
+            self.assertEqual(
+                uploaded_files, {"file1.txt": "ghi789", "file2.txt": "def456"}
+            )
+
+
 @patch("s3_upload.utils.utils.path.exists")
 @patch("s3_upload.utils.utils.read_upload_state_log")
 class TestCheckUploadState(unittest.TestCase):
@@ -148,13 +217,13 @@ class TestCheckUploadState(unittest.TestCase):
         with self.subTest("correct string returned"):
             self.assertEqual(upload_state, "new")
 
-        with self.subTest("empty file list returned"):
-            self.assertEqual(uploaded_files, [])
+        with self.subTest("empty file mapping returned"):
+            self.assertEqual(uploaded_files, {})
 
     def test_uploaded_returned_for_run_that_has_uploaded(
         self, mock_log, mock_exists
     ):
-        mock_exists.return_value = True
+        mock_exists.side_effect = lambda x: not x.endswith(".completed")
 
         mock_log.return_value = {
             "run_id": "test_run",
@@ -170,14 +239,37 @@ class TestCheckUploadState(unittest.TestCase):
         with self.subTest("uploaded run correctly returned"):
             self.assertEqual(upload_state, "uploaded")
 
-        with self.subTest("correct file list returned"):
-            self.assertEqual(uploaded_files, ["file1.txt", "file2.txt"])
+        with self.subTest("correct file mapping returned"):
+            self.assertEqual(
+                uploaded_files, {"file1.txt": "abc123", "file2.txt": "def456"}
+            )
 
-    def test_partial_returned_for_run_that_has_not_fully_uploaded(
+    def test_log_not_read_for_run_with_completed_marker(
         self, mock_log, mock_exists
     ):
         mock_exists.return_value = True
 
+        upload_state, uploaded_files = utils.check_upload_state(
+            run_dir="/some/path/to/test_run"
+        )
+
+        with self.subTest("uploaded run correctly returned"):
+            self.assertEqual((upload_state, uploaded_files), ("uploaded", {}))
+
+        with self.subTest("marker checked"):
+            self.assertEqual(
+                mock_exists.call_args[0][0],
+                "/var/log/s3_upload/uploads/test_run.upload.log.json.completed",
+            )
+
+        with self.subTest("log not read"):
+            mock_log.assert_not_called()
+
+    def test_partial_returned_for_run_that_has_not_fully_uploaded(
+        self, mock_log, mock_exists
+    ):
+        mock_exists.side_effect = lambda x: not x.endswith(".completed")
+
         mock_log.return_value = {
             "run_id": "test_run",
             "run_path": "/some/path/to/test_run",
@@ -192,8 +284,10 @@ class TestCheckUploadState(unittest.TestCase):
         with self.subTest("partial correctly returned"):
             self.assertEqual(upload_state, "partial")
 
-        with self.subTest("correct file list returned"):
-            self.assertEqual(uploaded_files, ["file1.txt", "file2.txt"])
+        with self.subTest("correct file mapping returned"):
+            self.assertEqual(
+                uploaded_files, {"file1.txt": "abc123", "file2.txt": "def456"}
+            )
 
 
 @patch("s3_upload.utils.utils.get_samplenames_from_samplesheet")
@@ -312,6 +406,27 @@ class TestGetRunsToUpload(unittest.TestCase):
 
         rmtree(sequencer_output_dir)
 
+    def test_all_monitored_directories_checked(self):
+        monitored_dirs = [
+            os.path.join(TEST_DATA_DIR, uuid4().hex) for _ in range(3)
+        ]
+
+        for monitored_dir in monitored_dirs:
+            os.makedirs(os.path.join(monitored_dir, "myRun"), exist_ok=True)
+
+        with self.assertLogs("s3_upload", level="DEBUG") as log:
+            utils.get_runs_to_upload(monitored_dirs)
+
+        for monitored_dir in monitored_dirs:
+            with self.subTest(monitored_dir):
+                self.assertIn(
+                    f"{os.path.join(monitored_dir, 'myRun')} is not a"
+                    " sequencing run",
+                    "".join(log.output),
+                )
+
+            rmtree(monitored_dir)
+
     def test_incomplete_sequencing_runs_are_skipped(self):
         """
         Incomplete run determined from presence of just having RunInfo.xml
@@ -662,6 +777,53 @@ class TestGetRunsToUpload(unittest.TestCase):
         rmtree(sequencer_output_dir)
 
 
+class TestListMonitoredDirectories(unittest.TestCase):
+    def setUp(self):
+        self.monitored_dir = os.path.join(TEST_DATA_DIR, uuid4().hex)
+        os.makedirs(os.path.join(self.monitored_dir, "run_1"))
+
+    def tearDown(self):
+        rmtree(self.monitored_dir)
+
+    def test_directory_monitored_twice_only_scanned_once(self):
+        with patch(
+            "s3_upload.utils.utils.scandir", wraps=os.scandir
+        ) as mock_scandir:
+            sub_directories = utils.list_monitored_directories(
+                [self.monitored_dir, self.monitored_dir]
+            )
+
+        with self.subTest("sub directories returned"):
+            self.assertEqual(
+                sub_directories,
+                {
+                    self.monitored_dir: [
+                        os.path.join(self.monitored_dir, "run_1")
+                    ]
+                },
+            )
+
+        with self.subTest("scanned once"):
+            self.assertEqual(mock_scandir.call_count, 1)
+
+    def test_changed_directory_scanned_again(self):
+        utils.list_monitored_directories([self.monitored_dir])
+
+        os.makedirs(os.path.join(self.monitored_dir, "run_2"))
+
+        self.assertEqual(
+            sorted(
+                utils.list_monitored_directories([self.monitored_dir])[
+                    self.monitored_dir
+                ]
+            ),
+            [
+                os.path.join(self.monitored_dir, "run_1"),
+                os.path.join(self.monitored_dir, "run_2"),
+            ],
+        )
+
+
 class TestGetSequencingFileList(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -725,6 +887,23 @@ class TestGetSequencingFileList(unittest.TestCase):
 
         self.assertEqual(returned_file_list, expected_file_list)
 
+    @patch("s3_upload.utils.utils._scan_files")
+    def test_files_not_stat_when_not_sorting_by_size(self, mock_scan):
+        entries = [Mock(path=f"file{x}.txt") for x in range(3)]
+        mock_scan.return_value = iter(entries)
+
+        returned_file_list = utils.get_sequencing_file_list(
+            seq_dir=self.test_run_dir, sort_by_size=False
+        )
+
+        with self.subTest("all files returned in order found"):
+            self.assertEqual(
+                returned_file_list, ["file0.txt", "file1.txt", "file2.txt"]
+            )
+
+        with self.subTest("files not stat"):
+            self.assertFalse(any(x.stat.called for x in entries))
+
     def test_empty_directories_ignored_and_only_files_returned(self):
         empty_dir = os.path.join(self.test_run_dir, "empty_dir")
         os.makedirs(
@@ -747,6 +926,24 @@ class TestGetSequencingFileList(unittest.TestCase):
 
         rmtree(empty_dir)
 
+    def test_symlinked_directories_not_followed(self):
+        linked_dir = os.path.join(self.test_run_dir, "linked_dir")
+        os.symlink(os.path.join(self.test_run_dir, "Logs"), linked_dir)
+
+        returned_file_list = utils.get_sequencing_file_list(
+            seq_dir=self.test_run_dir
+        )
+
+        os.remove(linked_dir)
+
+        self.assertEqual(
+            sorted(returned_file_list),
+            sorted(
+                os.path.join(self.test_run_dir, x[0])
+                for x in self.sequencing_files
+            ),
+        )
+
     def test_exclude_patterns_removes_matching_files(self):
         """
         Test that both patterns of filenames and / or directory names
@@ -815,6 +1012,23 @@ class TestGetSequencingFileList(unittest.TestCase):
                     sorted(returned_file_list), sorted(expected_files)
                 )
 
+    def test_compiled_exclude_patterns_remove_matching_files(self):
+        returned_file_list = utils.get_sequencing_file_list(
+            seq_dir=self.test_run_dir,
+            exclude_patterns=[re.compile(".*png$"), re.compile("Logs/")],
+        )
+
+        expected_files = [
+            "Data/Intensities/BaseCalls/L002/C1.1/L002_2.cbcl",
+            "Data/Intensities/BaseCalls/L001/C1.1/L001_2.cbcl",
+            "InterOp/C1.1/BasecallingMetricsOut.bin",
+        ]
+
+        self.assertEqual(
+            returned_file_list,
+            [os.path.join(self.test_run_dir, x) for x in expected_files],
+        )
+
     def test_file_not_found_error_raised_on_invalid_directory_provided(self):
         invalid_dir = os.path.join(TEST_DATA_DIR, uuid4().hex)
         expected_error = f"Provided directory does not exist: {invalid_dir}"
@@ -903,47 +1117,22 @@ class TestFilterUploadedFiles(unittest.TestCase):
 
         self.assertEqual(to_upload, ["file3.txt"])
 
+    def test_order_of_local_files_kept(self):
+        local_files = ["file5.txt", "file1.txt", "file4.txt", "file2.txt"]
 
-class TestSplitFileListByCores(unittest.TestCase):
-    items = [1, 2, 3, 4, 5, 6, 7, 8, 100, 110, 120, 130, 140, 150, 160, 170]
-
-    def test_list_split_as_expected(self):
-
-        returned_split_list = utils.split_file_list_by_cores(
-            files=self.items, n=4
+        to_upload = utils.filter_uploaded_files(
+            local_files=local_files, uploaded_files=["file1.txt"]
         )
 
-        expected_list = [
-            [1, 5, 100, 140],
-            [2, 6, 110, 150],
-            [3, 7, 120, 160],
-            [4, 8, 130, 170],
-        ]
+        self.assertEqual(to_upload, ["file5.txt", "file4.txt", "file2.txt"])
 
-        self.assertEqual(returned_split_list, expected_list)
-
-    def test_correct_return_when_file_length_not_exact_multiple_of_n(self):
-        returned_split_list = utils.split_file_list_by_cores(
-            files=self.items, n=3
+    def test_mapping_of_uploaded_files_accepted(self):
+        to_upload = utils.filter_uploaded_files(
+            local_files=["file1.txt", "file2.txt"],
+            uploaded_files={"file1.txt": "abc123"},
         )
 
-        expected_list = [
-            [1, 4, 7, 110, 140, 170],
-            [2, 5, 8, 120, 150],
-            [3, 6, 100, 130, 160],
-        ]
-
-        self.assertEqual(returned_split_list, expected_list)
-
-    def test_error_not_raised_when_n_greater_than_total_files(self):
-        returned_split_list = utils.split_file_list_by_cores(files=[1, 2], n=3)
-
-        self.assertEqual([[1], [2]], returned_split_list)
-
-    def test_empty_file_list_returns_empty_list(self):
-        returned_split_list = utils.split_file_list_by_cores(files=[], n=2)
-
-        self.assertEqual([], returned_split_list)
+        self.assertEqual(to_upload, ["file2.txt"])
 
 
 class TestParseConfig(unittest.TestCase):
@@ -1054,6 +1243,92 @@ class TestVerifyConfig(unittest.TestCase):
         with pytest.raises(RuntimeError, match=re.escape(expected_error)):
             utils.verify_config(invalid_config)
 
+    def test_regex_patterns_compiled_in_place(self):
+        config = {
+            "monitor": [
+                {
+                    "monitored_directories": ["/path/to/sequencer_1"],
+                    "bucket": "bucket_A",
+                    "remote_path": "/",
+                    "sample_regex": "_assay_1_",
+                    "exclude_patterns": [".*png$", "Logs/"],
+                },
+            ],
+        }
+
+        utils.verify_config(config)
+
+        with self.subTest("sample regex compiled"):
+            self.assertEqual(
+                config["monitor"][0]["sample_regex"], re.compile("_assay_1_")
+            )
+
+        with self.subTest("exclude patterns compiled"):
+            self.assertEqual(
+                config["monitor"][0]["exclude_patterns"],
+                [re.compile(".*png$"), re.compile("Logs/")],
+            )
+
+    def test_invalid_exclude_pattern_raises_runtime_error(self):
+        invalid_config = {
+            "monitor": [
+                {
+                    "monitored_directories": ["/path/to/sequencer_1"],
+                    "bucket": "bucket_A",
+                    "remote_path": "/",
+                    "exclude_patterns": ["Logs/", "[png"],
+                },
+            ],
+        }
+
+        expected_error = (
+            "1 errors found in config:\n\tInvalid exclude pattern provided"
+            " in monitor section 0: [png"
+        )
+
+        with pytest.raises(RuntimeError, match=re.escape(expected_error)):
+            utils.verify_config(invalid_config)
+
+    def test_non_integer_http_send_buffer_bytes_raises_runtime_error(self):
+        invalid_config = {
+            "http_send_buffer_bytes": "1MB",
+            "monitor": [
+                {
+                    "monitored_directories": ["/path/to/sequencer_1"],
+                    "bucket": "bucket_A",
+                    "remote_path": "/",
+                },
+            ],
+        }
+
+        expected_error = (
+            "1 errors found in config:\n\thttp_send_buffer_bytes must be an"
+            " integer"
+        )
+
+        with pytest.raises(RuntimeError, match=re.escape(expected_error)):
+            utils.verify_config(invalid_config)
+
+    def test_invalid_upload_mode_raises_runtime_error(self):
+        invalid_config = {
+            "upload_mode": "processes",
+            "monitor": [
+                {
+                    "monitored_directories": ["/path/to/sequencer_1"],
+                    "bucket": "bucket_A",
+                    "remote_path": "/",
+                },
+            ],
+        }
+
+        expected_error = (
+            "1 errors found in config:\n\tupload_mode must be one of:"
+            " threads, async"
+        )
+
+        with pytest.raises(RuntimeError, match=re.escape(expected_error)):
+            utils.verify_config(invalid_config)
+
 
 class TestSizeofFmt(unittest.TestCase):
     def test_expected_value_and_suffix_returned(self):